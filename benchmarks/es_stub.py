@@ -0,0 +1,82 @@
+"""Minimal Elasticsearch stub server, answering just enough of the API for the `Elastic` save path.
+
+Documents are not stored: every document is reported as not found by _mget and every bulk action succeeds, so the
+benchmark measures the client side of saving (serialization, chunking, threads and HTTP) rather than a cluster.
+"""
+import json
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class ElasticStub:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.__server = ThreadingHTTPServer((host, port), _RequestHandler)
+        self.__server.daemon_threads = True
+        self.__thread = Thread(target=self.__server.serve_forever, name='es-stub', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.__server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?')[0].strip('/').split('/')
+        if path == ['']:
+            return self.__respond({'version': {'number': '8.4.3'}, 'tagline': 'You Know, for Search'})
+        if len(path) > 1 and path[1] == '_settings':
+            return self.__respond({path[0]: {'settings': {}}})
+        self.__respond({path[0]: {}})
+
+    def do_HEAD(self):
+        self.__respond(None)
+
+    def do_POST(self):
+        path = self.path.split('?')[0].strip('/').split('/')
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if path[-1] == '_bulk':
+            return self.__respond(self.__bulk(body))
+        if path[-1] == '_mget':
+            ids = json.loads(body).get('ids', [])
+            return self.__respond({'docs': [{'_index': path[0], '_id': i, 'found': False} for i in ids]})
+        self.__respond({'acknowledged': True, '_shards': {'total': 1, 'successful': 1, 'failed': 0}})
+
+    do_PUT = do_POST
+
+    def log_message(self, format: str, *args):
+        pass
+
+    @staticmethod
+    def __bulk(body: bytes) -> dict:
+        items = []
+        lines = iter(filter(None, body.split(b'\n')))
+        for line in lines:
+            op_type, meta = json.loads(line).popitem()
+            if op_type != 'delete':
+                next(lines)  # skip document source
+            items.append({op_type: {'_index': meta.get('_index'), '_id': meta.get('_id'), 'status': 200,
+                                    'result': 'updated'}})
+
+        return {'took': 1, 'errors': False, 'items': items}
+
+    def __respond(self, data):
+        content = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Offline benchmarks of parsing, calendar math and persistence hot paths.
+
+Every benchmark runs against fixture payloads in benchmarks/fixtures, so no API requests are made. Elasticsearch saves
+go to a local stub server. Reports the median time per operation and the peak memory allocated by one operation, and
+compares both with a stored baseline.
+
+Usage:
+    run.py [--repeat=<repeat>] [--baseline=<baseline>] [--save] [--tolerance=<tolerance>] [<name>...]
+
+Options:
+    --repeat=<repeat>        Number of timed runs of each benchmark [default: 7]
+    --baseline=<baseline>    Baseline file [default: benchmarks/baseline.json]
+    --save                   Save results as the new baseline
+    --tolerance=<tolerance>  Percentage a benchmark may be slower than its baseline before it fails [default: 10]
+"""
+import copy
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import tracemalloc
+
+from datetime import datetime
+from docopt import docopt
+from time import perf_counter
+from urllib.parse import parse_qs, urlparse
+
+BENCHMARKS_PATH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_PATH))
+
+import stl.endpoint.base_endpoint  # noqa: E402
+from es_stub import ElasticStub  # noqa: E402
+from stl.endpoint.calendar import Calendar, Pricing  # noqa: E402
+from stl.endpoint.explore import Explore  # noqa: E402
+from stl.endpoint.pdp import Pdp  # noqa: E402
+from stl.endpoint.reviews import Reviews  # noqa: E402
+from stl.persistence.csv import Csv  # noqa: E402
+from stl.scraper.airbnb_scraper import AirbnbSearchScraper  # noqa: E402
+
+LOGGER = logging.getLogger('benchmarks')
+N_LISTINGS = 200  # listings per save
+N_PAGES = 5  # search result pages per end-to-end search
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(BENCHMARKS_PATH, 'fixtures', '{}.json'.format(name))) as f:
+        return json.load(f)
+
+
+def get_listings(n: int) -> list:
+    """Parse n listings from fixtures, as scraped by a search."""
+    pdp = Pdp(None, 'USD', LOGGER)
+    explore = load_fixture('explore')
+    geography = explore['data']['dora']['exploreV3']['metadata']['geography']
+    data_cache = {}
+    listing_ids = pdp.collect_listings_from_sections(explore, geography, data_cache)
+    reviews, _ = Reviews.parse_reviews(load_fixture('reviews'))
+    response = load_fixture('pdp')
+    listings = []
+    for i in range(n):
+        listing_id = listing_ids[i % len(listing_ids)]
+        response['data']['merlin']['pdpSections']['id'] = str(int(listing_id) + i)
+        listings.append(
+            pdp.parse_listing(str(int(listing_id) + i), response, data_cache[listing_id], geography, reviews))
+
+    return listings
+
+
+class ReplayResponse:
+    def __init__(self, data: dict):
+        self.status_code = 200
+        self.__data = data
+
+    @property
+    def text(self) -> str:
+        return json.dumps(self.__data)
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode('utf-8')
+
+    def json(self) -> dict:
+        return json.loads(self.text)  # decode like a real response would
+
+
+class ReplaySession:
+    """Stand-in for the endpoints' requests session, answering with fixture payloads."""
+
+    def __init__(self, n_pages: int):
+        self.__explore = load_fixture('explore')
+        self.__n_pages = n_pages
+        self.__page = 0
+        self.__pdp = load_fixture('pdp')
+        self.__reviews = load_fixture('reviews')
+
+    def request(self, method: str, url: str, headers: dict = None, data=None, timeout=None) -> ReplayResponse:
+        operation = urlparse(url).path.rsplit('/', 1)[-1]
+        if operation == 'ExploreSearch':
+            self.__page += 1
+            page = copy.deepcopy(self.__explore)
+            explore = page['data']['dora']['exploreV3']
+            for section in explore['sections']:
+                for item in section['items']:
+                    item['listing']['id'] = str(int(item['listing']['id']) + self.__page * 1000)
+            explore['metadata']['paginationMetadata']['hasNextPage'] = self.__page <= self.__n_pages
+            return ReplayResponse(page)
+        if operation == 'PdpPlatformSections':
+            variables = json.loads(parse_qs(urlparse(url).query)['variables'][0])
+            self.__pdp['data']['merlin']['pdpSections']['id'] = variables['request']['id']
+            return ReplayResponse(self.__pdp)
+        if operation == 'PdpReviews':
+            return ReplayResponse(self.__reviews)
+
+        raise ValueError('No fixture for {}'.format(url))
+
+
+def bench_collect_listings():
+    pdp = Pdp(None, 'USD', LOGGER)
+    explore = load_fixture('explore')
+    geography = explore['data']['dora']['exploreV3']['metadata']['geography']
+    return lambda: pdp.collect_listings_from_sections(explore, geography, {})
+
+
+def bench_parse_listing_contents():
+    pdp = Pdp(None, 'USD', LOGGER)
+    explore = load_fixture('explore')
+    geography = explore['data']['dora']['exploreV3']['metadata']['geography']
+    data_cache = {}
+    listing_id = pdp.collect_listings_from_sections(explore, geography, data_cache)[0]
+    reviews, _ = Reviews.parse_reviews(load_fixture('reviews'))
+    response = load_fixture('pdp')
+    return lambda: pdp._Pdp__parse_listing_contents(response, data_cache[listing_id], geography, reviews)
+
+
+def bench_parse_reviews():
+    response = load_fixture('reviews')
+    return lambda: Reviews.parse_reviews(response)
+
+
+def bench_get_booking_calendar():
+    calendar = Calendar(None, 'USD', LOGGER, Pricing(None, 'USD', LOGGER))
+    calendar._Calendar__today = datetime(2023, 5, 31)  # day before the first fixture date
+    response = load_fixture('calendar')
+    return lambda: calendar._Calendar__get_booking_calendar(response)
+
+
+def bench_get_date_ranges():
+    calendar = Calendar(None, 'USD', LOGGER, Pricing(None, 'USD', LOGGER))
+    calendar._Calendar__today = datetime(2023, 5, 31)
+    booking_calendar, _, _ = calendar._Calendar__get_booking_calendar(load_fixture('calendar'))
+    return lambda: (Calendar.get_date_ranges('available', booking_calendar),
+                    Calendar.get_date_ranges('booked', booking_calendar))
+
+
+def bench_normalize_pricing():
+    price_breakdown = load_fixture('pricing')
+    return lambda: Pricing._Pricing__normalize_pricing(price_breakdown, 7)
+
+
+def bench_csv_save():
+    listings = get_listings(N_LISTINGS)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.csv')
+
+    def save():
+        persistence = Csv(path)
+        persistence.save('bench', listings)
+        persistence.close()
+
+    return save
+
+
+def bench_elastic_save(es_url: str):
+    from elasticsearch import Elasticsearch
+    from stl.persistence.elastic import Elastic
+
+    listings = get_listings(N_LISTINGS)
+    persistence = Elastic(Elasticsearch(es_url), 'bench', LOGGER)
+    return lambda: persistence.save('bench', listings)
+
+
+def bench_search_end_to_end():
+    def search():
+        session = ReplaySession(N_PAGES)
+        explore, pdp, reviews = Explore(None, 'USD', LOGGER), Pdp(None, 'USD', LOGGER), Reviews(None, 'USD', LOGGER)
+        for endpoint in [explore, pdp, reviews]:
+            endpoint._session = session
+        persistence = Csv(os.path.join(tempfile.mkdtemp(), 'search.csv'))
+        AirbnbSearchScraper(explore, pdp, reviews, persistence, LOGGER).run('San Diego, CA', {})
+        persistence.close()
+
+    stl.endpoint.base_endpoint.sleep = lambda seconds: None  # no request throttling for replayed responses
+    return search
+
+
+def measure(fn, repeat: int) -> dict:
+    """Time fn, running it as many times per run as fit in about 0.2s, and measure peak memory of one call."""
+    fn()  # warm up
+    number = 1
+    started_at = perf_counter()
+    fn()
+    elapsed = perf_counter() - started_at
+    if elapsed < 0.2:
+        number = max(1, int(0.2 / max(elapsed, 1e-7)))
+
+    times = []
+    for _ in range(repeat):
+        started_at = perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((perf_counter() - started_at) / number)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'time_ms': statistics.median(times) * 1000, 'peak_kib': peak / 1024}
+
+
+def main():
+    args = docopt(__doc__)
+    logging.basicConfig(level=logging.WARNING)
+    baseline_path = args['--baseline']
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+    with ElasticStub() as es_stub:
+        benchmarks = {
+            'pdp.collect_listings_from_sections': bench_collect_listings,
+            'pdp.parse_listing_contents':         bench_parse_listing_contents,
+            'reviews.parse_reviews':              bench_parse_reviews,
+            'calendar.get_booking_calendar':      bench_get_booking_calendar,
+            'calendar.get_date_ranges':           bench_get_date_ranges,
+            'pricing.normalize_pricing':          bench_normalize_pricing,
+            'csv.save':                           bench_csv_save,
+            'elastic.save':                       lambda: bench_elastic_save(es_stub.url),
+            'search.end_to_end':                  bench_search_end_to_end,
+        }
+        names = args['<name>'] or list(benchmarks)
+        results = {}
+        n_regressions = 0
+        print('{:<36} {:>12} {:>12} {:>10} {:>10}'.format('benchmark', 'time (ms)', 'peak (KiB)', 'time', 'memory'))
+        for name in names:
+            results[name] = result = measure(benchmarks[name](), int(args['--repeat']))
+            time_change = memory_change = ''
+            if name in baseline:
+                time_ratio = result['time_ms'] / baseline[name]['time_ms'] - 1
+                memory_ratio = result['peak_kib'] / baseline[name]['peak_kib'] - 1 if baseline[name]['peak_kib'] else 0
+                time_change, memory_change = '{:+.1%}'.format(time_ratio), '{:+.1%}'.format(memory_ratio)
+                if time_ratio * 100 > float(args['--tolerance']):
+                    n_regressions += 1
+                    time_change += ' !'
+            print('{:<36} {:>12.3f} {:>12.1f} {:>10} {:>10}'.format(
+                name, result['time_ms'], result['peak_kib'], time_change, memory_change))
+
+    if args['--save']:
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline | results, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print('Saved baseline to {}'.format(baseline_path))
+
+    if n_regressions:
+        print('{} benchmarks slower than baseline by more than {}%'.format(n_regressions, args['--tolerance']))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Measure CLI startup time and which heavy modules each subcommand loads.
+
+Every scenario runs in a fresh interpreter, imports `stl.command.stl_command` and sets up what the subcommand needs
+before it makes its first request. No requests are made.
+
+Usage:
+    startup.py [--runs=<runs>]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from docopt import docopt
+from time import perf_counter
+
+PROJECT_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+HEAVY_MODULES = ['elasticsearch', 'elastic_transport', 'geopy', 'lxml', 'pyarrow', 'pycountry', 'sqlite3']
+SCENARIOS = {
+    'help':    '',
+    'pricing': 'from stl.endpoint.calendar import Pricing; Pricing("", "USD", logger)',
+    'data':    'from stl.endpoint.pdp import Pdp; Pdp("", "USD", logger)',
+    'search':  'from stl.endpoint.pdp import Pdp; from stl.persistence.csv import Csv; Pdp("", "USD", logger)',
+}
+SNIPPET = """
+import json, logging, sys
+from time import perf_counter
+started_at = perf_counter()
+from stl.command.stl_command import StlCommand
+logger = logging.getLogger()
+{setup}
+print(json.dumps({{
+    'seconds': perf_counter() - started_at,
+    'heavy':   sorted(m for m in {heavy!r} if m in sys.modules),
+}}))
+"""
+
+
+def run_scenario(setup: str) -> tuple:
+    """Run scenario in a fresh interpreter, return (total seconds, import seconds, heavy modules loaded)."""
+    started_at = perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', SNIPPET.format(setup=setup, heavy=HEAVY_MODULES)],
+        cwd=PROJECT_PATH, check=True, capture_output=True, text=True
+    ).stdout
+    result = json.loads(output)
+
+    return perf_counter() - started_at, result['seconds'], result['heavy']
+
+
+def main():
+    args = docopt(__doc__)
+    runs = int(args['--runs'] or 10)
+    print('{:<10} {:>12} {:>12}  {}'.format('command', 'total (ms)', 'import (ms)', 'heavy modules loaded'))
+    for name, setup in SCENARIOS.items():
+        results = [run_scenario(setup) for _ in range(runs)]
+        print('{:<10} {:>12.1f} {:>12.1f}  {}'.format(
+            name,
+            statistics.median(r[0] for r in results) * 1000,
+            statistics.median(r[1] for r in results) * 1000,
+            ', '.join(results[-1][2]) or '-'
+        ))
+
+
+if __name__ == '__main__':
+    main()
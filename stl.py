@@ -9,7 +9,9 @@ def main():
     load_dotenv()
     try:
         arguments = docopt(str(StlCommand.__doc__))
-        StlCommand(arguments).execute()
+        output = StlCommand(arguments).execute()
+        if output is not None:
+            print(output)
     except DocoptExit as de:
         print(de)
         exit(1)
@@ -1,20 +1,29 @@
 import json
 import logging
 import os
+import signal
 import sys
 
-from elasticsearch import Elasticsearch
-from elastic_transport import ConnectionError
+from docopt import docopt
 from logging import Logger
+from threading import RLock, Thread
+from time import perf_counter
+from typing import Callable
 
 from stl.endpoint.calendar import Calendar, Pricing
 from stl.endpoint.explore import Explore
+from stl.endpoint.hedging import HedgePolicy
 from stl.endpoint.pdp import Pdp
+from stl.endpoint.pricing_planner import QuoteCache
 from stl.endpoint.reviews import Reviews
-from stl.persistence.csv import Csv
-from stl.persistence.elastic import Elastic
-from stl.persistence import PersistenceInterface
+from stl.metrics.request_metrics import request_metrics
+from stl.metrics.stage_timer import stage_timer
+from stl.persistence.calendar_snapshots import CalendarSnapshotStore
+from stl.persistence.response_archive import ResponseArchive
+from stl.persistence.write_behind import WriteBehind
+from stl.persistence import CalendarPersistenceInterface, PersistenceInterface
 from stl.scraper.airbnb_scraper import AirbnbSearchScraper, AirbnbCalendarScraper, AirbnbScraperInterface
+from stl.scraper.refresh_scheduler import RefreshScheduler
 
 
 class StlCommand:
@@ -22,10 +31,21 @@ class StlCommand:
 
 Usage:
     stl.py search <query> [--checkin=<checkin> --checkout=<checkout> [--priceMin=<priceMin>] [--priceMax=<priceMax>]] \
-[--roomTypes=<roomTypes>] [--storage=<storage>] [-v|--verbose]
-    stl.py calendar (<listingId> | --all) [--updated=<updated>]
+[--roomTypes=<roomTypes>] [--storage=<storage>] [--archive=<archive>] [--profile=<profile>] [-v|--verbose]
+    stl.py calendar (<listingId> | --all) [--updated=<updated>] [--workers=<workers>] [--budget=<budget>] \
+[--profile=<profile>]
     stl.py pricing <listingId> --checkin=<checkin> --checkout=<checkout>
     stl.py data <listingId>
+    stl.py reparse [--archive=<archive>] [--workers=<workers>] [--storage=<storage>] [--profile=<profile>] \
+[-v|--verbose]
+    stl.py serve [--host=<host>] [--port=<port>] [--socket=<socket>] [--workers=<workers>] [-v|--verbose]
+    stl.py enqueue calendar (--all | <listingIds>...) [--updated=<updated>] [--budget=<budget>] [--queue=<queue>]
+    stl.py enqueue search <queries>... [--checkin=<checkin> --checkout=<checkout> [--priceMin=<priceMin>] \
+[--priceMax=<priceMax>]] [--roomTypes=<roomTypes>] [--queue=<queue>]
+    stl.py worker (calendar | search) [--workers=<workers>] [--storage=<storage>] [--queue=<queue>] [--wait] \
+[--profile=<profile>] [-v|--verbose]
+    stl.py mock [--host=<host>] [--port=<port>] [--listings=<listings>] [--latency=<latency>] [--errors=<errors>] \
+[--rateLimit=<rateLimit>] [--seed=<seed>] [-v|--verbose]
 
 Arguments:
     <query>          The query string to search (e.g. "San Diego, CA")
@@ -38,18 +58,44 @@ Options:
     --priceMax=<priceMax>  Maximum nightly or monthly price
     --updated=<updated>    Only update listings not updated in given period. Prevents updating listings that have been \
 recently updated. [default: 1d]
-    --all                  Update calendar for all listings (requires Elasticsearch backend)
+    --all                  Update calendar for all listings (requires Elasticsearch, Parquet or SQLite backend)
+    --workers=<workers>    Number of listings to update concurrently when using "--all", or number of processes \
+re-parsing archived responses, or number of jobs run concurrently by "serve" [default: 1]
+    --host=<host>          Host to serve job API or mock API on (default: SERVICE_HOST or 127.0.0.1)
+    --port=<port>          Port to serve job API on (default: SERVICE_PORT or 8765), or mock API on (default: 8766)
+    --socket=<socket>      Serve job API on given Unix socket instead
+    --queue=<queue>        Work queue database file shared by "enqueue" and "worker" (default: LEASE_QUEUE_PATH or \
+./stl-queue.sqlite)
+    --wait                 Keep waiting for new tasks once the work queue is drained
+    --budget=<budget>      Maximum number of API requests to spend when using "--all". Listings are refreshed in \
+order of priority (staleness, change frequency, upcoming availability and activity).
+    --listings=<listings>  Number of synthetic listings served by the mock API [default: 100000]
+    --latency=<latency>    Mock API latency distribution, optionally per operation, e.g. \
+"lognormal:150:0.6,PdpReviews=fixed:50" (fixed:<ms>, uniform:<min ms>:<max ms> or lognormal:<median ms>:<sigma>) \
+[default: fixed:0]
+    --errors=<errors>      Mock API error rates by error class, e.g. "server_error=0.01,try_again=0.02" (forbidden, \
+server_error, data_fetching or try_again)
+    --rateLimit=<rateLimit>  Maximum mock API requests per second, answered with HTTP 429 beyond
+    --seed=<seed>          Seed of the synthetic listings generated by the mock API [default: 0]
 
 Global Options:
+    --archive=<archive>    Directory of raw API response archive (default: RESPONSE_ARCHIVE_PATH)
     --currency=<currency>  "USD", "EUR", etc. (default: USD)
+    --profile=<profile>    Profile the run with cProfile, save stats to given file and print the slowest functions
     --source=<source>      Only allows "airbnb" [default: airbnb]
-    --storage=<storage>    csv or elasticsearch (default: csv)
+    --storage=<storage>    csv, elasticsearch, parquet or sqlite (default: csv)
     -v, --verbose          Verbose logging output
 """
 
-    def __init__(self, args: dict):
+    __resources_lock = RLock()
+
+    def __init__(self, args: dict, resources: dict = None):
+        """When running as a service, clients, endpoints and storage are kept in resources and shared between
+        commands.
+        """
         self.__args = args
         self.__logger = StlCommand.__get_logger(bool(args.get('--verbose')))
+        self.__resources = resources
 
     @staticmethod
     def __get_logger(is_verbose: bool) -> Logger:
@@ -61,36 +107,109 @@ Global Options:
         )
         return logging.getLogger(__class__.__module__.lower())
 
-    def execute(self):
+    def execute(self) -> str | None:
+        """Execute command, return output of data and pricing commands.
+
+        Unless running as a service, runs of search, calendar, reparse and worker commands end with a summary of the
+        time spent per stage on stderr, and API request metrics are exported at the end of every command if configured.
+        """
+        is_run = any(self.__args.get(c) for c in ['search', 'calendar', 'reparse', 'worker'])
+        print_stages = is_run and self.__resources is None and not self.__args.get('enqueue')
+        started_at = perf_counter()
+        try:
+            if self.__args.get('--profile'):
+                return self.__execute_profiled(self.__args['--profile'])
+
+            return self.__execute()
+        finally:
+            if print_stages and stage_timer.get_stats():
+                print(stage_timer.format_table(perf_counter() - started_at), file=sys.stderr)
+            if self.__resources is None and not self.__args.get('serve'):
+                StlCommand.__write_metrics()
+
+    def __execute_profiled(self, profile_path: str) -> str | None:
+        """Execute command with cProfile, save the stats and print the functions with the highest cumulative time."""
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.__execute)
+        finally:
+            profiler.dump_stats(profile_path)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+            self.__logger.warning('Saved profile to {}'.format(profile_path))
+
+    def __execute(self) -> str | None:
         project_path = os.path.dirname(os.path.realpath('{}/../../'.format(__file__)))
         currency = self.__args.get('--currency') or os.getenv('SEARCH_CURRENCY', 'USD')
-        if self.__args.get('search'):
+        if self.__args.get('enqueue'):
+            self.__enqueue(project_path)
+
+        elif self.__args.get('worker'):
+            self.__work(project_path, currency)
+
+        elif self.__args.get('search'):
             query = self.__args['<query>']
-            persistence = self.__create_persistence(project_path, query)
+            persistence = self.__get_persistence(project_path, query)
             scraper = self.__create_scraper('search', persistence, currency)
             params = self.__get_search_params()
-            scraper.run(query, params)
+            try:
+                scraper.run(query, params)
+            finally:
+                self.__release_persistence(persistence)
 
         elif self.__args.get('calendar'):
-            if self.__args.get('--all') and self.__args.get('--storage') == 'csv':
-                self.__logger.critical('"csv" storage backend not supported in combination with "--all" option.')
+            persistence = self.__get_persistence(project_path)
+            if self.__args.get('--all') and not isinstance(persistence, CalendarPersistenceInterface):
+                self.__logger.critical('{} storage backend not supported in combination with "--all" option.'.format(
+                    type(persistence).__name__))
                 exit(1)
-            persistence = self.__create_persistence(project_path)
-            scraper = self.__create_scraper('calendar', persistence, currency)
-            source = 'elasticsearch' if self.__args.get('--all') else self.__args['<listingId>']
-            scraper.run(source, self.__args.get('--updated'))
+            calendar = self.__get_calendar(currency)
+            scraper = self.__create_scraper('calendar', persistence, currency, calendar)
+            source = 'all' if self.__args.get('--all') else self.__args['<listingId>']
+            budget = int(self.__args['--budget']) if self.__args.get('--budget') else None
+            try:
+                scraper.run(source, self.__args.get('--updated'), int(self.__args.get('--workers') or 1), budget)
+            finally:
+                self.__release_persistence(persistence)
+                self.__release_calendar(calendar)
+
+        elif self.__args.get('reparse'):
+            archive = self.__get_archive()
+            if archive is None:
+                self.__logger.critical('No response archive configured. Use "--archive" or RESPONSE_ARCHIVE_PATH.')
+                exit(1)
+            from stl.scraper.archive_reparser import ArchiveReparser
+            persistence = self.__get_persistence(project_path, 'reparse')
+            reparser = ArchiveReparser(archive, persistence, self.__logger, int(self.__args.get('--workers') or 1))
+            try:
+                reparser.run('reparse')
+            finally:
+                self.__release_persistence(persistence)
 
         elif self.__args.get('data'):
-            pdp = Pdp(os.getenv('AIRBNB_API_KEY'), currency, self.__logger)
-            print(json.dumps(pdp.get_raw_listing(self.__args.get('<listingId>'))))
+            def create_pdp():
+                pdp_endpoint = Pdp(os.getenv('AIRBNB_API_KEY'), currency, self.__logger)
+                pdp_endpoint.set_hedge_policy(self.__get_hedge_policy())
+                return pdp_endpoint
+
+            pdp = self.__get_resource(('pdp', currency), create_pdp)
+            return json.dumps(pdp.get_raw_listing(self.__args.get('<listingId>')))
 
         elif self.__args.get('pricing'):
             listing_id = self.__args.get('<listingId>')
             checkin = self.__args.get('--checkin')
             checkout = self.__args.get('--checkout')
-            pricing = Pricing(os.getenv('AIRBNB_API_KEY'), currency, self.__logger)
+            pricing = self.__get_pricing(currency)
             total = pricing.get_pricing(checkin, checkout, listing_id)
-            print('https://www.airbnb.com/rooms/{} - {} to {}: {}'.format(listing_id, checkin, checkout, total))
+            return 'https://www.airbnb.com/rooms/{} - {} to {}: {}'.format(listing_id, checkin, checkout, total)
+
+        elif self.__args.get('serve'):
+            self.__serve()
+
+        elif self.__args.get('mock'):
+            self.__mock()
 
         else:
             raise RuntimeError('ERROR: Unexpected command:\n{}'.format(*self.__args))
@@ -99,26 +218,51 @@ Global Options:
             self,
             scraper_type: str,
             persistence: PersistenceInterface,
-            currency: str
+            currency: str,
+            calendar: Calendar = None
     ) -> AirbnbScraperInterface:
-        """Create scraper of given type using given parameters."""
+        """Create scraper of given type using given parameters. Calendar scrapers use the given calendar endpoint."""
         api_key = os.getenv('AIRBNB_API_KEY')
         if scraper_type == 'search':
-            explore = Explore(api_key, currency, self.__logger)
-            pdp = Pdp(api_key, currency, self.__logger)
-            reviews = Reviews(api_key, currency, self.__logger)
-            return AirbnbSearchScraper(explore, pdp, reviews, persistence, self.__logger)
+            archive = self.__get_archive()
+
+            def create_endpoints():
+                endpoints = [
+                    Explore(api_key, currency, self.__logger),
+                    Pdp(api_key, currency, self.__logger),
+                    Reviews(api_key, currency, self.__logger),
+                ]
+                for endpoint in endpoints:
+                    endpoint.set_archive(archive)
+                endpoints[1].set_hedge_policy(self.__get_hedge_policy())
+                return endpoints
+
+            explore, pdp, reviews = self.__get_resource(
+                ('search', currency, self.__args.get('--archive') or os.getenv('RESPONSE_ARCHIVE_PATH')),
+                create_endpoints
+            )
+            return AirbnbSearchScraper(
+                explore, pdp, reviews, persistence, self.__logger, float(os.getenv('LISTING_DEADLINE', 600)))
         elif scraper_type == 'calendar':
-            pricing = Pricing(api_key, currency, self.__logger)
-            calendar = Calendar(api_key, currency, self.__logger, pricing)
-            return AirbnbCalendarScraper(calendar, persistence, self.__logger)
+            snapshot_path = os.getenv('CALENDAR_SNAPSHOT_PATH')
+            snapshots = CalendarSnapshotStore(snapshot_path) if snapshot_path else None
+            return AirbnbCalendarScraper(
+                calendar, persistence, self.__logger, snapshots, float(os.getenv('LISTING_DEADLINE', 600)))
         else:
             raise RuntimeError('Unknown scraper type: %s' % scraper_type)
 
     def __create_persistence(self, project_path: str = None, query: str = None) -> PersistenceInterface:
-        """Create persistence layer - either CSV or Elasticsearch."""
+        """Create persistence layer - either CSV, Elasticsearch, Parquet or SQLite.
+
+        Storage backends are imported here, so that only the selected backend's dependencies are loaded.
+        """
         storage_type = self.__args.get('--storage') or os.getenv('STORAGE_TYPE')
         if storage_type == 'elasticsearch':
+            from elasticsearch import Elasticsearch
+            from elastic_transport import ConnectionError
+            from stl.persistence.bulk_buffer import BulkBuffer
+            from stl.persistence.elastic import Elastic
+
             es_params = {
                 'hosts':      os.getenv('ELASTIC_HOSTS'),
                 'basic_auth': (os.getenv('ELASTIC_USERNAME'), os.getenv('ELASTIC_PASSWORD')),
@@ -127,18 +271,306 @@ Global Options:
                 es_params['ca_certs'] = os.getenv('ELASTIC_CA_CERT')
             else:
                 es_params['verify_certs'] = False
-            persistence = Elastic(Elasticsearch(**es_params), os.getenv('ELASTIC_INDEX'))
+            es = Elasticsearch(**es_params)
+            bulk_buffer = BulkBuffer(
+                es,
+                os.getenv('ELASTIC_INDEX'),
+                self.__logger,
+                max_actions=int(os.getenv('ELASTIC_BULK_ACTIONS', 500)),
+                max_bytes=int(os.getenv('ELASTIC_BULK_BYTES', 5 * 1024 * 1024)),
+                max_seconds=float(os.getenv('ELASTIC_BULK_SECONDS', 5))
+            )
+            persistence = Elastic(
+                es,
+                os.getenv('ELASTIC_INDEX'),
+                self.__logger,
+                bulk_buffer,
+                threads=int(os.getenv('ELASTIC_SAVE_THREADS', 4)),
+                chunk_size=int(os.getenv('ELASTIC_SAVE_CHUNK_SIZE', 500)),
+                max_chunk_bytes=int(os.getenv('ELASTIC_SAVE_CHUNK_BYTES', 10 * 1024 * 1024)),
+                slices=int(os.getenv('ELASTIC_SCAN_SLICES', 4))
+            )
             try:
                 persistence.create_index_if_not_exists(os.getenv('ELASTIC_INDEX'))
             except ConnectionError as e:
                 self.__logger.critical(e.message + '\nCould not connect to elasticsearch.')
                 exit(1)
+        elif storage_type == 'sqlite':
+            from stl.persistence.sqlite import Sqlite
+            persistence = Sqlite(os.getenv('SQLITE_PATH') or os.path.join(project_path, 'stl.sqlite'))
+        elif storage_type == 'parquet':
+            from stl.persistence.parquet import Parquet
+            persistence = Parquet(os.getenv('PARQUET_PATH') or os.path.join(project_path, 'parquet'))
         else:  # assume csv
-            csv_path = os.path.join(project_path, '{}.csv'.format(query))
+            from stl.persistence.csv import Csv
+            compression_suffix = {'gzip': '.gz', 'zstd': '.zst'}.get(os.getenv('CSV_COMPRESSION'), '')
+            csv_path = os.path.join(project_path, '{}.csv{}'.format(query, compression_suffix))
             persistence = Csv(csv_path)
 
         return persistence
 
+    def __create_write_behind(self, persistence: PersistenceInterface) -> PersistenceInterface:
+        """Wrap persistence layer so that writes are made on a separate writer thread, unless disabled.
+
+        Elasticsearch storage is not wrapped: it buffers calendar updates itself, and streams saved listings into
+        parallel bulk requests.
+        """
+        queue_size = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', 1000))
+        storage_type = self.__args.get('--storage') or os.getenv('STORAGE_TYPE')
+        if queue_size <= 0 or storage_type == 'elasticsearch':
+            return persistence
+
+        return WriteBehind.wrap(
+            persistence,
+            self.__logger,
+            queue_size=queue_size,
+            batch_size=int(os.getenv('WRITE_BEHIND_BATCH_SIZE', 500)),
+            max_seconds=float(os.getenv('WRITE_BEHIND_SECONDS', 5))
+        )
+
+    def __get_persistence(self, project_path: str, query: str = None) -> PersistenceInterface:
+        """Get persistence layer, with writes made on a separate writer thread.
+
+        When running as a service, Elasticsearch and SQLite storage is shared between commands. Other storage writes
+        to files per command, so it is created for each command.
+        """
+        storage_type = self.__args.get('--storage') or os.getenv('STORAGE_TYPE')
+        if self.__resources is not None and storage_type in ['elasticsearch', 'sqlite']:
+            return self.__get_resource(
+                ('persistence', storage_type),
+                lambda: self.__create_write_behind(self.__create_persistence(project_path, query))
+            )
+
+        return self.__create_write_behind(self.__create_persistence(project_path, query))
+
+    def __release_persistence(self, persistence: PersistenceInterface):
+        """Close persistence layer at the end of a command, or only flush it if it is shared with other commands."""
+        if self.__resources is not None and any(persistence is r for r in self.__resources.values()):
+            persistence.flush()
+        else:
+            persistence.close()
+
+    def __get_calendar(self, currency: str) -> Calendar:
+        """Get calendar endpoint, with pricing probes sized for the number of listings updated at the same time."""
+        workers = int(self.__args.get('--workers') or 1)
+
+        def create_calendar():
+            calendar = Calendar(
+                os.getenv('AIRBNB_API_KEY'), currency, self.__logger, self.__get_pricing(currency), workers)
+            calendar.set_hedge_policy(self.__get_hedge_policy())
+            return calendar
+
+        return self.__get_resource(('calendar', currency, workers), create_calendar)
+
+    def __release_calendar(self, calendar: Calendar):
+        """Shut down the pricing probes of a calendar endpoint at the end of a command, unless it is shared with other
+        commands.
+        """
+        if self.__resources is None or not any(calendar is r for r in self.__resources.values()):
+            calendar.close()
+
+    def __get_pricing(self, currency: str) -> Pricing:
+        return self.__get_resource(('pricing', currency), lambda: Pricing(
+            os.getenv('AIRBNB_API_KEY'), currency, self.__logger, QuoteCache(int(os.getenv('PRICING_CACHE_TTL', 3600)))
+        ))
+
+    def __get_resource(self, key: tuple, create: Callable):
+        """Get resource shared between the commands of a service, or create a new one if not running as a service."""
+        if self.__resources is None:
+            return create()
+        with StlCommand.__resources_lock:
+            if key not in self.__resources:
+                self.__resources[key] = create()
+
+            return self.__resources[key]
+
+    def __get_hedge_policy(self) -> HedgePolicy | None:
+        """Get policy to hedge slow PDP and calendar requests, if enabled."""
+        if not float(os.getenv('HEDGE_QUANTILE') or 0):
+            return None
+
+        return self.__get_resource(('hedge',), lambda: HedgePolicy(
+            quantile=float(os.getenv('HEDGE_QUANTILE')),
+            budget=float(os.getenv('HEDGE_BUDGET', 0.05)),
+            min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+        ))
+
+    def __get_archive(self) -> ResponseArchive | None:
+        """Get raw API response archive, if configured."""
+        archive_path = self.__args.get('--archive') or os.getenv('RESPONSE_ARCHIVE_PATH')
+        return ResponseArchive(archive_path) if archive_path else None
+
+    def __enqueue(self, project_path: str):
+        """Queue listing calendars to update or searches to run, for workers to pick up."""
+        lease_queue = self.__create_lease_queue(project_path)
+        try:
+            if self.__args.get('calendar'):
+                listing_ids = self.__args.get('<listingIds>')
+                if self.__args.get('--all'):
+                    persistence = self.__create_persistence(project_path)
+                    if not isinstance(persistence, CalendarPersistenceInterface):
+                        self.__logger.critical('{} storage backend not supported in combination with "--all" option.'
+                                               .format(type(persistence).__name__))
+                        exit(1)
+                    try:
+                        since = self.__args.get('--updated')
+                        if self.__args.get('--budget'):
+                            scheduler = RefreshScheduler(int(self.__args['--budget']))
+                            listing_ids = scheduler.select(persistence.get_refresh_candidates(since))
+                        else:
+                            listing_ids = list(persistence.get_all_index_ids(since))
+                    finally:
+                        persistence.close()
+                n_queued = lease_queue.enqueue('calendar', map(str, listing_ids))
+            else:
+                options = ['--checkin', '--checkout', '--priceMin', '--priceMax', '--roomTypes']
+                argv_options = ['{}={}'.format(o, self.__args[o]) for o in options if self.__args.get(o)]
+                n_queued = lease_queue.enqueue(
+                    'search', (json.dumps(['search', query] + argv_options) for query in self.__args['<queries>']))
+            self.__logger.warning('Queued {} tasks.'.format(n_queued))
+        finally:
+            lease_queue.close()
+
+    def __work(self, project_path: str, currency: str):
+        """Handle queued calendar updates or searches until the queue is drained."""
+        from stl.worker.queue_worker import QueueWorker
+
+        lease_queue = self.__create_lease_queue(project_path)
+        resources = {}
+        if self.__args.get('calendar'):
+            queue = 'calendar'
+            persistence = self.__get_persistence(project_path)
+            if not isinstance(persistence, CalendarPersistenceInterface):
+                self.__logger.critical('{} storage backend not supported by calendar workers.'.format(
+                    type(persistence).__name__))
+                exit(1)
+            calendar = self.__get_calendar(currency)
+            scraper = self.__create_scraper('calendar', persistence, currency, calendar)
+            scraper.open_snapshots()
+
+            def handle(listing_id: str):
+                scraper.update_listing(listing_id)
+                StlCommand.__write_metrics()
+
+            flush = persistence.flush  # store the updates of handled tasks before they are acked
+        else:
+            queue = 'search'
+            persistence = None
+            calendar = scraper = None
+            storage_argv = ['--storage={}'.format(self.__args['--storage'])] if self.__args.get('--storage') else []
+            flush = None  # searches store their listings before they finish
+
+            def handle(payload: str):
+                StlCommand(docopt(StlCommand.__doc__, json.loads(payload) + storage_argv), resources).execute()
+                StlCommand.__write_metrics()
+
+        worker = QueueWorker(
+            lease_queue,
+            queue,
+            handle,
+            self.__logger,
+            concurrency=int(self.__args.get('--workers') or 1),
+            heartbeat_seconds=float(os.getenv('LEASE_HEARTBEAT_SECONDS', 60)),
+            wait=bool(self.__args.get('--wait')),
+            flush=flush,
+            ack_batch_size=int(os.getenv('LEASE_ACK_BATCH_SIZE', 100)),
+            ack_seconds=float(os.getenv('LEASE_ACK_SECONDS', 10))
+        )
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        try:
+            worker.run()
+        finally:
+            if scraper is not None:
+                scraper.close_snapshots()
+            if persistence is not None:
+                persistence.close()
+            if calendar is not None:
+                self.__release_calendar(calendar)
+            for resource in resources.values():
+                if isinstance(resource, PersistenceInterface):
+                    resource.close()
+            lease_queue.close()
+
+    @staticmethod
+    def __write_metrics():
+        """Export API request metrics to a Prometheus text file and a JSON report, if configured."""
+        if os.getenv('METRICS_PROMETHEUS_PATH'):
+            request_metrics.write_prometheus(os.getenv('METRICS_PROMETHEUS_PATH'))
+        if os.getenv('METRICS_REPORT_PATH'):
+            request_metrics.write_report(os.getenv('METRICS_REPORT_PATH'))
+
+    def __create_lease_queue(self, project_path: str):
+        from stl.worker.lease_queue import LeaseQueue
+
+        queue_path = self.__args.get('--queue') or os.getenv('LEASE_QUEUE_PATH')
+        return LeaseQueue(
+            queue_path or os.path.join(project_path, 'stl-queue.sqlite'),
+            lease_seconds=float(os.getenv('LEASE_SECONDS', 300)),
+            max_attempts=int(os.getenv('LEASE_MAX_ATTEMPTS', 3))
+        )
+
+    def __serve(self):
+        """Run as a service executing commands submitted through the job API, keeping clients, endpoints (with their
+        connection pools and caches) and storage warm between commands.
+        """
+        from stl.service.job_queue import JobQueue
+        from stl.service.server import StlServer
+
+        resources = {}
+        limits = {}
+        for limit in filter(bool, map(str.strip, os.getenv('SERVICE_LIMITS', '').split(','))):
+            command, n = limit.split('=')
+            limits[command.strip()] = int(n)
+        job_queue = JobQueue(
+            lambda job: StlCommand(job.args, resources).execute(),
+            self.__logger,
+            workers=int(self.__args.get('--workers') or 1),
+            limits=limits,
+            max_queued=int(os.getenv('SERVICE_MAX_QUEUED', 100))
+        )
+        server = StlServer(job_queue, self.__logger)
+        signal.signal(signal.SIGTERM, lambda *_: Thread(target=server.shutdown).start())
+        try:
+            server.serve(
+                self.__args.get('--host') or os.getenv('SERVICE_HOST', '127.0.0.1'),
+                int(self.__args.get('--port') or os.getenv('SERVICE_PORT', 8765)),
+                self.__args.get('--socket') or os.getenv('SERVICE_SOCKET')
+            )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            job_queue.stop()
+            for resource in resources.values():
+                if isinstance(resource, (Calendar, PersistenceInterface)):
+                    resource.close()
+
+    def __mock(self):
+        """Run a local stand-in for the Airbnb API, to point AIRBNB_BASE_URL at."""
+        from stl.mock.payloads import MockPayloads
+        from stl.mock.server import LatencyModel, MockServer
+
+        latencies = {}
+        for spec in filter(bool, map(str.strip, (self.__args.get('--latency') or '').split(','))):
+            operation, _, model = spec.rpartition('=')
+            latencies[operation or None] = LatencyModel(model)
+        error_rates = {}
+        for spec in filter(bool, map(str.strip, (self.__args.get('--errors') or '').split(','))):
+            error_class, rate = spec.split('=')
+            error_rates[error_class.strip()] = float(rate)
+
+        server = MockServer(
+            MockPayloads(int(self.__args.get('--listings') or 100000), int(self.__args.get('--seed') or 0)),
+            self.__logger,
+            latencies=latencies,
+            error_rates=error_rates,
+            rate_limit=float(self.__args['--rateLimit']) if self.__args.get('--rateLimit') else None
+        )
+        signal.signal(signal.SIGTERM, lambda *_: Thread(target=server.shutdown).start())
+        try:
+            server.serve(self.__args.get('--host') or '127.0.0.1', int(self.__args.get('--port') or 8766))
+        except KeyboardInterrupt:
+            pass
+
     def __get_search_params(self) -> dict:
         """Get search parameters: roomTypes, checkin, checkout, priceMin, priceMax."""
         params = {}
@@ -1,13 +1,26 @@
 import json
+import os
 import requests
 
 from abc import ABC
 from logging import Logger
 from random import randint
-from time import sleep
-from urllib.parse import urlunparse, urlencode
+from time import perf_counter, sleep
+from typing import Protocol
+from urllib.parse import urlparse, urlunparse, urlencode
 
+from stl.endpoint.deadline import check_deadline, clip_timeout
+from stl.endpoint.hedging import HedgePolicy
+from stl.endpoint.single_flight import single_flight
 from stl.exception.api import ApiException, ForbiddenException
+from stl.metrics.request_metrics import request_metrics
+
+
+class ResponseArchiveProtocol(Protocol):
+    """Destination of raw API responses, e.g. stl.persistence.response_archive.ResponseArchive."""
+
+    def append(self, operation: str, listing_id: str | None, response: dict, context: dict = None):
+        ...
 
 
 class BaseEndpoint(ABC):
@@ -19,15 +32,46 @@ class BaseEndpoint(ABC):
         self._currency = currency
         self._locale = locale
         self._logger = logger
+        self._archive = None
+        self._hedge_policy = None
+        self._session = requests.Session()  # reuse connections across requests
 
     @staticmethod
     def build_airbnb_url(path: str, query=None):
+        """Build Airbnb URL, on AIRBNB_BASE_URL if set (e.g. to use the mock API)."""
         if query is not None:
             query = urlencode(query)
 
-        return urlunparse(['https', 'www.airbnb.com', path, None, query, None])
+        base_url = urlparse(os.getenv('AIRBNB_BASE_URL') or 'https://www.airbnb.com')
+        return urlunparse([base_url.scheme, base_url.netloc, base_url.path.rstrip('/') + path, None, query, None])
+
+    @staticmethod
+    def get_timeout(operation: str) -> tuple:
+        """Get (connect, read) timeout in seconds for requests of operation, from API_TIMEOUTS (e.g.
+        "PdpReviews=5:30,startStaysCheckout=5:90") or else API_TIMEOUT (e.g. "10:60").
+        """
+        timeout = os.getenv('API_TIMEOUT') or '10:60'
+        for operation_timeout in filter(bool, map(str.strip, os.getenv('API_TIMEOUTS', '').split(','))):
+            name, operation_timeout = operation_timeout.split('=')
+            if name.strip() == operation:
+                timeout = operation_timeout
+        connect_timeout, _, read_timeout = timeout.partition(':')
+
+        return float(connect_timeout), float(read_timeout or connect_timeout)
 
     def _api_request(self, url: str, method: str = 'GET', data=None) -> dict:
+        """Perform API request. Concurrent identical requests (same method, URL and body) are sent only once and share
+        the response, which must therefore not be modified.
+        """
+        body = data if data is None or isinstance(data, (str, bytes)) else json.dumps(data, sort_keys=True)
+        response_json, is_shared = single_flight.do(
+            (method, url, body), lambda: self.__api_request(url, method, data))
+        if is_shared:
+            request_metrics.add_coalesced(self._get_operation())
+
+        return response_json
+
+    def __api_request(self, url: str, method: str, data) -> dict:
         if data is None:
             data = {}
 
@@ -35,9 +79,15 @@ class BaseEndpoint(ABC):
         headers = {'x-airbnb-api-key': self._api_key}
         max_attempts = 3
         while attempts < max_attempts:
-            sleep(randint(0, 2))  # do a little throttling
+            self._throttle(randint(0, 2))  # do a little throttling
+            if attempts:
+                request_metrics.add_retry(self._get_operation())
             attempts += 1
-            response = requests.request(method, url, headers=headers, data=data)
+            try:
+                response = self._send(method, url, headers, data)
+            except requests.exceptions.Timeout as e:
+                self._logger.warning('{}: {}'.format(self._get_operation(), e))
+                continue
             response_json = response.json()
             errors = response_json.get('errors')
             if not errors:
@@ -45,7 +95,67 @@ class BaseEndpoint(ABC):
 
             self.__handle_api_error(url, errors)
 
-        raise ApiException(['Could not complete API {} request to "{}"'.format(method, url)])
+        request_metrics.add_error(self._get_operation(), 'attempts_exhausted')
+        raise ApiException([{'message': 'Could not complete API {} request to "{}"'.format(method, url)}])
+
+    def _send(self, method: str, url: str, headers: dict = None, data=None) -> requests.Response:
+        """Send HTTP request to the API, hedging slow GET requests if a hedge policy is set. Hedges are throttled like
+        any other request.
+        """
+        if method == 'GET' and self._hedge_policy is not None:
+            return self._hedge_policy.send(
+                self._get_operation(),
+                lambda: self.__send(method, url, headers, data),
+                lambda: self.__send(method, url, headers, data, is_hedge=True),
+                lambda: self._throttle(randint(0, 2))
+            )
+
+        return self.__send(method, url, headers, data)
+
+    def __send(
+            self,
+            method: str,
+            url: str,
+            headers: dict = None,
+            data=None,
+            is_hedge: bool = False
+    ) -> requests.Response:
+        """Send HTTP request, recording its latency, status and response size per operation."""
+        started_at = perf_counter()
+        try:
+            response = self._session.request(
+                method, url, headers=headers, data=data, timeout=clip_timeout(self.get_timeout(self._get_operation())))
+        except requests.exceptions.Timeout:
+            request_metrics.add_error(self._get_operation(), 'timeout')
+            check_deadline()  # the timeout may have been cut short by the deadline
+            raise
+        request_metrics.observe_request(
+            self._get_operation(), perf_counter() - started_at, len(response.content), response.status_code, is_hedge)
+
+        return response
+
+    def _throttle(self, seconds: float):
+        """Sleep between requests, or before retrying a request, unless the deadline would pass while sleeping."""
+        if seconds:
+            check_deadline(seconds)
+            sleep(seconds)
+            request_metrics.add_throttle(self._get_operation(), seconds)
+
+    def _get_operation(self) -> str:
+        """Get API operation name, e.g. "PdpPlatformSections"."""
+        return self.API_PATH.rsplit('/', 1)[-1]
+
+    def set_archive(self, archive: ResponseArchiveProtocol | None):
+        """Archive raw API responses of this endpoint."""
+        self._archive = archive
+
+    def set_hedge_policy(self, policy: HedgePolicy | None):
+        """Hedge slow GET requests of this endpoint."""
+        self._hedge_policy = policy
+
+    def _archive_response(self, listing_id: str | None, response: dict, context: dict = None):
+        if self._archive is not None:
+            self._archive.append(self._get_operation(), listing_id, response, context)
 
     @staticmethod
     def _put_json_param_strings(query: dict):
@@ -60,20 +170,25 @@ class BaseEndpoint(ABC):
                 if error['extensions'].get('response'):
                     status_code = error['extensions']['response'].get('statusCode')
                     if status_code == 403:
+                        request_metrics.add_error(self._get_operation(), 'forbidden')
                         self._logger.critical('403 Forbidden: %s' % url)
                         raise ForbiddenException([error])
                     if status_code >= 500:
-                        sleep(60)  # sleep for a minute and then make another attempt
+                        request_metrics.add_error(self._get_operation(), 'server_error')
+                        self._throttle(60)  # sleep for a minute and then make another attempt
                         self._logger.warning(error)
                         return
                 elif error['extensions'].get('classification') == 'DataFetchingException':
-                    sleep(60)  # sleep for a minute and then make another attempt
+                    request_metrics.add_error(self._get_operation(), 'data_fetching')
+                    self._throttle(60)  # sleep for a minute and then make another attempt
                     self._logger.warning(error['message'])
                     return
 
             if 'please try again' in error['message'].lower():
-                sleep(30)  # sleep 30 seconds then make another attempt
+                request_metrics.add_error(self._get_operation(), 'try_again')
+                self._throttle(30)  # sleep 30 seconds then make another attempt
                 self._logger.warning(error['message'])
                 return
 
+        request_metrics.add_error(self._get_operation(), 'other')
         raise ApiException(errors)
@@ -1,22 +1,38 @@
 import json
 import statistics
 
-from datetime import date, datetime, timedelta
-from itertools import groupby
+from datetime import date, datetime
 from logging import Logger
-from operator import itemgetter
-from requests.exceptions import ConnectionError
-from time import sleep
 
 from stl.endpoint.base_endpoint import BaseEndpoint
 from stl.endpoint.pdp import Pdp
+from stl.endpoint.pricing_planner import PricingPlanner, QuoteCache
+from stl.metrics.stage_timer import stage_timer
+from stl.model.booking_calendar import BookingCalendar
 
 
 class Pricing(BaseEndpoint):
     API_PATH = '/api/v3/startStaysCheckout'
 
+    def __init__(self, api_key: str, currency: str, logger: Logger, cache: QuoteCache = None):
+        super().__init__(api_key, currency, logger)
+        self.__cache = cache
+
     def get_pricing(self, checkin: str, checkout: str, listing_id: str) -> dict:
-        """Get pricing object for a listing for specific dates."""
+        """Get pricing object for a listing for specific dates. Quotes are served from the cache if available."""
+        cache_key = (listing_id, checkin, checkout, self._currency)
+        if self.__cache:
+            pricing = self.__cache.get(cache_key)
+            if pricing is not None:
+                return pricing
+
+        pricing = self.__fetch_pricing(checkin, checkout, listing_id)
+        if self.__cache:
+            self.__cache.put(cache_key, pricing)
+
+        return pricing
+
+    def __fetch_pricing(self, checkin: str, checkout: str, listing_id: str) -> dict:
         # Get raw price data
         product_id = Pdp.get_product_id(listing_id)
         rates = self.get_rates(product_id, checkin, checkout)
@@ -30,6 +46,7 @@ class Pricing(BaseEndpoint):
             (datetime.strptime(checkout, '%Y-%m-%d') - datetime.strptime(checkin, '%Y-%m-%d')).days
         )
 
+    @stage_timer.timed('pricing probes')
     def get_rates(self, product_id: str, start_date: str, end_date: str):
         url = BaseEndpoint.build_airbnb_url(self.API_PATH, {
             'operationName': 'startStaysCheckout',
@@ -74,6 +91,7 @@ class Pricing(BaseEndpoint):
         return self._api_request(url, 'POST', payload)
 
     @staticmethod
+    @stage_timer.timed('parsing')
     def __normalize_pricing(price_breakdown: dict, nights: int):
         """Normalize price line items. Throw ValueError if price data malformed."""
         price_items = price_breakdown['priceItems']
@@ -133,37 +151,29 @@ class Calendar(BaseEndpoint):
     API_PATH = '/api/v3/PdpAvailabilityCalendar'
     N_MONTHS = 12  # number of months of data to return; 12 months == 1 year
 
-    def __init__(self, api_key: str, currency: str, logger: Logger, pricing: Pricing):
+    def __init__(self, api_key: str, currency: str, logger: Logger, pricing: Pricing, listings: int = 1):
+        """Pricing probes run concurrently for up to given number of listings being updated at the same time.
+
+        Calendars are requested relative to the current day, so that a long-lived endpoint (e.g. of a service or a
+        waiting worker) keeps up with the date.
+        """
         super().__init__(api_key, currency, logger)
-        self.__pricing = pricing
-        self.__today = datetime.today()
+        self.__planner = PricingPlanner(pricing.get_pricing, logger, listings)
+
+    def close(self):
+        self.__planner.close()
 
     @staticmethod
-    def get_date_ranges(status: str, booking_calendar: dict) -> list:
+    def get_date_ranges(status: str, booking_calendar: BookingCalendar | dict) -> list:
         """Given a booking calendar and a status of "available" or "booked", return a list of date range objects for
         either available or booked dates.
         """
-        allowed_status = ['available', 'booked']
-        if status not in allowed_status:
-            raise ValueError('status must be one of "available" or "booked"')
-        dates = [
-            datetime.strptime(dt, '%Y-%m-%d').toordinal() for dt, is_booked in booking_calendar.items() if is_booked
-        ] if status == 'booked' else [
-            datetime.strptime(dt, '%Y-%m-%d').toordinal() for dt, is_booked in booking_calendar.items() if not is_booked
-        ]
-        ranges = []
-        for k, g in groupby(enumerate(dates), lambda i: i[0] - i[1]):
-            group = list(map(itemgetter(1), g))
-            start_date = date.fromordinal(group[0])
-            end_date = date.fromordinal(group[-1]) + timedelta(days=1)
-            ranges.append({
-                'start':  start_date,
-                'end':    end_date,
-                'length': (end_date - start_date).days
-            })
-
-        return ranges
+        if isinstance(booking_calendar, dict):
+            booking_calendar = BookingCalendar.from_dict(booking_calendar)
+
+        return booking_calendar.get_ranges(status)
 
+    @stage_timer.timed('calendar fetch')
     def get_calendar(self, listing_id: str) -> tuple:
         url = self.get_url(listing_id)
         response_data = self._api_request(url)
@@ -177,38 +187,8 @@ class Calendar(BaseEndpoint):
             max_nights: int = None,
             full_data: bool = False
     ) -> dict:
-        test_lengths = self.__get_test_lengths(max_nights, min_nights)
-        pricing_data = {}
-        for test_length in test_lengths:
-            if test_length > max_nights:
-                continue
-            if test_length < min_nights:
-                continue
-
-            possible_ranges = [r for r in ranges if r.get('length') >= test_length]
-            pd = None
-            while possible_ranges and not pd:
-                test_range = possible_ranges.pop()
-                start_time = test_range['start'].strftime('%Y-%m-%d')
-                end_time = (test_range['start'] + timedelta(days=test_length)).strftime('%Y-%m-%d')
-                try:
-                    pd = self.__pricing.get_pricing(start_time, end_time, listing_id)
-                except (ValueError, RuntimeError) as e:
-                    # ValueError or Response error
-                    self._logger.error('{}: Could not get pricing data: {}'.format(listing_id, str(e)))
-                    continue
-                except ConnectionError as e:
-                    self._logger.error('{}: Could not get pricing data: {}'.format(listing_id, str(e)))
-                    # connection error due to network issues. wait for one minute for network connection to be
-                    # re-established.
-                    sleep(60)
-                    continue
-
-            if not pd:
-                self._logger.warning('{}: Unable to find available {} day range'.format(listing_id, test_length))
-                continue
-
-            pricing_data[test_length] = pd
+        test_lengths = self.get_test_lengths(max_nights, min_nights)
+        pricing_data = self.__planner.get_quotes(listing_id, ranges, test_lengths, date.today())
 
         if full_data or not pricing_data:
             return pricing_data
@@ -231,6 +211,7 @@ class Calendar(BaseEndpoint):
 
     def get_url(self, listing_id: str) -> str:
         """Get PdpAvailabilityCalendar URL."""
+        today = date.today()
         query = {
             'operationName': 'PdpAvailabilityCalendar',
             'locale':        self._locale,
@@ -239,8 +220,8 @@ class Calendar(BaseEndpoint):
                 "request": {
                     'count':     self.N_MONTHS,
                     'listingId': listing_id,
-                    'month':     self.__today.month,
-                    'year':      self.__today.year
+                    'month':     today.month,
+                    'year':      today.year
                 }
             },
             'extensions':    {
@@ -255,44 +236,35 @@ class Calendar(BaseEndpoint):
         return BaseEndpoint.build_airbnb_url(self.API_PATH, query)
 
     @staticmethod
-    def __get_test_lengths(max_nights: int, min_nights: int) -> list:
+    def get_test_lengths(max_nights: int, min_nights: int) -> list:
         """Generate a list of lengths of stays to be used to determine pricing, based upon listing requirements of
         max_nights and min_nights."""
         if min_nights > 28:  # monthly only
-            return [min_nights]
+            test_lengths = [min_nights]
         elif min_nights >= 7:
             if max_nights >= 28:  # weekly and monthly
-                return [min_nights, 28]
+                test_lengths = [min_nights, 28]
             else:  # weekly only
-                return [min_nights]
+                test_lengths = [min_nights]
         else:  # min nights < 7
             if max_nights >= 28:  # daily, weekly, and monthly
-                return [min_nights, 7, 28]
+                test_lengths = [min_nights, 7, 28]
             elif max_nights >= 7:  # daily and weekly
-                return [min_nights, 7]
+                test_lengths = [min_nights, 7]
             else:  # daily only
-                return [min_nights]
+                test_lengths = [min_nights]
 
+        return [length for length in test_lengths if min_nights <= length <= max_nights]
+
+    @stage_timer.timed('parsing')
     def __get_booking_calendar(self, data: dict) -> tuple:
         calendar_months = data['data']['merlin']['pdpAvailabilityCalendar']['calendarMonths']
-        first_available_date = None
-        booking_calendar = {}
-        for month in calendar_months:
-            booked_days = total_days = 0
-            for day in month['days']:
-                total_days += 1
-                calendar_date = datetime.strptime(day['calendarDate'], '%Y-%m-%d')
-                if calendar_date < self.__today:
-                    continue  # skip dates in the past
-
-                # is either today or in the future
-                if day['available']:
-                    if first_available_date is None:
-                        first_available_date = day['calendarDate']
-                    booking_calendar[day['calendarDate']] = False
-                else:
-                    booking_calendar[day['calendarDate']] = True
-                    booked_days += 1
+        today = date.today().isoformat()
+        booking_calendar = BookingCalendar.from_days(
+            (day['calendarDate'], not day['available'])
+            for month in calendar_months for day in month['days']
+            if day['calendarDate'] > today  # skip dates in the past, including today which has already begun
+        )
 
         min_nights = statistics.mode([day['minNights'] for month in calendar_months for day in month['days']])
         max_nights = statistics.mode([day['maxNights'] for month in calendar_months for day in month['days']])
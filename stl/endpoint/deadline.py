@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+from stl.exception.api import DeadlineExceededException
+
+_expires_at = ContextVar('stl_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds: float | None):
+    """Give all API requests made within the enclosed block a shared deadline, e.g. all requests for one listing.
+
+    The deadline is kept in a context variable, so it also applies to requests made in threads that run a copy of the
+    context. A nested deadline never extends the enclosing one. Without seconds, no deadline is set.
+    """
+    if not seconds:
+        yield
+        return
+
+    expires_at = monotonic() + seconds
+    if _expires_at.get() is not None:
+        expires_at = min(expires_at, _expires_at.get())
+    token = _expires_at.set(expires_at)
+    try:
+        yield
+    finally:
+        _expires_at.reset(token)
+
+
+def get_remaining() -> float | None:
+    """Get seconds left until the current deadline, or None without a deadline."""
+    expires_at = _expires_at.get()
+    return expires_at - monotonic() if expires_at is not None else None
+
+
+def check_deadline(seconds: float = 0):
+    """Raise DeadlineExceededException if the current deadline passes within given seconds."""
+    remaining = get_remaining()
+    if remaining is not None and remaining <= seconds:
+        raise DeadlineExceededException([{'message': 'Deadline exceeded'}])
+
+
+def clip_timeout(timeout: tuple) -> tuple:
+    """Clip (connect, read) timeout to the time left until the current deadline."""
+    check_deadline()
+    remaining = get_remaining()
+    if remaining is None:
+        return timeout
+
+    return tuple(min(t, remaining) for t in timeout)
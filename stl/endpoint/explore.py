@@ -1,4 +1,5 @@
 from stl.endpoint.base_endpoint import BaseEndpoint
+from stl.metrics.stage_timer import stage_timer
 
 
 class Explore(BaseEndpoint):
@@ -50,8 +51,10 @@ class Explore(BaseEndpoint):
 
         return url
 
+    @stage_timer.timed('explore fetch')
     def search(self, url: str):
         data = self._api_request(url)
+        self._archive_response(None, data, {'url': url})
         pagination = data['data']['dora']['exploreV3']['metadata']['paginationMetadata']
 
         return data, pagination
@@ -0,0 +1,73 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from threading import Lock
+from typing import Callable
+
+from stl.metrics.request_metrics import request_metrics
+
+
+class HedgePolicy:
+    """Hedge slow requests: if a request has not been answered within the observed latency quantile of its operation
+    (e.g. p95), send a duplicate and use whichever response comes first.
+
+    Hedges are limited to a fraction of all requests (the budget), so that they add at most that fraction to the
+    request rate, and are throttled like any other request. Until enough latencies have been observed for an operation,
+    its requests are not hedged. A request that has already been sent cannot be aborted, so the slower of the two is
+    left to finish and its response dropped.
+    """
+
+    def __init__(self, quantile: float = 0.95, budget: float = 0.05, min_samples: int = 20, max_workers: int = 64):
+        self.__budget = budget
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stl-hedge')
+        self.__lock = Lock()
+        self.__min_samples = min_samples
+        self.__n_hedges = 0
+        self.__n_requests = 0
+        self.__quantile = quantile
+
+    def send(self, operation: str, send: Callable, send_hedge: Callable = None, throttle: Callable = None):
+        """Call send, and call send_hedge (default: send) if the first call is slow. Return the first result.
+
+        The hedge calls throttle first, and is not sent if the first call succeeded in the meantime.
+        """
+        with self.__lock:
+            self.__n_requests += 1
+        delay = request_metrics.get_quantile(operation, self.__quantile, self.__min_samples)
+        if delay is None:
+            return send()
+
+        primary = self.__executor.submit(copy_context().run, send)  # keep the deadline of the request
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.__acquire_hedge():
+            return primary.result()
+
+        def hedge_request():
+            if throttle is not None:
+                throttle()
+            if primary.done() and primary.exception() is None:
+                return None  # answered while throttling, so the hedge is not needed
+            return (send_hedge or send)()
+
+        hedge = self.__executor.submit(copy_context().run, hedge_request)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()  # only cancels a hedge that has not been sent yet
+                    request_metrics.add_hedge(operation, future is hedge)
+                    return future.result()
+                error = error or future.exception()
+
+        request_metrics.add_hedge(operation, False)
+        raise error
+
+    def __acquire_hedge(self) -> bool:
+        """Take a hedge from the budget, if any is left."""
+        with self.__lock:
+            if self.__n_hedges + 1 > self.__budget * self.__n_requests:
+                return False
+            self.__n_hedges += 1
+            return True
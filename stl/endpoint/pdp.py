@@ -1,13 +1,13 @@
 import base64
-import lxml.html
-import pycountry
+import hashlib
+import json
 import re
 
 from datetime import datetime
 from logging import Logger
 
 from stl.endpoint.base_endpoint import BaseEndpoint
-from stl.geo.geocode import Geocoder
+from stl.metrics.stage_timer import stage_timer
 
 
 class Pdp(BaseEndpoint):
@@ -72,26 +72,61 @@ class Pdp(BaseEndpoint):
 
     def __init__(self, api_key: str, currency: str, logger: Logger):
         super().__init__(api_key, currency, logger)
-        self.__geocoder = Geocoder()
+        self.__geocoder_instance = None
         self.__regex_amenity_id = re.compile(r'^([a-z0-9]+_)+([0-9]+)_')
 
+    @property
+    def __geocoder(self):
+        """Geocoder, only created (and geopy imported) once listings from search results are collected."""
+        if self.__geocoder_instance is None:
+            from stl.geo.geocode import Geocoder
+            self.__geocoder_instance = Geocoder()
+
+        return self.__geocoder_instance
+
     @staticmethod
     def get_product_id(listing_id: str) -> str:
         return base64.b64encode(bytes(f'StayListing:{listing_id}', 'utf-8')).decode('utf-8')
 
+    @staticmethod
+    def get_content_hash(listing: dict) -> str:
+        """Get a stable hash of the listing contents, ignoring `updated_at`."""
+        contents = {k: v for k, v in listing.items() if k not in ['content_hash', 'updated_at']}
+        return hashlib.blake2b(
+            json.dumps(contents, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8'), digest_size=16
+        ).hexdigest()
+
     def get_listing(self, listing_id: str, data_cache: dict, geography: dict, reviews: dict) -> dict:
-        product_id = self.get_product_id(listing_id)
         response = self.get_raw_listing(listing_id)
-        return self.__parse_listing_contents(response, data_cache[listing_id], geography, reviews) | {
-            'product_id': product_id,
+        self._archive_response(listing_id, response, {'listing': data_cache[listing_id], 'geography': geography})
+        return self.parse_listing(listing_id, response, data_cache[listing_id], geography, reviews)
+
+    @stage_timer.timed('parsing')
+    def parse_listing(
+            self,
+            listing_id: str,
+            response: dict,
+            listing_data_cached: dict,
+            geography: dict,
+            reviews: dict,
+            updated_at: datetime = None
+    ) -> dict:
+        """Parse a raw PdpPlatformSections response, combined with the listing data from search results."""
+        listing = self.__parse_listing_contents(response, listing_data_cached, geography, reviews) | {
+            'product_id': self.get_product_id(listing_id),
             'source':     self.SOURCE,
-            'updated_at': datetime.utcnow(),
+        }
+        return listing | {
+            'content_hash': self.get_content_hash(listing),
+            'updated_at':   updated_at or datetime.utcnow(),
         }
 
+    @stage_timer.timed('pdp fetch')
     def get_raw_listing(self, listing_id: str) -> dict:
         url = self.__get_url(listing_id)
         return self._api_request(url)
 
+    @stage_timer.timed('parsing')
     def collect_listings_from_sections(self, data: dict, geography: dict, data_cache: dict):
         """Get listings from "sections" (i.e. search results page sections)."""
         sections = data['data']['dora']['exploreV3']['sections']
@@ -314,6 +349,8 @@ class Pdp(BaseEndpoint):
         we use reverse geocoding (and, of course, advanced AI) to determine what the actual city name is. As a bonus,
         we also try to get the neighborhood.
         """
+        import pycountry
+
         public_address_components = list(map(str.strip, filter(bool, listing['publicAddress'].split(','))))
         search_city = geography['city']
 
@@ -420,6 +457,7 @@ class Pdp(BaseEndpoint):
     @staticmethod
     def __html_to_text(html: str) -> str:
         """Get plaintext from HTML."""
+        import lxml.html
         return lxml.html.document_fromstring(html).text_content()
 
     @staticmethod
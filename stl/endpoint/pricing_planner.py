@@ -0,0 +1,155 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import date, timedelta
+from logging import Logger
+from requests.exceptions import ConnectionError
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable
+
+from stl.endpoint.deadline import check_deadline
+
+
+class QuoteCache:
+    """Thread-safe in-memory cache of pricing quotes keyed by (listing id, checkin, checkout, currency).
+
+    Entries expire after `ttl` seconds. When more than `max_entries` quotes are cached, the least recently used quote
+    is evicted.
+    """
+
+    def __init__(self, ttl: int = 3600, max_entries: int = 10000):
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+        self.__max_entries = max_entries
+        self.__ttl = ttl
+
+    def get(self, key: tuple) -> dict | None:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+            expires_at, quote = entry
+            if expires_at < monotonic():
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+
+        return dict(quote)
+
+    def put(self, key: tuple, quote: dict):
+        with self.__lock:
+            self.__entries[key] = (monotonic() + self.__ttl, dict(quote))
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+
+class PricingPlanner:
+    """Plan and run the checkout probes used to determine pricing for a listing.
+
+    Every probe is a full startStaysCheckout request, so the planner tries to succeed with as few of them as possible:
+    candidate date ranges are tried most-likely-to-succeed first and identical stay lengths are only probed once. The
+    longest stay length is probed first. If its quote has no weekly or monthly discount, the nightly rate does not
+    depend on the length of stay, and the quotes for shorter lengths are derived from it. Otherwise the shorter lengths
+    are probed concurrently.
+
+    The concurrent probes run on a thread pool sized for the given number of listings being updated at the same time.
+    """
+    MIN_LEAD_DAYS = 2  # same-day and next-day check-ins are frequently blocked by the host's advance notice setting
+    MAX_CONCURRENT_PROBES = 2  # at most 3 test lengths, the longest of which is probed by the caller
+
+    def __init__(self, get_pricing: Callable, logger: Logger, listings: int = 1):
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max(1, listings) * self.MAX_CONCURRENT_PROBES, thread_name_prefix='stl-pricing')
+        self.__get_pricing = get_pricing
+        self.__logger = logger
+
+    def get_quotes(self, listing_id: str, ranges: list, test_lengths: list, today: date) -> dict:
+        """Get a pricing quote for each test length, keyed by length. Lengths without a quote are omitted."""
+        lengths = list(dict.fromkeys(test_lengths))
+        if not lengths:
+            return {}
+        longest = max(lengths)
+        longest_quote = self.__probe_length(listing_id, ranges, longest, today)
+        if longest_quote and 'discount' not in longest_quote:
+            return {
+                length: longest_quote if length == longest else self.derive_quote(longest_quote, length)
+                for length in lengths
+            }
+
+        futures = {
+            length: self.__executor.submit(copy_context().run, self.__probe_length, listing_id, ranges, length, today)
+            for length in lengths if length != longest  # run with the context, and so the deadline, of the listing
+        }
+        quotes = {}
+        for length in lengths:
+            quote = longest_quote if length == longest else futures[length].result()
+            if quote:
+                quotes[length] = quote
+
+        return quotes
+
+    def close(self):
+        """Shut down the probe threads, after the running probes have finished."""
+        self.__executor.shutdown()
+
+    @staticmethod
+    def derive_quote(quote: dict, nights: int) -> dict:
+        """Derive the quote for a stay of given nights from a quote without discount, at the same nightly rate, cleaning
+        fee and tax rate. The service fee is scaled with the subtotal.
+        """
+        price_accommodation = quote['price_nightly'] * nights
+        subtotal = price_accommodation + quote['price_cleaning']
+        airbnb_fee = quote['airbnb_fee'] * subtotal / (quote['price_accommodation'] + quote['price_cleaning'])
+        taxes = quote['tax_rate'] * subtotal
+
+        return dict(
+            quote,
+            nights=nights,
+            price_accommodation=price_accommodation,
+            taxes=taxes,
+            airbnb_fee=airbnb_fee,
+            total=subtotal + taxes + airbnb_fee,
+            derived=True
+        )
+
+    @staticmethod
+    def get_candidates(ranges: list, length: int, today: date) -> list:
+        """Get (checkin, checkout) candidates for a stay of given length, most likely to succeed first.
+
+        Ranges that leave no slack around the stay, or that start before the minimum lead time, are tried last.
+        """
+        candidates = []
+        min_checkin = today + timedelta(days=PricingPlanner.MIN_LEAD_DAYS)
+        for date_range in ranges:
+            slack = date_range['length'] - length
+            if slack < 0:
+                continue
+            checkin = date_range['start']
+            if checkin < min_checkin:
+                checkin += timedelta(days=min((min_checkin - checkin).days, slack))
+                slack -= (checkin - date_range['start']).days
+            candidates.append(((checkin < min_checkin, slack == 0, checkin), checkin))
+
+        return [
+            (checkin.strftime('%Y-%m-%d'), (checkin + timedelta(days=length)).strftime('%Y-%m-%d'))
+            for _, checkin in sorted(candidates, key=lambda c: c[0])
+        ]
+
+    def __probe_length(self, listing_id: str, ranges: list, length: int, today: date) -> dict | None:
+        for checkin, checkout in self.get_candidates(ranges, length, today):
+            try:
+                return self.__get_pricing(checkin, checkout, listing_id)
+            except (ValueError, RuntimeError) as e:
+                # ValueError or Response error
+                self.__logger.error('{}: Could not get pricing data: {}'.format(listing_id, str(e)))
+            except ConnectionError as e:
+                self.__logger.error('{}: Could not get pricing data: {}'.format(listing_id, str(e)))
+                # connection error due to network issues. wait for one minute for network connection to be
+                # re-established.
+                check_deadline(60)
+                sleep(60)
+
+        self.__logger.warning('{}: Unable to find available {} day range'.format(listing_id, length))
+        return None
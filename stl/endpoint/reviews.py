@@ -1,7 +1,7 @@
 import json
-import requests
 
 from stl.endpoint.base_endpoint import BaseEndpoint
+from stl.metrics.stage_timer import stage_timer
 
 
 class Reviews(BaseEndpoint):
@@ -20,12 +20,21 @@ class Reviews(BaseEndpoint):
 
         return reviews
 
+    @stage_timer.timed('reviews fetch')
     def __get_reviews_batch(self, listing_id: str, limit: int, offset: int):
         """Get reviews for a given listing ID in batches."""
         url = self.__get_url(listing_id, limit, offset)
         headers = {'x-airbnb-api-key': self._api_key}
-        response = requests.get(url, headers=headers)
+        response = self._send('GET', url, headers)
         data = json.loads(response.text)
+        self._archive_response(listing_id, data, {'limit': limit, 'offset': offset})
+
+        return self.parse_reviews(data)
+
+    @staticmethod
+    @stage_timer.timed('parsing')
+    def parse_reviews(data: dict):
+        """Parse a PdpReviews response into a list of reviews and the total number of reviews."""
         pdp_reviews = data['data']['merlin']['pdpReviews']
         if isinstance(pdp_reviews, dict):
             n_reviews_total = (
@@ -0,0 +1,60 @@
+from threading import Event, Lock
+from typing import Callable, Hashable
+
+from stl.endpoint.deadline import check_deadline, get_remaining
+from stl.exception.api import DeadlineExceededException
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls: while a call for a key is in flight, callers with the same key wait for it
+    and share its result or exception instead of making the call again.
+
+    A caller waits no longer than its own deadline. If the call in flight fails because the deadline of its caller
+    passed, waiting callers make the call again themselves.
+    """
+
+    def __init__(self):
+        self.__calls = {}
+        self.__lock = Lock()
+
+    def do(self, key: Hashable, func: Callable) -> tuple:
+        """Call func, or wait for the call in flight for key. Return (result, whether it was shared)."""
+        while True:
+            with self.__lock:
+                call = self.__calls.get(key)
+                if call is None:
+                    call = self.__calls[key] = _Call()
+                    break
+
+            if not call.done.wait(get_remaining()):
+                check_deadline()
+                continue
+            if isinstance(call.error, DeadlineExceededException):
+                continue  # the deadline of the caller making the call passed, not necessarily ours
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+class _Call:
+    __slots__ = ('done', 'error', 'result')
+
+    def __init__(self):
+        self.done = Event()
+        self.error = None
+        self.result = None
+
+
+single_flight = SingleFlight()
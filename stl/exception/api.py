@@ -13,3 +13,8 @@ class ForbiddenException(ApiException):
 class ServerException(ApiException):
     """HTTP 500 Server Error Exception"""
     pass
+
+
+class DeadlineExceededException(ApiException):
+    """Deadline of the API requests for a listing exceeded"""
+    pass
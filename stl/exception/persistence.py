@@ -0,0 +1,8 @@
+class BulkWriteException(Exception):
+    """Exception raised for bulk actions that failed."""
+
+    def __init__(self, errors: list):
+        super().__init__('{} bulk actions failed:\n{}'.format(len(errors), '\n'.join([
+            '{} of {}: {}'.format(error['op_type'], error['_id'], error['error']) for error in errors
+        ])))
+        self.errors = errors
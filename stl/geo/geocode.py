@@ -4,6 +4,8 @@ from geopy.geocoders import Nominatim, GoogleV3
 from geopy.extra.rate_limiter import RateLimiter
 from random import randint
 
+from stl.metrics.stage_timer import stage_timer
+
 
 class Geocoder:
 
@@ -14,6 +16,7 @@ class Geocoder:
         self.__geolocator = Nominatim(user_agent=user_agent)
         self.__osm_reverse_geo = RateLimiter(self.__geolocator.reverse, min_delay_seconds=1)
 
+    @stage_timer.timed('geocoding')
     def is_city(self, name: str, country: str):
         try:
             location = self.__geolocator.geocode({'city': name, 'country': country})
@@ -24,6 +27,7 @@ class Geocoder:
         except:
             return False
 
+    @stage_timer.timed('geocoding')
     def reverse(self, lat: float, lon: float) -> dict | bool:
         """Tries OSM reverse geocoder (Nomatim) first. If it fails, tries Google Maps reverse geocoder (untested)."""
         # Try OSM
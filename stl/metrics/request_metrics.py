@@ -0,0 +1,225 @@
+import json
+import os
+
+from collections import deque
+from threading import Lock
+
+
+class RequestMetrics:
+    """Count API requests, retries, errors, bytes received and throttling time, and record request latencies, per
+    operation (e.g. ExploreSearch, PdpPlatformSections).
+
+    Latencies are kept as a cumulative histogram for Prometheus, and as a window of the most recent samples to
+    estimate tail latency quantiles. Hedged requests are left out of the window: they are only sent for slow requests
+    and mostly answer fast, so they would pull down the quantiles that decide when to hedge.
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    WINDOW = 1000
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__operations = {}
+        self.__write_lock = Lock()
+
+    def observe_request(
+            self,
+            operation: str,
+            seconds: float,
+            n_bytes: int,
+            status_code: int = None,
+            is_hedge: bool = False
+    ):
+        """Record a request that was answered after given seconds with a response body of given size."""
+        with self.__lock:
+            op = self.__get_operation(operation)
+            op['requests'] += 1
+            op['bytes'] += n_bytes
+            op['seconds'] += seconds
+            if not is_hedge:
+                op['window'].append(seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    op['buckets'][i] += 1
+            if status_code is not None:
+                status = '{}xx'.format(status_code // 100)
+                op['statuses'][status] = op['statuses'].get(status, 0) + 1
+
+    def add_coalesced(self, operation: str):
+        """Record a request that was not sent, because it shared the response of an identical request in flight."""
+        with self.__lock:
+            self.__get_operation(operation)['coalesced'] += 1
+
+    def add_error(self, operation: str, error_class: str):
+        with self.__lock:
+            errors = self.__get_operation(operation)['errors']
+            errors[error_class] = errors.get(error_class, 0) + 1
+
+    def add_hedge(self, operation: str, won: bool):
+        """Record a hedged request, i.e. a duplicate of a slow request, and whether it answered first."""
+        with self.__lock:
+            op = self.__get_operation(operation)
+            op['hedges'] += 1
+            op['hedge_wins'] += int(won)
+
+    def add_retry(self, operation: str):
+        with self.__lock:
+            self.__get_operation(operation)['retries'] += 1
+
+    def add_throttle(self, operation: str, seconds: float):
+        with self.__lock:
+            self.__get_operation(operation)['throttle_seconds'] += seconds
+
+    def get_quantile(self, operation: str, q: float, min_samples: int = 1) -> float | None:
+        """Get quantile q (e.g. 0.95) of the most recent latencies of operation, or None with fewer than min_samples
+        requests.
+        """
+        with self.__lock:
+            window = sorted(self.__operations[operation]['window']) if operation in self.__operations else []
+
+        return self.__quantile(window, q) if len(window) >= min_samples else None
+
+    def get_requests(self) -> int:
+        """Get the number of API requests answered so far, over all operations."""
+        with self.__lock:
+            return sum(op['requests'] for op in self.__operations.values())
+
+    def get_report(self) -> dict:
+        """Get totals and latency quantiles per operation."""
+        report = {}
+        for name, op in self.__get_snapshot():
+            window = op['window']
+            report[name] = {
+                'requests':         op['requests'],
+                'retries':          op['retries'],
+                'hedges':           op['hedges'],
+                'hedge_wins':       op['hedge_wins'],
+                'coalesced':        op['coalesced'],
+                'errors':           op['errors'],
+                'statuses':         op['statuses'],
+                'bytes':            op['bytes'],
+                'seconds':          round(op['seconds'], 3),
+                'throttle_seconds': round(op['throttle_seconds'], 3),
+                'latency':          {
+                    'mean': round(op['seconds'] / op['requests'], 3) if op['requests'] else None,
+                    'p50':  self.__round(self.__quantile(window, 0.5)),
+                    'p95':  self.__round(self.__quantile(window, 0.95)),
+                    'p99':  self.__round(self.__quantile(window, 0.99)),
+                    'max':  self.__round(self.__quantile(window, 1.0)),
+                },
+            }
+
+        return report
+
+    def format_prometheus(self) -> str:
+        """Format metrics in the Prometheus text exposition format."""
+        operations = self.__get_snapshot()
+        lines = []
+
+        def add_metric(name: str, metric_type: str, description: str, samples: list):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append('{}{}{{{}}} {}'.format(
+                    name, suffix, ','.join('{}="{}"'.format(k, v) for k, v in labels.items()), value))
+
+        add_metric('stl_api_requests_total', 'counter', 'API requests answered, by HTTP status class.', [
+            ('', {'operation': name, 'status': status}, n)
+            for name, op in operations for status, n in sorted(op['statuses'].items())
+        ])
+        add_metric('stl_api_retries_total', 'counter', 'API requests retried after an error.', [
+            ('', {'operation': name}, op['retries']) for name, op in operations
+        ])
+        add_metric('stl_api_hedges_total', 'counter', 'Duplicate requests sent for slow API requests.', [
+            ('', {'operation': name}, op['hedges']) for name, op in operations
+        ])
+        add_metric('stl_api_hedge_wins_total', 'counter', 'Duplicate requests answered before the original request.', [
+            ('', {'operation': name}, op['hedge_wins']) for name, op in operations
+        ])
+        add_metric('stl_api_coalesced_total', 'counter', 'API requests answered by an identical request in flight.', [
+            ('', {'operation': name}, op['coalesced']) for name, op in operations
+        ])
+        add_metric('stl_api_errors_total', 'counter', 'API errors, by error class.', [
+            ('', {'operation': name, 'class': error_class}, n)
+            for name, op in operations for error_class, n in sorted(op['errors'].items())
+        ])
+        add_metric('stl_api_response_bytes_total', 'counter', 'Bytes of API response bodies received.', [
+            ('', {'operation': name}, op['bytes']) for name, op in operations
+        ])
+        add_metric('stl_api_throttle_seconds_total', 'counter', 'Seconds spent sleeping to throttle API requests.', [
+            ('', {'operation': name}, round(op['throttle_seconds'], 6)) for name, op in operations
+        ])
+        histogram = []
+        for name, op in operations:
+            for bound, n in zip(self.BUCKETS, op['buckets']):
+                histogram.append(('_bucket', {'operation': name, 'le': bound}, n))
+            histogram.append(('_bucket', {'operation': name, 'le': '+Inf'}, op['requests']))
+            histogram.append(('_sum', {'operation': name}, round(op['seconds'], 6)))
+            histogram.append(('_count', {'operation': name}, op['requests']))
+        add_metric('stl_api_request_duration_seconds', 'histogram', 'API request latency.', histogram)
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """Write metrics to a Prometheus text file, e.g. for the node exporter's textfile collector."""
+        self.__write(path, self.format_prometheus())
+
+    def write_report(self, path: str):
+        """Write totals and latency quantiles per operation to a JSON file."""
+        self.__write(path, json.dumps(self.get_report(), indent=2))
+
+    def reset(self):
+        with self.__lock:
+            self.__operations = {}
+
+    def __get_operation(self, operation: str) -> dict:
+        if operation not in self.__operations:
+            self.__operations[operation] = {
+                'requests':         0,
+                'retries':          0,
+                'hedges':           0,
+                'hedge_wins':       0,
+                'coalesced':        0,
+                'errors':           {},
+                'statuses':         {},
+                'bytes':            0,
+                'seconds':          0.0,
+                'throttle_seconds': 0.0,
+                'buckets':          [0] * len(self.BUCKETS),
+                'window':           deque(maxlen=self.WINDOW),
+            }
+
+        return self.__operations[operation]
+
+    def __get_snapshot(self) -> list:
+        """Get a copy of the metrics of all operations, sorted by operation, with sorted latency windows."""
+        with self.__lock:
+            return sorted((name, dict(
+                op,
+                errors=dict(op['errors']),
+                statuses=dict(op['statuses']),
+                buckets=list(op['buckets']),
+                window=sorted(op['window'])
+            )) for name, op in self.__operations.items())
+
+    @staticmethod
+    def __quantile(window: list, q: float) -> float | None:
+        """Get quantile q of sorted samples."""
+        if not window:
+            return None
+
+        return window[min(len(window) - 1, int(q * len(window)))]
+
+    @staticmethod
+    def __round(seconds: float | None) -> float | None:
+        return round(seconds, 3) if seconds is not None else None
+
+    def __write(self, path: str, content: str):
+        """Write file atomically, so that scrapers never read a partially written file."""
+        tmp_path = '{}.tmp'.format(path)
+        with self.__write_lock:
+            with open(tmp_path, 'w') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+
+
+request_metrics = RequestMetrics()
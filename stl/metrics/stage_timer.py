@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter
+
+
+class StageTimer:
+    """Attribute wall time to named stages of a run, e.g. fetching, parsing and persistence.
+
+    Stages may be nested: time spent in a nested stage is attributed to that stage only, not to the enclosing one.
+    Stages of different threads are timed separately, so with concurrent workers the stage times add up to more than
+    the wall time of the run.
+    """
+
+    def __init__(self):
+        self.__local = local()
+        self.__lock = Lock()
+        self.__stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the enclosed block as stage name."""
+        stack = self.__get_stack()
+        frame = [0.0]  # time spent in nested stages
+        stack.append(frame)
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - started_at
+            stack.pop()
+            if stack:
+                stack[-1][0] += duration
+            self.add(name, duration - frame[0])
+
+    def timed(self, name: str):
+        """Decorator timing every call of the decorated function as stage name."""
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorate
+
+    def add(self, name: str, seconds: float):
+        with self.__lock:
+            stats = self.__stages.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def get_stats(self) -> dict:
+        """Get count, total and maximum seconds by stage."""
+        with self.__lock:
+            return {name: dict(stats) for name, stats in self.__stages.items()}
+
+    def reset(self):
+        with self.__lock:
+            self.__stages = {}
+
+    def format_table(self, wall_seconds: float = None) -> str:
+        """Format stages as a table, slowest stage first."""
+        stats = sorted(self.get_stats().items(), key=lambda item: item[1]['seconds'], reverse=True)
+        lines = ['{:<24} {:>8} {:>12} {:>10} {:>10} {:>7}'.format(
+            'stage', 'count', 'total (s)', 'mean (ms)', 'max (ms)', 'wall')]
+        for name, s in stats:
+            lines.append('{:<24} {:>8} {:>12.2f} {:>10.1f} {:>10.1f} {:>7}'.format(
+                name,
+                s['count'],
+                s['seconds'],
+                s['seconds'] / s['count'] * 1000,
+                s['max_seconds'] * 1000,
+                '{:.0%}'.format(s['seconds'] / wall_seconds) if wall_seconds else ''
+            ))
+        if wall_seconds is not None:
+            lines.append('{:<24} {:>8} {:>12.2f}'.format('wall time', '', wall_seconds))
+
+        return '\n'.join(lines)
+
+    def __get_stack(self) -> list:
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+
+stage_timer = StageTimer()
@@ -0,0 +1,264 @@
+import base64
+import json
+import zlib
+
+from datetime import date, timedelta
+from random import Random
+
+from stl.endpoint.pdp import Pdp
+
+
+class MockPayloads:
+    """Generate synthetic API responses in the shapes parsed by the endpoints.
+
+    Listings are generated on demand from their id, so any number of them can be served without keeping them in
+    memory, and the same listing always has the same details, reviews, calendar and prices. Search queries page
+    through windows of the same set of listings, so different queries overlap as they would for neighbouring areas.
+    """
+    FIRST_ID = 10_000_000
+    PAGE_SIZE = 20
+
+    ROOM_TYPES = [
+        ('Entire home/apt', 'entire_home', 'Entire rental unit'),
+        ('Entire home/apt', 'entire_home', 'Entire home'),
+        ('Private room', 'private_room', 'Private room in home'),
+        ('Hotel room', 'hotel_room', 'Room in boutique hotel'),
+    ]
+    NEIGHBORHOODS = ['Downtown', 'Old Town', 'North Park', 'Little Italy', 'Hillcrest', 'Ocean Beach']
+
+    def __init__(self, n_listings: int = 100_000, seed: int = 0):
+        self.__n_listings = n_listings
+        self.__seed = seed
+
+    def explore(self, query: str, items_offset: int = 0) -> dict:
+        """ExploreSearch response: one page of search results for query."""
+        components = [c.strip() for c in query.split(',')]
+        geography = {
+            'city':        components[0],
+            'country':     components[-1] if len(components) > 2 else 'United States',
+            'fullAddress': ', '.join(components),
+            'placeId':     'mock-{:08x}'.format(self.__hash(query)),
+            'state':       components[1] if len(components) > 1 else None,
+            'province':    None,
+        }
+        start = self.__hash(query) % self.__n_listings
+        items = []
+        for i in range(items_offset, min(items_offset + self.PAGE_SIZE, self.__n_listings)):
+            listing_id = str(self.FIRST_ID + (start + i) % self.__n_listings)
+            items.append(self.__get_search_item(listing_id, geography['city']))
+
+        return {'data': {'dora': {'exploreV3': {
+            'metadata': {
+                'geography':          geography,
+                'paginationMetadata': {
+                    'hasNextPage':  items_offset + self.PAGE_SIZE < self.__n_listings,
+                    'itemsOffset':  items_offset + self.PAGE_SIZE,
+                    'totalCount':   self.__n_listings,
+                },
+            },
+            'sections': [
+                {'sectionComponentType': 'filters_Explore', 'items': []},
+                {'sectionComponentType': 'listings_ListingsGrid_Explore', 'items': items},
+            ],
+        }}}}
+
+    def pdp(self, listing_id: str) -> dict:
+        """PdpPlatformSections response: listing details."""
+        rnd = self.__get_random(listing_id, 'pdp')
+        amenity_ids = sorted(rnd.sample(sorted(Pdp.AMENITIES), 20))
+        sections = {
+            'AMENITIES_DEFAULT':    {'seeAllAmenitiesGroups': [
+                {'title': 'Guest access', 'amenities': [
+                    {'id': 'guest_access_0_', 'title': 'Entire place', 'subtitle': None, 'available': True},
+                ]},
+                {'title': 'Amenities', 'amenities': [{
+                    'id':        'mock_amenity_{}_'.format(amenity_id),
+                    'title':     Pdp.AMENITIES[amenity_id].capitalize(),
+                    'subtitle':  None,
+                    'available': rnd.random() < 0.9,
+                } for amenity_id in amenity_ids]},
+            ]},
+            'DESCRIPTION_DEFAULT':  {'htmlDescription': {
+                'htmlText': '<p>Synthetic listing <b>{}</b>.</p>{}'.format(
+                    listing_id, '<p>Close to everything.</p>' * rnd.randint(1, 20))
+            }},
+            'HOST_PROFILE_DEFAULT': {'hostInfos': [
+                {'title': 'During your stay', 'html': {'htmlText': '<span>Available by message.</span>'}},
+            ]},
+            'LOCATION_DEFAULT':     {'seeAllLocationDetails': [
+                {'title': 'Getting around', 'content': {'htmlText': '<span>Walkable.</span>'}},
+            ]},
+            'POLICIES_DEFAULT':     {
+                'additionalHouseRules': 'No shoes inside.' if rnd.random() < 0.5 else None,
+                'houseRules':           [{'title': 'Check-in after 4:00 PM'}] + (
+                    [{'title': 'No parties or events'}] if rnd.random() < 0.7 else []),
+                'listingExpectations':  [{'title': 'Must climb stairs', 'subtitle': 'Second floor'}],
+            },
+        }
+
+        return {'data': {'merlin': {'pdpSections': {
+            'id':       listing_id,
+            'metadata': {
+                'bookingPrefetchData': {'canInstantBook': rnd.random() < 0.6, 'isHotelRatePlanEnabled': False},
+                'loggingContext':      {'eventDataLogging': {
+                    'accuracyRating':           round(rnd.uniform(4, 5), 2),
+                    'checkinRating':            round(rnd.uniform(4, 5), 2),
+                    'cleanlinessRating':        round(rnd.uniform(4, 5), 2),
+                    'communicationRating':      round(rnd.uniform(4, 5), 2),
+                    'locationRating':           round(rnd.uniform(4, 5), 2),
+                    'valueRating':              round(rnd.uniform(4, 5), 2),
+                    'guestSatisfactionOverall': round(rnd.uniform(4, 5), 2),
+                }},
+            },
+            'sections': [{'sectionId': section_id, 'section': s} for section_id, s in sections.items()],
+        }}}}
+
+    def reviews(self, listing_id: str, limit: int, offset: int = 0) -> dict:
+        """PdpReviews response: one batch of reviews."""
+        n_reviews = self.__get_random(listing_id, 'search').randint(0, 300)
+        rnd = self.__get_random(listing_id, 'reviews')
+        created_at = date(2020, 1, 1) + timedelta(days=rnd.randint(0, 365))
+        reviews = []
+        for i in range(offset, min(offset + limit, n_reviews)):
+            reviews.append({
+                'comments':   'Review {} of listing {}. Great stay, would book again!'.format(i, listing_id),
+                'createdAt':  (created_at + timedelta(days=i * 3)).strftime('%Y-%m-%dT10:00:00Z'),
+                'language':   'en',
+                'rating':     rnd.choice([3, 4, 5, 5, 5]),
+                'response':   None,
+            })
+
+        return {'data': {'merlin': {'pdpReviews': {'metadata': {'reviewsCount': n_reviews}, 'reviews': reviews}}}}
+
+    def calendar(self, listing_id: str, month: int, year: int, count: int = 12) -> dict:
+        """PdpAvailabilityCalendar response: availability of count months, starting with given month."""
+        min_nights, max_nights = self.__get_stay_limits(listing_id)
+        calendar_months = []
+        for i in range(count):
+            month_year, month_index = divmod(month - 1 + i, 12)
+            first_day = date(year + month_year, month_index + 1, 1)
+            days = []
+            day = first_day
+            while day.month == first_day.month:
+                days.append({
+                    'calendarDate': day.isoformat(),
+                    'available':    not self.__is_booked(listing_id, day),
+                    'minNights':    min_nights,
+                    'maxNights':    max_nights,
+                })
+                day += timedelta(days=1)
+            calendar_months.append({'month': first_day.month, 'year': first_day.year, 'days': days})
+
+        return {'data': {'merlin': {'pdpAvailabilityCalendar': {'calendarMonths': calendar_months}}}}
+
+    def checkout(self, product_id: str, checkin: str, checkout: str) -> dict:
+        """startStaysCheckout response: price breakdown of a stay, or an error if any night is booked."""
+        listing_id = base64.b64decode(product_id).decode('utf-8').split(':')[-1]
+        checkin_date, checkout_date = date.fromisoformat(checkin), date.fromisoformat(checkout)
+        nights = (checkout_date - checkin_date).days
+        min_nights, max_nights = self.__get_stay_limits(listing_id)
+        booked = any(self.__is_booked(listing_id, checkin_date + timedelta(days=i)) for i in range(nights))
+        if booked or not min_nights <= nights <= max_nights:
+            return {'data': {'startStayCheckoutFlow': {'stayCheckout': {'sections': {
+                'temporaryQuickPayData': None,
+                'metadata':              {'errorData': {'errorMessage': 'Those dates are not available'}},
+            }}}}}
+
+        rnd = self.__get_random(listing_id, 'pricing')
+        mega = 1_000_000
+        accommodation = self.__get_nightly_price(listing_id) * nights * mega
+        items = [{'type': 'ACCOMMODATION', 'localizedTitle': 'Accommodation', 'total': {'amountMicros': accommodation}}]
+        discount = 0
+        if nights >= 28:
+            discount = -int(accommodation * rnd.choice([0, 0.15, 0.25]))
+            title = 'Monthly discount'
+        elif nights >= 7:
+            discount = -int(accommodation * rnd.choice([0, 0.05, 0.1]))
+            title = 'Weekly discount'
+        if discount:
+            items.append({'type': 'DISCOUNT', 'localizedTitle': title, 'total': {'amountMicros': discount}})
+        cleaning_fee = rnd.choice([0, 50, 90, 150]) * mega
+        if cleaning_fee:
+            items.append({'type': 'CLEANING_FEE', 'localizedTitle': 'Cleaning fee', 'total': {
+                'amountMicros': cleaning_fee}})
+        subtotal = accommodation + discount + cleaning_fee
+        guest_fee = int(subtotal * 0.14)
+        taxes = int(subtotal * 0.105)
+        items.append({'type': 'AIRBNB_GUEST_FEE', 'localizedTitle': 'Service fee', 'total': {
+            'amountMicros': guest_fee}})
+        items.append({'type': 'TAXES', 'localizedTitle': 'Taxes', 'total': {'amountMicros': taxes}})
+        price_breakdown = {'priceItems': items, 'total': {'total': {'amountMicros': subtotal + guest_fee + taxes}}}
+
+        return {'data': {'startStayCheckoutFlow': {'stayCheckout': {'sections': {
+            'temporaryQuickPayData': {'bootstrapPaymentsJSON': json.dumps(
+                {'productPriceBreakdown': {'priceBreakdown': price_breakdown}})},
+            'metadata':              {'errorData': None},
+        }}}}}
+
+    def __get_search_item(self, listing_id: str, city: str) -> dict:
+        rnd = self.__get_random(listing_id, 'search')
+        n_reviews = rnd.randint(0, 300)  # first draw, also used by reviews()
+        room_type, room_type_category, room_and_property_type = rnd.choice(self.ROOM_TYPES)
+        bedrooms = rnd.randint(0, 5)
+        neighborhood = rnd.choice(self.NEIGHBORHOODS)
+        price = self.__get_nightly_price(listing_id)
+        n_pictures = rnd.randint(5, 40)
+
+        return {
+            'listing':      {
+                'id':                    listing_id,
+                'avgRating':             round(rnd.uniform(3.5, 5), 2) if n_reviews else None,
+                'bathrooms':             float(rnd.randint(1, 4)),
+                'bedrooms':              bedrooms,
+                'beds':                  max(1, bedrooms),
+                'isBusinessTravelReady': rnd.random() < 0.2,
+                'user':                  {'id': str(rnd.randint(1, self.__n_listings // 3 + 1))},
+                'lat':                   round(32.7 + rnd.uniform(-0.1, 0.1), 6),
+                'lng':                   round(-117.15 + rnd.uniform(-0.1, 0.1), 6),
+                'name':                  '{} in {}'.format(room_and_property_type, neighborhood),
+                'neighborhoodOverview':  'Quiet street close to shops.',
+                'personCapacity':        max(1, bedrooms) * 2,
+                'pictureCount':          n_pictures,
+                'contextualPictures':    [
+                    {'picture': 'https://a0.muscache.com/im/pictures/{}-{}.jpg'.format(listing_id, i)}
+                    for i in range(min(n_pictures, 10))
+                ],
+                'reviewsCount':          n_reviews,
+                'roomAndPropertyType':   room_and_property_type,
+                'roomType':              room_type,
+                'roomTypeCategory':      room_type_category,
+                'starRating':            round(rnd.uniform(3.5, 5) * 2) / 2 if n_reviews else None,
+                'city':                  city,  # the search city, so that listings are not reverse geocoded
+                'localizedCity':         city,
+                'neighborhood':          neighborhood,
+                'localizedNeighborhood': neighborhood,
+                'publicAddress':         '{}, {}'.format(city, neighborhood),
+            },
+            'pricingQuote': {
+                'monthlyPriceFactor':        0.8,
+                'weeklyPriceFactor':         0.9,
+                'structuredStayDisplayPrice': {
+                    'primaryLine':   {'price': '${:,}'.format(price), 'qualifier': 'night'},
+                    'secondaryLine': None,
+                },
+            },
+        }
+
+    def __get_nightly_price(self, listing_id: str) -> int:
+        return self.__get_random(listing_id, 'price').randint(40, 900)
+
+    def __get_stay_limits(self, listing_id: str) -> tuple:
+        rnd = self.__get_random(listing_id, 'stay')
+        return rnd.choice([1, 1, 2, 3, 7, 30]), rnd.choice([28, 90, 365, 1125])
+
+    def __is_booked(self, listing_id: str, day: date) -> bool:
+        """Bookings are blocks of a few nights, so that some but not all stay lengths are available."""
+        block_length = 2 + self.__hash(listing_id) % 6
+        block = (day.toordinal() + self.__hash(listing_id)) // block_length
+        return self.__hash('{}:{}'.format(listing_id, block)) % 100 < 30
+
+    def __get_random(self, listing_id: str, purpose: str) -> Random:
+        return Random(self.__hash('{}:{}'.format(listing_id, purpose)))
+
+    def __hash(self, key: str) -> int:
+        return zlib.crc32('{}:{}'.format(self.__seed, key).encode('utf-8'))
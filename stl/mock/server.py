@@ -0,0 +1,198 @@
+import json
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+from random import Random
+from threading import Lock
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlparse
+
+from stl.mock.payloads import MockPayloads
+
+
+class LatencyModel:
+    """Response latency distribution, given as "<distribution>:<parameters in ms>", e.g.:
+
+        fixed:100               100ms
+        uniform:50:500          50ms to 500ms
+        lognormal:150:0.6       log-normal around a median of 150ms with sigma 0.6, i.e. with a long tail
+    """
+
+    def __init__(self, spec: str = 'fixed:0'):
+        distribution, *params = spec.split(':')
+        if distribution not in ['fixed', 'uniform', 'lognormal']:
+            raise ValueError('Unknown latency distribution: {}'.format(distribution))
+        self.__distribution = distribution
+        self.__params = [float(p) for p in params]
+        self.__random = Random()
+
+    def sample(self) -> float:
+        """Get a latency in seconds."""
+        if self.__distribution == 'uniform':
+            return self.__random.uniform(*self.__params) / 1000
+        if self.__distribution == 'lognormal':
+            median, sigma = self.__params
+            return median * self.__random.lognormvariate(0, sigma) / 1000
+
+        return self.__params[0] / 1000
+
+
+class TokenBucket:
+    """Allow rate requests per second on average, with bursts of up to burst requests."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.__burst = burst or max(1, int(rate))
+        self.__lock = Lock()
+        self.__rate = rate
+        self.__tokens = float(self.__burst)
+        self.__updated_at = monotonic()
+
+    def acquire(self) -> bool:
+        with self.__lock:
+            now = monotonic()
+            self.__tokens = min(self.__burst, self.__tokens + (now - self.__updated_at) * self.__rate)
+            self.__updated_at = now
+            if self.__tokens < 1:
+                return False
+            self.__tokens -= 1
+            return True
+
+
+class MockServer:
+    """Local stand-in for the Airbnb API, for load testing without making any requests to Airbnb.
+
+    Serves synthetic ExploreSearch, PdpPlatformSections, PdpReviews, PdpAvailabilityCalendar and startStaysCheckout
+    responses, and listing pages (/rooms/<id>). Responses are delayed according to a latency model per operation.
+    Errors are injected at random with given rates per error class, in the shapes handled by the endpoints:
+
+        forbidden       HTTP 403 error
+        server_error    HTTP 503 error
+        data_fetching   DataFetchingException
+        try_again       "Please try again" error
+
+    Requests over the rate limit are answered with HTTP 429 and a "please try again" error.
+    """
+    ERRORS = {
+        'forbidden':     (403, {'message': 'Forbidden', 'extensions': {'response': {'statusCode': 403}}}),
+        'server_error':  (503, {'message': 'Service unavailable', 'extensions': {'response': {'statusCode': 503}}}),
+        'data_fetching': (200, {
+            'message':    'Exception while fetching data',
+            'extensions': {'classification': 'DataFetchingException'}
+        }),
+        'try_again':     (200, {'message': 'Something went wrong. Please try again.'}),
+    }
+
+    def __init__(
+            self,
+            payloads: MockPayloads,
+            logger: Logger,
+            latencies: dict = None,
+            error_rates: dict = None,
+            rate_limit: float = None
+    ):
+        """latencies maps operation names to latency models, with key None for the default model."""
+        unknown_errors = set(error_rates or {}) - set(self.ERRORS)
+        if unknown_errors:
+            raise ValueError('Unknown error classes: {}'.format(', '.join(sorted(unknown_errors))))
+        self.__error_rates = error_rates or {}
+        self.__latencies = latencies or {}
+        self.__logger = logger
+        self.__payloads = payloads
+        self.__random = Random()
+        self.__rate_limiter = TokenBucket(rate_limit) if rate_limit else None
+        self.__server = None
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8766):
+        """Serve requests until shutdown() is called."""
+        self.__server = ThreadingHTTPServer((host, port), _RequestHandler)
+        self.__server.daemon_threads = True
+        self.__server.request_queue_size = 1024
+        self.__server.mock = self
+        self.__logger.warning('Serving mock Airbnb API on http://{}:{}'.format(host, port))
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.__server.server_close()
+
+    def shutdown(self):
+        """Stop serving requests. Must not be called from the thread running serve()."""
+        if self.__server is not None:
+            self.__server.shutdown()
+
+    def handle(self, method: str, url: str, body: bytes) -> tuple:
+        """Handle API request, return (HTTP status, response, seconds to delay the response)."""
+        parsed_url = urlparse(url)
+        path = parsed_url.path.rstrip('/')
+        operation = path.rsplit('/', 1)[-1]
+        latency = self.__latencies.get(operation) or self.__latencies.get(None)
+        delay = latency.sample() if latency else 0
+
+        if path.startswith('/rooms/'):
+            return 200, '<html><body>Listing {}</body></html>'.format(operation), delay
+        if not path.startswith('/api/v3/'):
+            return 404, {'errors': [{'message': 'Not found'}]}, 0
+
+        if self.__rate_limiter and not self.__rate_limiter.acquire():
+            return 429, {'errors': [{'message': 'Too many requests. Please try again later.'}]}, 0
+        for error_class, rate in self.__error_rates.items():
+            if self.__random.random() < rate:
+                status, error = self.ERRORS[error_class]
+                return status, {'data': None, 'errors': [error]}, delay
+
+        query = {k: v[0] for k, v in parse_qs(parsed_url.query).items()}
+        try:
+            variables = json.loads(query.get('variables') or 'null')
+            if method == 'POST':
+                variables = json.loads(body)['variables']
+            return 200, self.__get_payload(operation, query, variables), delay
+        except (KeyError, TypeError, ValueError) as e:
+            self.__logger.warning('Bad mock API request {} {}: {!r}'.format(method, url, e))
+            return 400, {'errors': [{'message': 'Bad request: {!r}'.format(e)}]}, 0
+
+    def __get_payload(self, operation: str, query: dict, variables: dict) -> dict:
+        if operation == 'ExploreSearch':
+            request = variables['request']
+            return self.__payloads.explore(request['query'], int(request.get('itemsOffset') or 0))
+        if operation == 'PdpPlatformSections':
+            return self.__payloads.pdp(variables['request']['id'])
+        if operation == 'PdpReviews':
+            request = variables['request']
+            return self.__payloads.reviews(request['listingId'], int(request['limit']), int(request.get('offset', 0)))
+        if operation == 'PdpAvailabilityCalendar':
+            request = variables['request']
+            return self.__payloads.calendar(
+                request['listingId'], int(request['month']), int(request['year']), int(request['count']))
+        if operation == 'startStaysCheckout':
+            request = variables['input']
+            return self.__payloads.checkout(request['productId'], request['checkinDate'], request['checkoutDate'])
+
+        raise ValueError('Unknown operation {} ({})'.format(operation, query.get('operationName')))
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive, as the Airbnb API does
+
+    def do_GET(self):
+        self.__respond(*self.server.mock.handle('GET', self.path, b''))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.__respond(*self.server.mock.handle('POST', self.path, body))
+
+    def log_message(self, format: str, *args):
+        pass
+
+    def __respond(self, status: int, data, delay: float):
+        if delay:
+            sleep(delay)
+        if isinstance(data, str):
+            content = data.encode('utf-8')
+            content_type = 'text/html; charset=utf-8'
+        else:
+            content = json.dumps(data).encode('utf-8')
+            content_type = 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
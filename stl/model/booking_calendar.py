@@ -0,0 +1,151 @@
+import struct
+
+from datetime import date, timedelta
+from typing import Iterable, Iterator
+
+
+class BookingCalendar:
+    """Compact booking calendar: a start date ordinal plus bitsets of known and booked days.
+
+    Bit i of each bitset refers to the day `start + i`. Date ranges are found with integer bit operations instead of
+    per-day date parsing. Convert to a {date string: is booked} dict only where one is needed, e.g. when persisting.
+    """
+    __slots__ = ('start', 'length', 'known', 'booked')
+    __HEADER = struct.Struct('<IH')
+
+    def __init__(self, start: int, length: int, known: int, booked: int):
+        self.start = start
+        self.length = length
+        self.known = known
+        self.booked = booked & known
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BookingCalendar):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __iter__(self) -> Iterator[str]:
+        return (dt for dt, _ in self.items())
+
+    def __len__(self) -> int:
+        return self.known.bit_count()
+
+    def __repr__(self) -> str:
+        return '<BookingCalendar {} +{} days, {} booked>'.format(
+            date.fromordinal(self.start), self.length, self.booked.bit_count())
+
+    @classmethod
+    def from_days(cls, days: Iterable[tuple]) -> 'BookingCalendar':
+        """Create calendar from (yyyy-mm-dd, is booked) pairs. Later pairs override earlier pairs for the same day."""
+        ordinals = {date.fromisoformat(dt).toordinal(): is_booked for dt, is_booked in days}
+        if not ordinals:
+            return cls(date.today().toordinal(), 0, 0, 0)
+
+        start = min(ordinals)
+        known = booked = 0
+        for ordinal, is_booked in ordinals.items():
+            bit = 1 << (ordinal - start)
+            known |= bit
+            if is_booked:
+                booked |= bit
+
+        return cls(start, max(ordinals) - start + 1, known, booked)
+
+    @classmethod
+    def from_dict(cls, calendar: dict) -> 'BookingCalendar':
+        return cls.from_days(calendar.items())
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> 'BookingCalendar':
+        start, length = cls.__HEADER.unpack_from(data)
+        n_bytes = (length + 7) // 8
+        offset = cls.__HEADER.size
+        known = int.from_bytes(data[offset:offset + n_bytes], 'little')
+        booked = int.from_bytes(data[offset + n_bytes:offset + 2 * n_bytes], 'little')
+        return cls(start, length, known, booked)
+
+    def serialize(self) -> bytes:
+        n_bytes = (self.length + 7) // 8
+        return (self.__HEADER.pack(self.start, self.length)
+                + self.known.to_bytes(n_bytes, 'little')
+                + self.booked.to_bytes(n_bytes, 'little'))
+
+    def booked_dates(self) -> list:
+        """Get booked dates as yyyy-mm-dd strings."""
+        return [self.__date_str(offset + i) for offset, length in self.runs(self.booked) for i in range(length)]
+
+    def changed_since(self, previous: 'BookingCalendar') -> 'BookingCalendar':
+        """Get a copy of the calendar with only the days that were unknown in the previous calendar or changed since."""
+        unchanged = self.__align(previous.known, previous.start) & ~(
+                self.__align(previous.booked, previous.start) ^ self.booked)
+        return BookingCalendar(self.start, self.length, self.known & ~unchanged, self.booked)
+
+    def available_ranges(self) -> list:
+        """Get (first date, last date) pairs of yyyy-mm-dd strings for the runs of available days."""
+        return [
+            (self.__date_str(offset), self.__date_str(offset + length - 1))
+            for offset, length in self.runs(self.known & ~self.booked)
+        ]
+
+    def first_available(self) -> str | None:
+        """Get the first available date as a yyyy-mm-dd string."""
+        available = self.known & ~self.booked
+        if not available:
+            return None
+        return self.__date_str((available & -available).bit_length() - 1)
+
+    def get_ranges(self, status: str) -> list:
+        """Get list of date range objects for either "available" or "booked" dates."""
+        if status == 'booked':
+            bits = self.booked
+        elif status == 'available':
+            bits = self.known & ~self.booked
+        else:
+            raise ValueError('status must be one of "available" or "booked"')
+
+        ranges = []
+        for offset, length in self.runs(bits):
+            start_date = date.fromordinal(self.start + offset)
+            ranges.append({
+                'start':  start_date,
+                'end':    start_date + timedelta(days=length),
+                'length': length
+            })
+
+        return ranges
+
+    def items(self) -> Iterator[tuple]:
+        """Iterate over (yyyy-mm-dd, is booked) pairs for all known days, in date order."""
+        for offset, length in self.runs(self.known):
+            for i in range(offset, offset + length):
+                yield self.__date_str(i), bool(self.booked >> i & 1)
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def without(self, start: date, length: int) -> 'BookingCalendar':
+        """Get a copy of the calendar with given date range removed (neither available nor booked)."""
+        mask = ~self.__align(((1 << length) - 1), start.toordinal())
+        return BookingCalendar(self.start, self.length, self.known & mask, self.booked & mask)
+
+    @staticmethod
+    def runs(bits: int) -> Iterator[tuple]:
+        """Yield (offset, length) for each run of consecutive set bits."""
+        offset = 0
+        while bits:
+            zeros = (bits & -bits).bit_length() - 1
+            bits >>= zeros
+            offset += zeros
+            ones = (bits ^ (bits + 1)).bit_length() - 1
+            yield offset, ones
+            bits >>= ones
+            offset += ones
+
+    def __align(self, bits: int, start: int) -> int:
+        """Shift bitset starting at ordinal `start` so that it lines up with this calendar."""
+        if start >= self.start:
+            return bits << (start - self.start)
+        return bits >> (self.start - start)
+
+    def __date_str(self, offset: int) -> str:
+        return date.fromordinal(self.start + offset).isoformat()
@@ -0,0 +1,104 @@
+import json
+
+from datetime import datetime
+
+
+class Listing:
+    """Schema of the normalized listings produced by `Pdp.get_listing`."""
+    FIELDS = {
+        'id':                     str,
+        'access':                 str,
+        'additional_house_rules': str,
+        'allows_events':          bool,
+        'amenities':              list[str],
+        'amenity_ids':            list[int],
+        'avg_rating':             float,
+        'bathrooms':              float,
+        'bedrooms':               int,
+        'beds':                   int,
+        'business_travel_ready':  bool,
+        'can_instant_book':       bool,
+        'city':                   str,
+        'content_hash':           str,
+        'coordinates':            {'lat': float, 'lon': float},
+        'country':                str,
+        'description':            str,
+        'host_id':                str,
+        'house_rules':            list[str],
+        'interaction':            str,
+        'is_hotel':               bool,
+        'latitude':               float,
+        'listing_expectations':   str,
+        'longitude':              float,
+        'monthly_price_factor':   float,
+        'name':                   str,
+        'neighborhood':           str,
+        'neighborhood_overview':  str,
+        'person_capacity':        int,
+        'photo_count':            int,
+        'photos':                 list[str],
+        'place_id':               str,
+        'price_rate':             int,
+        'price_rate_type':        str,
+        'product_id':             str,
+        'province':               str,
+        'rating_accuracy':        float,
+        'rating_checkin':         float,
+        'rating_cleanliness':     float,
+        'rating_communication':   float,
+        'rating_location':        float,
+        'rating_value':           float,
+        'review_count':           int,
+        'reviews':                list[dict],
+        'room_and_property_type': str,
+        'room_type':              str,
+        'room_type_category':     str,
+        'satisfaction_guest':     float,
+        'source':                 str,
+        'star_rating':            float,
+        'state':                  str,
+        'total_price':            int,
+        'transit':                str,
+        'updated_at':             datetime,
+        'url':                    str,
+        'weekly_price_factor':    float,
+    }
+
+    REVIEW_FIELDS = {
+        'comments':   str,
+        'created_at': str,
+        'language':   str,
+        'rating':     int,
+        'response':   str,
+    }
+
+    @staticmethod
+    def get_flat_field_names() -> list:
+        """Get field names of flattened listings: nested objects become one `<field>_<key>` field per key."""
+        names = []
+        for name, field_type in Listing.FIELDS.items():
+            if isinstance(field_type, dict):
+                names.extend('{}_{}'.format(name, key) for key in field_type)
+            else:
+                names.append(name)
+
+        return names
+
+    @staticmethod
+    def flatten(listing: dict) -> dict:
+        """Flatten a listing to scalar values: nested objects are split into fields and lists are JSON encoded.
+
+        Fields not in the schema are dropped, missing fields are None.
+        """
+        flat = {}
+        for name, field_type in Listing.FIELDS.items():
+            value = listing.get(name)
+            if isinstance(field_type, dict):
+                for key in field_type:
+                    flat['{}_{}'.format(name, key)] = value.get(key) if value else None
+            elif isinstance(value, list):
+                flat[name] = json.dumps(value, default=str, ensure_ascii=False)
+            else:
+                flat[name] = value
+
+        return flat
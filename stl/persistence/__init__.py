@@ -5,3 +5,45 @@ class PersistenceInterface(ABC):
     @abstractmethod
     def save(self, query: str, listings: list):
         pass
+
+    def close(self):
+        """Flush any buffered writes and release resources."""
+        pass
+
+    def flush(self):
+        """Write any buffered writes, keeping the persistence layer open."""
+        pass
+
+
+class CalendarPersistenceInterface(PersistenceInterface):
+    """Persistence layer that can also enumerate stored listings and update their calendars and pricing, as required
+    to update calendars for all listings.
+    """
+
+    @abstractmethod
+    def get_all_index_ids(self, since: str):
+        pass
+
+    @abstractmethod
+    def get_refresh_candidates(self, since: str):
+        pass
+
+    @abstractmethod
+    def mark_deleted(self, listing_id: str):
+        pass
+
+    @abstractmethod
+    def update_calendar(
+            self,
+            listing_id: str,
+            calendar,
+            pricing: dict = None,
+            min_nights: int = None,
+            max_nights: int = None,
+            previous=None
+    ):
+        pass
+
+    @abstractmethod
+    def update_pricing(self, listing_id: str, pricing: dict, min_nights: int = None, max_nights: int = None):
+        pass
@@ -0,0 +1,112 @@
+import json
+
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk
+from logging import Logger
+from threading import Event, RLock, Thread
+from time import monotonic
+
+from stl.exception.persistence import BulkWriteException
+
+
+class BulkBuffer:
+    """Write-behind buffer that collects Elasticsearch bulk actions and sends them in batches.
+
+    The buffer is flushed once it holds `max_actions` actions or `max_bytes` bytes, or once its oldest action is
+    `max_seconds` old. A flush runs on the thread whose action filled the buffer while other producers wait for it, so
+    a slow cluster slows down the producers instead of letting the buffer grow. Bulk requests rejected with 429 Too Many
+    Requests are retried with exponential backoff. Actions that fail are logged and counted in `n_errors`, and raised
+    as a BulkWriteException by the next call to flush() or close().
+    """
+
+    def __init__(
+            self,
+            es: Elasticsearch,
+            index: str,
+            logger: Logger,
+            max_actions: int = 500,
+            max_bytes: int = 5 * 1024 * 1024,
+            max_seconds: float = 5.0,
+            max_retries: int = 3
+    ):
+        self.__actions = []
+        self.__errors = []
+        self.__es = es
+        self.__first_added_at = None
+        self.__index = index
+        self.__lock = RLock()
+        self.__logger = logger
+        self.__max_actions = max_actions
+        self.__max_bytes = max_bytes
+        self.__max_retries = max_retries
+        self.__max_seconds = max_seconds
+        self.__n_bytes = 0
+        self.__stopped = Event()
+        self.__timer = None
+        self.n_errors = 0
+
+    def add(self, action: dict):
+        """Add a bulk action, flushing the buffer if it is full."""
+        with self.__lock:
+            if self.__timer is None:
+                self.__timer = Thread(target=self.__flush_periodically, name='stl-bulk-buffer', daemon=True)
+                self.__timer.start()
+            if not self.__actions:
+                self.__first_added_at = monotonic()
+            self.__actions.append(action)
+            self.__n_bytes += len(json.dumps(action, default=str))
+            if len(self.__actions) >= self.__max_actions or self.__n_bytes >= self.__max_bytes:
+                self.__send()
+
+    def close(self):
+        """Stop the flush timer and flush any remaining actions."""
+        self.__stopped.set()
+        if self.__timer is not None:
+            self.__timer.join()
+        self.flush()
+
+    def flush(self):
+        """Send all buffered actions. Raise BulkWriteException if any action failed since the last flush."""
+        with self.__lock:
+            self.__send()
+            errors = self.__errors
+            self.__errors = []
+        if errors:
+            raise BulkWriteException(errors)
+
+    def __send(self):
+        with self.__lock:
+            actions = self.__actions
+            if not actions:
+                return
+            self.__actions = []
+            self.__n_bytes = 0
+            started_at = monotonic()
+            n_ok = 0
+            for ok, item in streaming_bulk(
+                    self.__es,
+                    actions,
+                    index=self.__index,
+                    chunk_size=self.__max_actions,
+                    max_chunk_bytes=self.__max_bytes,
+                    raise_on_error=False,
+                    max_retries=self.__max_retries,
+                    initial_backoff=2
+            ):
+                if ok:
+                    n_ok += 1
+                    continue
+                self.n_errors += 1
+                op_type, result = item.popitem()
+                self.__errors.append({'op_type': op_type, '_id': result.get('_id'), 'error': result.get('error')})
+                self.__logger.error('Bulk {} of {} failed: {}'.format(op_type, result.get('_id'), result.get('error')))
+
+            duration = monotonic() - started_at
+            log = self.__logger.warning if duration > self.__max_seconds else self.__logger.info
+            log('Flushed {} of {} bulk actions in {:.2f}s'.format(n_ok, len(actions), duration))
+
+    def __flush_periodically(self):
+        while not self.__stopped.wait(min(1.0, self.__max_seconds)):
+            with self.__lock:
+                if self.__actions and monotonic() - self.__first_added_at >= self.__max_seconds:
+                    self.__send()
@@ -0,0 +1,303 @@
+import fcntl
+import mmap
+import numpy as np
+import os
+import struct
+
+from datetime import date
+from threading import Lock
+from time import monotonic
+from typing import Iterator
+
+from stl.model.booking_calendar import BookingCalendar
+
+
+class SnapshotDay:
+    """Read-only, memory-mapped view of the calendar snapshots taken on one scrape day.
+
+    File layout: a header, an index of (listing id, first run, number of known runs, number of booked runs) sorted by
+    listing id, then the runs of all rows. A run is a fixed-width (offset, length) pair of days, relative to the scrape
+    day, so that nights are counted over all rows at once with numpy, straight from the mapped file.
+    """
+    HEADER = struct.Struct('<4sHHIII')  # magic, version, reserved, scrape date ordinal, number of rows, number of runs
+    INDEX_ENTRY = struct.Struct('<QIHH')  # listing id, first run, number of known runs, number of booked runs
+    INDEX_DTYPE = np.dtype([('listing_id', '<u8'), ('first_run', '<u4'), ('n_known', '<u2'), ('n_booked', '<u2')])
+    RUN = struct.Struct('<HH')  # offset, length
+    MAGIC = b'STLS'
+    VERSION = 2
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, self.ordinal, self.__n_rows, self.__n_runs = self.HEADER.unpack_from(self.__mmap)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError('Not a calendar snapshot file: %s' % path)
+        self.date = date.fromordinal(self.ordinal)
+        self.__runs_offset = self.HEADER.size + self.__n_rows * self.INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return self.__n_rows
+
+    def close(self):
+        self.__mmap.close()
+
+    def find(self, listing_id: str) -> tuple | None:
+        """Get (first run, number of known runs, number of booked runs) of a listing by binary search over the index,
+        or None if not found.
+        """
+        listing_id = int(listing_id)
+        lo, hi = 0, self.__n_rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            found_id, *row = self.INDEX_ENTRY.unpack_from(self.__mmap, self.HEADER.size + mid * self.INDEX_ENTRY.size)
+            if found_id == listing_id:
+                return tuple(row)
+            if found_id < listing_id:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return None
+
+    def get(self, listing_id: str) -> BookingCalendar | None:
+        """Get the calendar snapshot of a listing, or None if the listing was not scraped on this day."""
+        row = self.find(listing_id)
+        if row is None:
+            return None
+        first_run, n_known, n_booked = row
+        return self.decode_row(self.ordinal, n_known, n_booked, self.get_runs(first_run, n_known + n_booked))
+
+    def get_runs(self, first_run: int, n_runs: int) -> bytes:
+        """Get the encoded runs of a row."""
+        offset = self.__runs_offset + first_run * self.RUN.size
+        return self.__mmap[offset:offset + n_runs * self.RUN.size]
+
+    def iter_rows(self) -> Iterator[tuple]:
+        """Yield (listing id, first run, number of known runs, number of booked runs) for all rows, in listing id
+        order.
+        """
+        for i in range(self.__n_rows):
+            yield self.INDEX_ENTRY.unpack_from(self.__mmap, self.HEADER.size + i * self.INDEX_ENTRY.size)
+
+    def count_nights(self, start: int, end: int, listing_ids: list = None) -> tuple:
+        """Count (listings, known nights, booked nights) between date ordinals `start` (incl.) and `end` (excl.) over
+        all rows, or the rows of the given listing ids.
+        """
+        index = np.frombuffer(self.__mmap, self.INDEX_DTYPE, self.__n_rows, self.HEADER.size)
+        runs = np.frombuffer(self.__mmap, '<u2', 2 * self.__n_runs, self.__runs_offset).reshape(-1, 2)
+        if listing_ids is not None:  # look up the given listings in the index, so that only their runs are counted
+            ids = np.array(sorted({int(listing_id) for listing_id in listing_ids}), dtype='<u8')
+            positions = np.searchsorted(index['listing_id'], ids)
+            is_found = positions < self.__n_rows
+            positions, ids = positions[is_found], ids[is_found]
+            index = index[positions[index['listing_id'][positions] == ids]]
+            n_runs = index['n_known'].astype(np.int64) + index['n_booked']
+            first_runs = np.repeat(index['first_run'] - np.cumsum(n_runs) + n_runs, n_runs)
+            runs = runs[first_runs + np.arange(len(first_runs))]
+        n_row_runs = np.column_stack((index['n_known'], index['n_booked'])).ravel()  # known, booked, known, ...
+        is_booked = np.repeat(np.tile(np.array([False, True]), len(index)), n_row_runs)
+
+        lo, hi = start - self.ordinal, end - self.ordinal
+        offsets = runs[:, 0].astype(np.int64)
+        nights = (np.minimum(hi, offsets + runs[:, 1]) - np.maximum(lo, offsets)).clip(min=0)
+        booked_nights = int(nights[is_booked].sum())
+        return len(index), int(nights.sum()) - booked_nights, booked_nights
+
+    @staticmethod
+    def decode_row(ordinal: int, n_known: int, n_booked: int, runs: bytes) -> BookingCalendar:
+        """Decode the runs of a row relative to the scrape day ordinal into a calendar."""
+        runs = list(SnapshotDay.RUN.iter_unpack(runs))
+        known = sum(((1 << length) - 1) << offset for offset, length in runs[:n_known])
+        booked = sum(((1 << length) - 1) << offset for offset, length in runs[n_known:])
+        return BookingCalendar(ordinal, known.bit_length(), known, booked)
+
+    @staticmethod
+    def encode_row(calendar: BookingCalendar, ordinal: int) -> tuple:
+        """Encode a calendar as (number of known runs, number of booked runs, runs) relative to the scrape day ordinal.
+        Days before the scrape day are dropped.
+        """
+        shift = calendar.start - ordinal
+        counts = []
+        runs = bytearray()
+        for bits in (calendar.known, calendar.booked):
+            bits = bits << shift if shift >= 0 else bits >> -shift
+            n_runs = 0
+            for offset, length in BookingCalendar.runs(bits):
+                runs += SnapshotDay.RUN.pack(offset, length)
+                n_runs += 1
+            counts.append(n_runs)
+
+        return counts[0], counts[1], bytes(runs)
+
+
+class SnapshotWriter:
+    """Collect calendar snapshots for one scrape day and merge them into the store.
+
+    Collected rows are merged every `merge_rows` rows or `merge_seconds` seconds, so that a crash loses little of the
+    day, and on close. Rows added after close are merged straight away. Rows already stored for the same day are kept,
+    unless the listing is snapshotted again. Writers of the same day (e.g. several calendar workers) merge their rows
+    under an exclusive lock on a lock file next to the day file.
+    """
+
+    def __init__(self, path: str, scrape_date: date, merge_rows: int = 10000, merge_seconds: float = 300):
+        self.__day = SnapshotDay(path) if os.path.exists(path) else None
+        self.__is_closed = False
+        self.__lock = Lock()
+        self.__merge_lock = Lock()
+        self.__merging = {}
+        self.__merge_rows = merge_rows
+        self.__merge_seconds = merge_seconds
+        self.__merged_at = monotonic()
+        self.__ordinal = scrape_date.toordinal()
+        self.__path = path
+        self.__rows = {}
+        self.date = scrape_date
+
+    def add(self, listing_id: str, calendar: BookingCalendar):
+        row = SnapshotDay.encode_row(calendar, self.__ordinal)
+        with self.__lock:
+            self.__rows[int(listing_id)] = row
+            is_due = self.__is_closed or len(self.__rows) >= self.__merge_rows or (
+                    monotonic() - self.__merged_at >= self.__merge_seconds)
+        if is_due:
+            self.flush()
+
+    def get(self, listing_id: str) -> BookingCalendar | None:
+        """Get the calendar snapshot of a listing taken on this day, or None if there is none yet."""
+        listing_id = int(listing_id)
+        with self.__lock:
+            row = self.__rows.get(listing_id) or self.__merging.get(listing_id)
+            if row is not None:
+                return SnapshotDay.decode_row(self.__ordinal, *row)
+            return self.__day.get(listing_id) if self.__day else None
+
+    def close(self):
+        with self.__lock:
+            self.__is_closed = True
+        self.flush()
+        with self.__lock:
+            if self.__day:
+                self.__day.close()
+                self.__day = None
+
+    def flush(self):
+        """Merge the collected rows into the day file."""
+        with self.__merge_lock:
+            with self.__lock:
+                rows = self.__merging = self.__rows  # still found by get() until the merged day file is open
+                self.__rows = {}
+                self.__merged_at = monotonic()
+            if not rows:
+                return
+            with open(self.__path + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the lock file is closed
+                self.__merge(dict(rows))
+                day = SnapshotDay(self.__path)
+            with self.__lock:
+                if self.__day:
+                    self.__day.close()
+                self.__day = day
+                self.__merging = {}
+
+    def __merge(self, rows: dict):
+        """Merge rows into the stored rows of the day and replace the day file."""
+        if os.path.exists(self.__path):
+            day = SnapshotDay(self.__path)
+            try:
+                for listing_id, first_run, n_known, n_booked in day.iter_rows():
+                    if listing_id not in rows:
+                        rows[listing_id] = (n_known, n_booked, day.get_runs(first_run, n_known + n_booked))
+            finally:
+                day.close()
+
+        listing_ids = sorted(rows)
+        tmp_path = '{}.{}.tmp'.format(self.__path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(SnapshotDay.HEADER.pack(
+                SnapshotDay.MAGIC,
+                SnapshotDay.VERSION,
+                0,
+                self.__ordinal,
+                len(listing_ids),
+                sum(n_known + n_booked for n_known, n_booked, _ in rows.values())
+            ))
+            first_run = 0
+            for listing_id in listing_ids:
+                n_known, n_booked, _ = rows[listing_id]
+                f.write(SnapshotDay.INDEX_ENTRY.pack(listing_id, first_run, n_known, n_booked))
+                first_run += n_known + n_booked
+            for listing_id in listing_ids:
+                f.write(rows[listing_id][2])
+        os.replace(tmp_path, self.__path)
+
+
+class CalendarSnapshotStore:
+    """Directory of daily calendar snapshots, one file per scrape day, for availability and occupancy analysis."""
+    SUFFIX = '.snap'
+
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.__path = path
+
+    def get_dates(self) -> list:
+        """Get all scrape dates with a snapshot, in date order."""
+        return sorted(
+            date.fromisoformat(name[:-len(self.SUFFIX)])
+            for name in os.listdir(self.__path) if name.endswith(self.SUFFIX)
+        )
+
+    def open_day(self, scrape_date: date) -> SnapshotDay:
+        return SnapshotDay(self.__get_day_path(scrape_date))
+
+    def open_previous_day(self, scrape_date: date = None) -> SnapshotDay | None:
+        """Open the latest snapshot day before given scrape date (default: today), or get None if there is none."""
+        scrape_date = scrape_date or date.today()
+        previous_dates = [d for d in self.get_dates() if d < scrape_date]
+        return self.open_day(previous_dates[-1]) if previous_dates else None
+
+    def writer(self, scrape_date: date = None) -> SnapshotWriter:
+        scrape_date = scrape_date or date.today()
+        return SnapshotWriter(self.__get_day_path(scrape_date), scrape_date)
+
+    def get_booked_nights(self, listing_id: str, start: date, end: date, scrape_dates: list = None) -> dict:
+        """Get the number of booked nights between start (incl.) and end (excl.) of a listing as seen on each scrape
+        date, keyed by scrape date. Scrape dates on which the listing was not snapshotted are omitted.
+        """
+        booked_nights = {}
+        for scrape_date in scrape_dates or self.get_dates():
+            day = self.open_day(scrape_date)
+            try:
+                n_listings, _, booked = day.count_nights(start.toordinal(), end.toordinal(), [listing_id])
+                if n_listings:
+                    booked_nights[scrape_date] = booked
+            finally:
+                day.close()
+
+        return booked_nights
+
+    def get_occupancy(self, start: date, end: date, scrape_dates: list = None, listing_ids: set = None) -> list:
+        """Aggregate known and booked nights between start (incl.) and end (excl.) over all listings (or the given
+        listing ids) for each scrape date.
+        """
+        listing_ids = list(listing_ids) if listing_ids else None
+        stats = []
+        for scrape_date in scrape_dates or self.get_dates():
+            day = self.open_day(scrape_date)
+            try:
+                n_listings, known_nights, booked_nights = day.count_nights(
+                    start.toordinal(), end.toordinal(), listing_ids)
+            finally:
+                day.close()
+
+            stats.append({
+                'scrape_date':   scrape_date,
+                'listings':      n_listings,
+                'known_nights':  known_nights,
+                'booked_nights': booked_nights,
+                'occupancy':     booked_nights / known_nights if known_nights else None,
+            })
+
+        return stats
+
+    def __get_day_path(self, scrape_date: date) -> str:
+        return os.path.join(self.__path, scrape_date.isoformat() + self.SUFFIX)
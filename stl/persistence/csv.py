@@ -1,15 +1,48 @@
 import csv
+import gzip
 
+from typing import Iterable
+
+from stl.metrics.stage_timer import stage_timer
+from stl.model.listing import Listing
 from stl.persistence import PersistenceInterface
 
 
 class Csv(PersistenceInterface):
+    """Write listings to a CSV file, gzip or zstandard compressed if the path ends in ".gz" or ".zst".
+
+    The columns are fixed by the listing model: nested objects are flattened and lists are JSON encoded. Listings are
+    written as they arrive, so memory use does not grow with the number of listings. The first save replaces the file,
+    later saves append to it.
+    """
 
     def __init__(self, csv_path: str):
         self.__csv_path = csv_path
+        self.__file = None
+        self.__writer = None
+
+    def close(self):
+        if self.__file:
+            self.__file.close()
+            self.__file = self.__writer = None
+
+    def save(self, query: str, listings: Iterable):
+        if not self.__writer:
+            self.__file = self.__open()
+            self.__writer = csv.DictWriter(self.__file, fieldnames=Listing.get_flat_field_names())
+            self.__writer.writeheader()
+
+        for listing in listings:
+            with stage_timer.stage('persistence'):  # not timing how long it takes to get the listing
+                self.__writer.writerow(Listing.flatten(listing))
+        with stage_timer.stage('persistence'):
+            self.__file.flush()
+
+    def __open(self):
+        if self.__csv_path.endswith('.gz'):
+            return gzip.open(self.__csv_path, 'wt', encoding='utf-8', newline='')
+        if self.__csv_path.endswith('.zst'):
+            import zstandard
+            return zstandard.open(self.__csv_path, 'wt', encoding='utf-8', newline='')
 
-    def save(self, query: str, listings: list):
-        with open(self.__csv_path, 'w', encoding='utf-8', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=listings[0].keys())
-            writer.writeheader()
-            writer.writerows(listings)
+        return open(self.__csv_path, 'w', encoding='utf-8', newline='')
@@ -1,12 +1,39 @@
 from datetime import datetime
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk, scan
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
 from elasticsearch.exceptions import RequestError
+from logging import Logger
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Iterable
 
-from stl.persistence import PersistenceInterface
+from stl.metrics.stage_timer import stage_timer
+from stl.model.booking_calendar import BookingCalendar
+from stl.persistence import CalendarPersistenceInterface
+from stl.persistence.bulk_buffer import BulkBuffer
 
 
-class Elastic(PersistenceInterface):
+class _StageTimedClient:
+    """Elasticsearch client that times bulk requests as persistence stage, in whichever thread the bulk helpers send
+    them.
+    """
+
+    def __init__(self, es: Elasticsearch):
+        self.__es = es
+
+    def __getattr__(self, name: str):
+        return getattr(self.__es, name)
+
+    def bulk(self, *args, **kwargs):
+        with stage_timer.stage('persistence'):
+            return self.__es.bulk(*args, **kwargs)
+
+    def options(self, *args, **kwargs) -> '_StageTimedClient':
+        return _StageTimedClient(self.__es.options(*args, **kwargs))
+
+
+class Elastic(CalendarPersistenceInterface):
     INDEX_MAPPINGS = {
         "properties": {
             "access":                 {"type": "text"},
@@ -25,8 +52,11 @@ class Elastic(PersistenceInterface):
                 "properties": {"date": {"type": "date", "format": "yyyy-MM-dd"}}
             },
             "business_travel_ready":  {"type": "boolean"},
+            "calendar_changes":       {"type": "integer"},
+            "calendar_refreshes":     {"type": "integer"},
             "city":                   {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
             "country":                {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "content_hash":           {"type": "keyword", "index": False},
             "coordinates":            {"type": "geo_point"},
             "description":            {"type": "text"},
             "discount_monthly":       {"type": "float"},
@@ -41,6 +71,7 @@ class Elastic(PersistenceInterface):
             "longitude":              {"type": "double"},
             "name":                   {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
             "neighborhood_overview":  {"type": "text"},
+            "next_available":         {"type": "date", "format": "yyyy-MM-dd"},
             "person_capacity":        {"type": "integer"},
             "photo_count":            {"type": "integer"},
             "photos":                 {"type": "keyword"},
@@ -72,9 +103,94 @@ class Elastic(PersistenceInterface):
         }
     }
 
-    def __init__(self, es: Elasticsearch, index: str):
+    CALENDAR_SCRIPT = """
+        if (ctx._source.bookings == null) {
+            ctx._source.bookings = [];
+        }
+        // dates are yyyy-MM-dd strings, so string order is date order
+        // remove bookings of days that are now available; days left out of the calendar are kept as they are
+        boolean removed = false;
+        for (Iterator it = ctx._source.bookings.iterator(); it.hasNext();) {
+            String dt = it.next().date;
+            for (range in params.available) {
+                if (dt.compareTo(range[0]) >= 0 && dt.compareTo(range[1]) <= 0) {
+                    it.remove();
+                    removed = true;
+                    break;
+                }
+            }
+        }
+        Set stored = new HashSet();
+        for (booking in ctx._source.bookings) {
+            stored.add(booking.date);
+        }
+        boolean added = false;
+        for (dt in params.dates) {
+            if (stored.add(dt)) {
+                ctx._source.bookings.add(['date': dt]);
+                added = true;
+            }
+        }
+        if (added) {
+            ctx._source.bookings.sort((a, b) -> a.date.compareTo(b.date));
+        }
+        // keep refresh statistics for the refresh scheduler
+        def refreshes = ctx._source.calendar_refreshes;
+        ctx._source.calendar_refreshes = (refreshes == null ? 0 : refreshes) + 1;
+        if (added || removed) {
+            def changes = ctx._source.calendar_changes;
+            ctx._source.calendar_changes = (changes == null ? 0 : changes) + 1;
+        }
+        ctx._source.next_available = params.next_available;
+        if (params.pricing != null) {
+            ctx._source.putAll(params.pricing);
+        }
+        // mark updated because we "touched" this listing
+        ctx._source.updated_at = params.now;
+    """
+
+    LARGE_LOAD_SIZE = 1000  # number of listings from which on index refresh is switched off while saving
+    PIT_KEEP_ALIVE = '2m'
+    PIT_HEARTBEAT_SECONDS = 30  # interval of searches keeping the point in time alive while the consumer is slow
+    REFRESH_CANDIDATE_FIELDS = [
+        'calendar_changes', 'calendar_refreshes', 'next_available', 'nights_max', 'nights_min', 'review_count',
+        'updated_at'
+    ]
+
+    def __init__(
+            self,
+            es: Elasticsearch,
+            index: str,
+            logger: Logger,
+            bulk_buffer: BulkBuffer = None,
+            threads: int = 4,
+            chunk_size: int = 500,
+            max_chunk_bytes: int = 10 * 1024 * 1024,
+            slices: int = 4,
+            page_size: int = 5000
+    ):
+        self.__bulk_buffer = bulk_buffer
+        self.__chunk_size = chunk_size
         self.__es = es
         self.__index = index
+        self.__logger = logger
+        self.__max_chunk_bytes = max_chunk_bytes
+        self.__page_size = page_size
+        self.__refresh_interval = None
+        self.__refresh_lock = Lock()
+        self.__refresh_off_count = 0
+        self.__slices = slices
+        self.__threads = threads
+
+    def close(self):
+        """Flush buffered bulk actions. Raise BulkWriteException if any of them failed."""
+        if self.__bulk_buffer:
+            self.__bulk_buffer.close()
+
+    def flush(self):
+        """Send buffered bulk actions. Raise BulkWriteException if any of them failed."""
+        if self.__bulk_buffer:
+            self.__bulk_buffer.flush()
 
     def create_index_if_not_exists(self, index_name: str):
         """Create an index if it doesn't already exist."""
@@ -92,104 +208,269 @@ class Elastic(PersistenceInterface):
 
     def get_all_index_ids(self, since: str):
         """Get all index ids not updated since "since" (default: "1d"), except those marked as deleted."""
-        query = {
-            "query": {
-                "bool": {
-                    "must_not": [
-                        {
-                            "term": {
-                                "deleted": {
-                                    "value": True
-                                }
-                            }
-                        }
-                    ],
-                    "must":     [
-                        {
-                            "range": {
-                                "updated_at": {
-                                    "lte": "now-{}".format(since)
-                                }
-                            }
-                        }
-                    ]
-                }
-            }
-        }
-        hits = scan(
-            self.__es,
-            query=query,
-            scroll='2m',
-            index=self.__index
-        )
-        return (hit['_id'] for hit in hits)
+        return (hit['_id'] for hit in self.__iter_hits(self.__get_stale_listings_query(since)))
+
+    def get_refresh_candidates(self, since: str):
+        """Get refresh statistics of all listings not updated since "since", except those marked as deleted."""
+        hits = self.__iter_hits(self.__get_stale_listings_query(since), self.REFRESH_CANDIDATE_FIELDS)
+        return ({'id': hit['_id']} | hit.get('_source', {}) for hit in hits)
+
+    def __iter_hits(self, query: dict, source: bool | list = False):
+        """Iterate over all hits for a query.
+
+        Hits are read in `slices` parallel slices of a point in time, paging with search_after. Pages are passed on
+        through a bounded queue, so the slice readers never get far ahead of the consumer. While the readers wait for
+        the consumer, the point in time is kept alive by a heartbeat search. It is closed once the iteration is done or
+        the iterator is closed.
+        """
+        pit_id = self.__es.open_point_in_time(index=self.__index, keep_alive=self.PIT_KEEP_ALIVE)['id']
+        pages = Queue(maxsize=self.__slices * 2)
+        stopped = Event()
+        errors = []
+
+        def read_slice(slice_id: int):
+            try:
+                search_after = None
+                while not stopped.is_set():
+                    params = {'slice': {'id': slice_id, 'max': self.__slices}} if self.__slices > 1 else {}
+                    if search_after:
+                        params['search_after'] = search_after
+                    response = self.__es.search(
+                        query=query,
+                        source=source,
+                        size=self.__page_size,
+                        pit={'id': pit_id, 'keep_alive': self.PIT_KEEP_ALIVE},
+                        sort=['_shard_doc'],
+                        track_total_hits=False,
+                        **params
+                    )
+                    page = response['hits']['hits']
+                    if page:
+                        pages.put(page)
+                    if len(page) < self.__page_size:
+                        break
+                    search_after = page[-1]['sort']
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pages.put(None)
+
+        def keep_alive():
+            while not stopped.wait(self.PIT_HEARTBEAT_SECONDS):
+                try:
+                    self.__es.search(
+                        size=0, pit={'id': pit_id, 'keep_alive': self.PIT_KEEP_ALIVE}, track_total_hits=False)
+                except Exception as e:
+                    self.__logger.warning('Could not keep point in time alive: {!r}'.format(e))
+
+        readers = [Thread(target=read_slice, args=(i,), daemon=True) for i in range(self.__slices)]
+        for reader in readers:
+            reader.start()
+        heartbeat = Thread(target=keep_alive, name='stl-pit-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            n_finished = 0
+            while n_finished < len(readers):
+                page = pages.get()
+                if page is None:
+                    n_finished += 1
+                    continue
+                yield from page
+            if errors:
+                raise errors[0]
+        finally:
+            stopped.set()
+            while any(reader.is_alive() for reader in readers):
+                try:
+                    pages.get(timeout=0.1)  # unblock readers waiting for room in the queue
+                except Empty:
+                    pass
+            heartbeat.join()
+            self.__es.close_point_in_time(id=pit_id)
 
     def mark_deleted(self, listing_id: str):
         """Mark a listing as deleted by setting the 'deleted' field to True."""
-        self.__es.update(index=self.__index, id=listing_id, doc={'deleted': True})
+        self.__update(listing_id, doc={'deleted': True})
+
+    def save(self, query: str, listings: Iterable):
+        """Bulk save listings by upsert. Listings may be a generator, which is consumed as the bulk requests are sent.
+
+        Listings with the same content hash as the stored listing are skipped. Once a load turns out to be large, the
+        index refresh is switched off until all listings are saved. Only the requests to Elasticsearch are timed as
+        persistence stage, not getting the listings.
+        """
+        n_unchanged = 0
+        is_refresh_off = False
 
-    def save(self, query: str, listings: list):
-        """Bulk save listings by upsert."""
-        bulk(self.__es, index=self.__index, actions=[{
+        def get_changed_listings():
+            nonlocal is_refresh_off, n_unchanged
+            n_read = 0
+            for chunk in self.__chunk(listings, self.__chunk_size):
+                n_read += len(chunk)
+                if not is_refresh_off and n_read >= self.LARGE_LOAD_SIZE:
+                    self.__disable_refresh()
+                    is_refresh_off = True
+                stored_hashes = self.__get_content_hashes([listing['id'] for listing in chunk])
+                for listing in chunk:
+                    if listing.get('content_hash') and listing['content_hash'] == stored_hashes.get(str(listing['id'])):
+                        n_unchanged += 1
+                        continue
+                    yield listing
+
+        actions = ({
             '_op_type':      'update',
             '_id':           listing['id'],
             'doc':           listing,
             'doc_as_upsert': True
-        } for listing in listings])
+        } for listing in get_changed_listings())
+        bulk_options = {
+            'index':           self.__index,
+            'chunk_size':      self.__chunk_size,
+            'max_chunk_bytes': self.__max_chunk_bytes,
+            'raise_on_error':  False,
+        }
+        started_at = monotonic()
+        n_listings = n_errors = 0
+        es = _StageTimedClient(self.__es)
+        try:
+            if self.__threads > 1:
+                results = parallel_bulk(es, actions, thread_count=self.__threads, **bulk_options)
+            else:
+                results = streaming_bulk(es, actions, max_retries=3, **bulk_options)
+            for ok, item in results:
+                n_listings += 1
+                if not ok:
+                    n_errors += 1
+                    op_type, result = item.popitem()
+                    self.__logger.error('Saving {} failed: {}'.format(result.get('_id'), result.get('error')))
+        finally:
+            if is_refresh_off:
+                self.__restore_refresh()
+
+        duration = monotonic() - started_at
+        self.__logger.info('Saved {} listings ({} errors, {} unchanged) in {:.1f}s: {:.1f} docs/sec'.format(
+            n_listings - n_errors, n_errors, n_unchanged, duration, n_listings / duration if duration else 0))
 
-    def update_calendar(self, listing_id: str, calendar: dict):
-        booked_dates = [dt for dt, is_booked in calendar.items() if is_booked]
-        exists_booking_field = self.__es.search(index=self.__index, query={
+    @staticmethod
+    def __chunk(items: Iterable, size: int):
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    @stage_timer.timed('persistence')
+    def __get_content_hashes(self, listing_ids: list) -> dict:
+        """Get stored content hashes by listing id."""
+        response = self.__es.mget(index=self.__index, ids=listing_ids, source=['content_hash'])
+        return {
+            doc['_id']: doc['_source'].get('content_hash') for doc in response['docs'] if doc.get('found')
+        }
+
+    def __disable_refresh(self):
+        """Switch off index refresh, unless a concurrent save already did. Record the refresh interval to restore."""
+        with self.__refresh_lock:
+            if self.__refresh_off_count > 0:
+                self.__refresh_off_count += 1
+                return
+            settings = self.__es.indices.get_settings(index=self.__index, name='index.refresh_interval')
+            refresh_interval = next(iter(settings.body.values()), {}).get('settings', {}).get('index', {}).get(
+                'refresh_interval')
+            if refresh_interval == '-1':
+                self.__logger.warning('Index refresh is already switched off, e.g. by another process saving listings. '
+                                      'It will be reset to the default interval.')
+                refresh_interval = None  # None resets the setting to its default
+            self.__refresh_interval = refresh_interval
+            self.__es.indices.put_settings(index=self.__index, settings={'index': {'refresh_interval': '-1'}})
+            self.__refresh_off_count = 1
+
+    def __restore_refresh(self):
+        """Restore the recorded refresh interval once the last concurrent save switching off refresh is done."""
+        with self.__refresh_lock:
+            self.__refresh_off_count -= 1
+            if self.__refresh_off_count > 0:
+                return
+            self.__es.indices.put_settings(
+                index=self.__index, settings={'index': {'refresh_interval': self.__refresh_interval}})
+            self.__es.indices.refresh(index=self.__index)
+
+    @staticmethod
+    def __get_stale_listings_query(since: str) -> dict:
+        return {
             "bool": {
-                "must":   {
-                    "exists": {
-                        "field": "bookings"
-                    }
-                },
-                "filter": {
-                    "term": {"_id": listing_id}
-                }
-            }
-        })
-        bookings = [{'date': dt} for dt in booked_dates]
-        if exists_booking_field.body['hits']['hits']:
-            script = {
-                "source": """
-                    def updated = false;
-                    for (booking in params.bookings) {
-                        if (!ctx._source.bookings.contains(booking)) {
-                            ctx._source.bookings.add(booking);
-                            updated = true;
+                "must_not": [
+                    {
+                        "term": {
+                            "deleted": {
+                                "value": True
+                            }
                         }
                     }
-                    if (updated) {
-                        // sort bookings
-                        ctx._source.bookings.sort((a,b) -> a.date == b.date 
-                            ? 0 
-                            : ZonedDateTime.parse(a.date + "T00:00:00Z").isBefore(ZonedDateTime.parse(b.date + "T00:00:00Z"))
-                                ? -1 
-                                : 1
-                        );
+                ],
+                "must":     [
+                    {
+                        "range": {
+                            "updated_at": {
+                                "lte": "now-{}".format(since)
+                            }
+                        }
                     }
-                    // mark updated because we "touched" this listing
-                    ctx._source.updated_at = params.now;
-                """,
-                "params": {
-                    "bookings": bookings,
-                    "now":      datetime.utcnow()
-                }
+                ]
             }
-            self.__es.update(index=self.__index, id=listing_id, script=script)
-        else:
-            self.__es.update(index=self.__index, id=listing_id, doc={
-                'bookings':   bookings,
-                'updated_at': datetime.utcnow()
-            })
+        }
+
+    def update_calendar(
+            self,
+            listing_id: str,
+            calendar: BookingCalendar | dict,
+            pricing: dict = None,
+            min_nights: int = None,
+            max_nights: int = None,
+            previous: BookingCalendar = None
+    ):
+        """Merge booked dates (and optionally pricing) into a listing in a single scripted update.
+
+        Stored bookings of days that the calendar shows as available are removed. Bookings of days the calendar does
+        not know, e.g. past days or implausibly long bookings left out of it, are kept. The calendar counts as changed
+        if a booking was added or removed.
+
+        Given the previously stored calendar of the listing, only the days that changed since are sent.
+        """
+        if isinstance(calendar, dict):
+            calendar = BookingCalendar.from_dict(calendar)
+        changes = calendar.changed_since(previous) if previous else calendar
+        if pricing:
+            pricing = self.__add_nights(pricing, min_nights, max_nights)
+
+        self.__update(listing_id, script={
+            "source": self.CALENDAR_SCRIPT,
+            "params": {
+                "dates":          changes.booked_dates(),
+                "available":      changes.available_ranges(),
+                "next_available": calendar.first_available(),
+                "pricing":        pricing or None,
+                "now":            datetime.utcnow()
+            }
+        })
 
     def update_pricing(self, listing_id: str, pricing: dict, min_nights: int = None, max_nights: int = None):
+        self.__update(listing_id, doc=self.__add_nights(pricing, min_nights, max_nights))
+
+    @staticmethod
+    def __add_nights(pricing: dict, min_nights: int = None, max_nights: int = None) -> dict:
         if max_nights:
             pricing['nights_max'] = max_nights
         if min_nights:
             pricing['nights_min'] = min_nights
 
-        self.__es.update(index=self.__index, id=listing_id, doc=pricing)
+        return pricing
+
+    def __update(self, listing_id: str, **update):
+        """Partially update a listing by doc or script, through the bulk buffer if there is one."""
+        if self.__bulk_buffer:
+            self.__bulk_buffer.add({'_op_type': 'update', '_id': listing_id} | update)
+        else:
+            self.__es.update(index=self.__index, id=listing_id, **update)
@@ -0,0 +1,244 @@
+import os
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import re
+
+from datetime import date, datetime, timedelta
+from threading import Lock
+from typing import Iterable
+
+from stl.metrics.stage_timer import stage_timer
+from stl.model.booking_calendar import BookingCalendar
+from stl.model.listing import Listing
+from stl.persistence import CalendarPersistenceInterface
+
+
+class Parquet(CalendarPersistenceInterface):
+    """Write listings, reviews, calendars, pricing and deletions to partitioned Parquet datasets.
+
+    Files are written to `<path>/<dataset>/query=<query>/scrape_date=<yyyy-mm-dd>/`, where calendar, pricing and
+    deletion records have no query partition. Rows are collected into Arrow record batches of `row_group_size` rows,
+    each written as one row group. Low-cardinality string columns are dictionary encoded.
+
+    Listings to refresh calendars for are read back from the files written so far. Files still being written are
+    skipped, so calendar and pricing records only become visible once flushed.
+    """
+    DICTIONARY_FIELDS = [
+        'amenities', 'city', 'country', 'neighborhood', 'price_rate_type', 'province', 'room_and_property_type',
+        'room_type', 'room_type_category', 'source', 'state'
+    ]
+    DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+    SCALAR_TYPES = {
+        bool:     pa.bool_(),
+        datetime: pa.timestamp('us'),
+        float:    pa.float64(),
+        int:      pa.int64(),
+        str:      pa.string(),
+    }
+
+    CALENDAR_SCHEMA = pa.schema([
+        ('listing_id', pa.string()),
+        ('scraped_at', pa.timestamp('us')),
+        ('date', pa.date32()),
+        ('booked', pa.bool_()),
+    ])
+    DELETION_SCHEMA = pa.schema([
+        ('listing_id', pa.string()),
+        ('deleted_at', pa.timestamp('us')),
+    ])
+    PRICING_SCHEMA = pa.schema([
+        ('listing_id', pa.string()),
+        ('scraped_at', pa.timestamp('us')),
+        ('price_nightly', pa.float64()),
+        ('price_cleaning', pa.float64()),
+        ('discount_weekly', pa.float64()),
+        ('discount_monthly', pa.float64()),
+        ('nights_min', pa.int64()),
+        ('nights_max', pa.int64()),
+    ])
+
+    def __init__(self, path: str, row_group_size: int = 10000):
+        self.__lock = Lock()
+        self.__listing_schema = self.__get_listing_schema()
+        self.__path = path
+        self.__review_schema = pa.schema(
+            [('listing_id', pa.string())] + [(n, self.SCALAR_TYPES[t]) for n, t in Listing.REVIEW_FIELDS.items()])
+        self.__row_group_size = row_group_size
+        self.__rows = {'calendar': [], 'deletions': [], 'pricing': []}
+        self.__writers = {}
+
+    def close(self):
+        self.flush()
+
+    def flush(self):
+        """Write collected records and complete the files written so far. Later records are written to new files."""
+        with self.__lock:
+            for dataset, rows in self.__rows.items():
+                self.__write_rows(dataset, None, rows)
+            for writer in self.__writers.values():
+                writer.close()
+            self.__writers = {}
+
+    def get_all_index_ids(self, since: str):
+        """Get the ids of all saved listings not updated since "since", except those marked as deleted."""
+        return (candidate['id'] for candidate in self.get_refresh_candidates(since))
+
+    def get_refresh_candidates(self, since: str):
+        """Get refresh statistics of all saved listings not updated since "since", except those marked as deleted.
+
+        A listing counts as updated when it was saved or its calendar was scraped.
+        """
+        match = re.fullmatch(r'(\d+)([smhdw])', since)
+        if not match:
+            raise ValueError('Invalid period: "{}", expected e.g. "12h" or "1d"'.format(since))
+        cutoff = datetime.utcnow() - timedelta(**{self.DURATION_UNITS[match[2]]: int(match[1])})
+
+        listings = self.__aggregate('listings', 'id', [('review_count', 'max'), ('updated_at', 'max')])
+        refreshes = self.__aggregate(
+            'calendar', 'listing_id', [('scraped_at', 'count_distinct'), ('scraped_at', 'max')])
+        pricing = self.__aggregate('pricing', 'listing_id', [('nights_min', 'last'), ('nights_max', 'last')])
+        deleted = set(self.__aggregate('deletions', 'listing_id', []))
+
+        for listing_id, (review_count, updated_at) in listings.items():
+            n_refreshes, refreshed_at = refreshes.get(listing_id, (0, None))
+            updated_at = max(filter(None, [updated_at, refreshed_at]), default=None)
+            if listing_id in deleted or (updated_at and updated_at > cutoff):
+                continue
+            nights_min, nights_max = pricing.get(listing_id, (None, None))
+            yield {
+                'id':                 listing_id,
+                'calendar_refreshes': n_refreshes,
+                'nights_max':         nights_max,
+                'nights_min':         nights_min,
+                'review_count':       review_count,
+                'updated_at':         updated_at,
+            }
+
+    def mark_deleted(self, listing_id: str):
+        self.__add_record('deletions', {'listing_id': listing_id, 'deleted_at': datetime.utcnow()})
+
+    def save(self, query: str, listings: Iterable):
+        listing_rows, review_rows = [], []
+        for listing in listings:
+            listing_rows.append({
+                name: self.__coerce(listing.get(name), field_type) for name, field_type in Listing.FIELDS.items()
+                if name in self.__listing_schema.names
+            })
+            review_rows.extend(
+                {'listing_id': str(listing['id'])} | {name: review.get(name) for name in Listing.REVIEW_FIELDS}
+                for review in listing.get('reviews') or []
+            )
+            if len(listing_rows) >= self.__row_group_size:
+                self.__write_rows('listings', query, listing_rows)
+            if len(review_rows) >= self.__row_group_size:
+                self.__write_rows('reviews', query, review_rows)
+
+        self.__write_rows('listings', query, listing_rows)
+        self.__write_rows('reviews', query, review_rows)
+
+    def update_calendar(
+            self,
+            listing_id: str,
+            calendar: BookingCalendar | dict,
+            pricing: dict = None,
+            min_nights: int = None,
+            max_nights: int = None,
+            previous: BookingCalendar = None
+    ):
+        scraped_at = datetime.utcnow()
+        for dt, is_booked in calendar.items():
+            self.__add_record('calendar', {
+                'listing_id': listing_id,
+                'scraped_at': scraped_at,
+                'date':       date.fromisoformat(dt),
+                'booked':     is_booked,
+            })
+        if pricing:
+            self.update_pricing(listing_id, pricing, min_nights, max_nights)
+
+    def update_pricing(self, listing_id: str, pricing: dict, min_nights: int = None, max_nights: int = None):
+        self.__add_record('pricing', {
+            'listing_id': listing_id,
+            'scraped_at': datetime.utcnow(),
+            'nights_min': min_nights,
+            'nights_max': max_nights,
+        } | {k: v for k, v in pricing.items() if k in self.PRICING_SCHEMA.names})
+
+    def __add_record(self, dataset: str, record: dict):
+        with self.__lock:
+            self.__rows[dataset].append(record)
+            if len(self.__rows[dataset]) >= self.__row_group_size:
+                self.__write_rows(dataset, None, self.__rows[dataset])
+
+    def __aggregate(self, dataset: str, key: str, aggregations: list) -> dict:
+        """Aggregate the columns of a dataset by key, in the order the rows were written, over all complete files.
+        Get the aggregates keyed by key value.
+        """
+        directory = os.path.join(self.__path, dataset)
+        if not os.path.isdir(directory):
+            return {}
+        columns = list(dict.fromkeys([key] + [column for column, _ in aggregations]))
+        table = ds.dataset(directory, format='parquet', partitioning='hive', exclude_invalid_files=True).to_table(
+            columns=columns)
+        if 'scraped_at' in table.column_names:
+            table = table.sort_by('scraped_at')
+        aggregates = table.group_by(key, use_threads=False).aggregate(aggregations)
+        values = [aggregates.column('{}_{}'.format(*aggregation)).to_pylist() for aggregation in aggregations]
+
+        return dict(zip(aggregates.column(key).to_pylist(), zip(*values) if values else [()] * len(aggregates)))
+
+    @staticmethod
+    def __coerce(value, field_type):
+        if value is None or field_type not in [bool, float, int, str]:
+            return value
+        return field_type(value)
+
+    def __get_listing_schema(self) -> pa.Schema:
+        """Derive the Arrow schema from the listing model. Reviews are written to a separate dataset."""
+        fields = []
+        for name, field_type in Listing.FIELDS.items():
+            if name == 'reviews':
+                continue
+            if isinstance(field_type, dict):
+                arrow_type = pa.struct([(k, self.SCALAR_TYPES[t]) for k, t in field_type.items()])
+            elif getattr(field_type, '__origin__', None) is list:
+                item_type = self.SCALAR_TYPES[field_type.__args__[0]]
+                if name in self.DICTIONARY_FIELDS:
+                    item_type = pa.dictionary(pa.int32(), item_type)
+                arrow_type = pa.list_(item_type)
+            elif name in self.DICTIONARY_FIELDS:
+                arrow_type = pa.dictionary(pa.int32(), self.SCALAR_TYPES[field_type])
+            else:
+                arrow_type = self.SCALAR_TYPES[field_type]
+            fields.append((name, arrow_type))
+
+        return pa.schema(fields)
+
+    def __get_schema(self, dataset: str) -> pa.Schema:
+        return {
+            'calendar':  self.CALENDAR_SCHEMA,
+            'deletions': self.DELETION_SCHEMA,
+            'listings':  self.__listing_schema,
+            'pricing':   self.PRICING_SCHEMA,
+            'reviews':   self.__review_schema,
+        }[dataset]
+
+    @stage_timer.timed('persistence')
+    def __write_rows(self, dataset: str, query: str | None, rows: list):
+        """Write rows as one record batch and empty the list."""
+        if not rows:
+            return
+        schema = self.__get_schema(dataset)
+        batch = pa.RecordBatch.from_pylist(rows, schema=schema)
+        rows.clear()
+        key = (dataset, query)
+        if key not in self.__writers:
+            partition = 'scrape_date={}'.format(date.today().isoformat())
+            if query is not None:
+                partition = os.path.join('query={}'.format(re.sub(r'[^\w.-]+', '_', query).strip('_')), partition)
+            directory = os.path.join(self.__path, dataset, partition)
+            os.makedirs(directory, exist_ok=True)
+            file_name = 'part-{}-{}.parquet'.format(datetime.utcnow().strftime('%H%M%S%f'), os.getpid())
+            self.__writers[key] = pq.ParquetWriter(os.path.join(directory, file_name), schema, compression='zstd')
+        self.__writers[key].write_batch(batch, row_group_size=self.__row_group_size)
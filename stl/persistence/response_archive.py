@@ -0,0 +1,82 @@
+import gzip
+import json
+import os
+
+from datetime import datetime
+from threading import Lock
+
+
+class ResponseArchive:
+    """Append-only archive of raw API responses, for re-parsing without scraping again.
+
+    Responses are appended to segments at `<path>/<operation>/<yyyy-mm-dd>/<pid>-<n>.jsonl.gz`. Every record is a
+    separate gzip member, so a segment is a valid gzip file and each record can also be read on its own. Every segment
+    has an index file `<segment>.idx` with one tab-separated line per record: listing id, scrape time, offset, length.
+    Each process writes its own segments, so several scrapers can share one archive.
+    """
+
+    def __init__(self, path: str, max_segment_bytes: int = 64 * 1024 * 1024):
+        self.__lock = Lock()
+        self.__max_segment_bytes = max_segment_bytes
+        self.__path = path
+        self.__segments = {}
+
+    def append(self, operation: str, listing_id: str | None, response: dict, context: dict = None):
+        """Archive a raw response, with any context needed to parse it."""
+        scraped_at = datetime.utcnow()
+        record = {
+            'operation':  operation,
+            'listing_id': listing_id,
+            'scraped_at': scraped_at.isoformat(),
+            'context':    context,
+            'response':   response,
+        }
+        data = gzip.compress(json.dumps(record, default=str).encode('utf-8') + b'\n')
+        with self.__lock:
+            segment_path = self.__get_segment(operation, scraped_at)
+            with open(segment_path, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+            with open(segment_path + '.idx', 'a', encoding='utf-8') as f:
+                f.write('{}\t{}\t{}\t{}\n'.format(listing_id or '', record['scraped_at'], offset, len(data)))
+
+    def iter_index(self, operation: str):
+        """Yield (listing id, scrape time, segment path, offset, length) for all archived responses of an operation."""
+        operation_path = os.path.join(self.__path, operation)
+        if not os.path.isdir(operation_path):
+            return
+        for day in sorted(os.listdir(operation_path)):
+            day_path = os.path.join(operation_path, day)
+            for name in sorted(n for n in os.listdir(day_path) if n.endswith('.idx')):
+                segment_path = os.path.join(day_path, name[:-len('.idx')])
+                with open(os.path.join(day_path, name), encoding='utf-8') as f:
+                    for line in f:
+                        listing_id, scraped_at, offset, length = line.rstrip('\n').split('\t')
+                        yield listing_id or None, scraped_at, segment_path, int(offset), int(length)
+
+    @staticmethod
+    def read(segment_path: str, offset: int, length: int) -> dict:
+        """Read a single archived record."""
+        with open(segment_path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(gzip.decompress(f.read(length)))
+
+    def __get_segment(self, operation: str, scraped_at: datetime) -> str:
+        """Get path of the current segment for operation, starting a new one per day or once it is full."""
+        day = scraped_at.strftime('%Y-%m-%d')
+        segment_path = self.__segments.get(operation)
+        if (
+            segment_path is None
+            or os.path.basename(os.path.dirname(segment_path)) != day
+            or os.path.getsize(segment_path) >= self.__max_segment_bytes
+        ):
+            directory = os.path.join(self.__path, operation, day)
+            os.makedirs(directory, exist_ok=True)
+            n = 0
+            while os.path.exists(os.path.join(directory, '{}-{}.jsonl.gz'.format(os.getpid(), n))):
+                n += 1
+            segment_path = os.path.join(directory, '{}-{}.jsonl.gz'.format(os.getpid(), n))
+            open(segment_path, 'ab').close()
+            self.__segments[operation] = segment_path
+
+        return segment_path
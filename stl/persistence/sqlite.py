@@ -0,0 +1,210 @@
+import json
+import re
+import sqlite3
+
+from datetime import datetime, timedelta
+from threading import RLock
+from typing import Callable, Iterable
+
+from stl.metrics.stage_timer import stage_timer
+from stl.model.booking_calendar import BookingCalendar
+from stl.persistence import CalendarPersistenceInterface
+
+
+class Sqlite(CalendarPersistenceInterface):
+    """Store listings, booked dates and pricing in an embedded SQLite database.
+
+    The database runs in WAL mode, so enumerating listings does not block writes. Writes are collected and committed
+    in transactions of `batch_size` writes.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS listings (
+            id                 TEXT PRIMARY KEY,
+            doc                TEXT,
+            pricing            TEXT,
+            content_hash       TEXT,
+            updated_at         TEXT,
+            deleted            INTEGER NOT NULL DEFAULT 0,
+            review_count       INTEGER,
+            calendar_refreshes INTEGER NOT NULL DEFAULT 0,
+            calendar_changes   INTEGER NOT NULL DEFAULT 0,
+            next_available     TEXT
+        );
+        CREATE INDEX IF NOT EXISTS listings_deleted_updated_at ON listings (deleted, updated_at);
+        CREATE TABLE IF NOT EXISTS bookings (
+            listing_id TEXT NOT NULL,
+            date       TEXT NOT NULL,
+            PRIMARY KEY (listing_id, date)
+        ) WITHOUT ROWID;
+    """
+    DURATION_UNITS = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+    PAGE_SIZE = 10000
+
+    def __init__(self, db_path: str, batch_size: int = 500):
+        self.__batch_size = batch_size
+        self.__db_path = db_path
+        self.__lock = RLock()
+        self.__writes = []
+        self.__conn = self.__connect()
+        self.__conn.executescript(self.SCHEMA)
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            self.__conn.close()
+
+    def flush(self):
+        with self.__lock:
+            self.__flush()
+
+    def get_all_index_ids(self, since: str):
+        """Get all listing ids not updated since "since" (e.g. "1d"), except those marked as deleted."""
+        return (row[0] for row in self.__iter_stale_listings(since, ['id']))
+
+    def get_refresh_candidates(self, since: str):
+        """Get refresh statistics of all listings not updated since "since", except those marked as deleted."""
+        columns = {
+            'id':                 'id',
+            'calendar_changes':   'calendar_changes',
+            'calendar_refreshes': 'calendar_refreshes',
+            'next_available':     'next_available',
+            'nights_max':         "json_extract(pricing, '$.nights_max')",
+            'nights_min':         "json_extract(pricing, '$.nights_min')",
+            'review_count':       'review_count',
+            'updated_at':         'updated_at',
+        }
+        rows = self.__iter_stale_listings(since, list(columns.values()))
+        return (dict(zip(columns, row)) for row in rows)
+
+    def mark_deleted(self, listing_id: str):
+        self.__add_write(lambda conn: conn.execute('UPDATE listings SET deleted = 1 WHERE id = ?', (listing_id,)))
+
+    def save(self, query: str, listings: Iterable):
+        """Upsert listings in batches. Listings with the same content hash as the stored listing are not rewritten."""
+        sql = """
+            INSERT INTO listings (id, doc, content_hash, updated_at, review_count) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                doc = excluded.doc,
+                content_hash = excluded.content_hash,
+                updated_at = excluded.updated_at,
+                review_count = excluded.review_count,
+                deleted = 0
+            WHERE excluded.content_hash IS NULL OR listings.content_hash IS NOT excluded.content_hash
+        """
+        batch = []
+        for listing in listings:
+            updated_at = listing.get('updated_at') or datetime.utcnow()
+            batch.append((
+                str(listing['id']),
+                json.dumps(listing, default=str),
+                listing.get('content_hash'),
+                updated_at.isoformat() if isinstance(updated_at, datetime) else updated_at,
+                listing.get('review_count'),
+            ))
+            if len(batch) >= self.__batch_size:
+                self.__add_write(lambda conn, rows=batch: conn.executemany(sql, rows))
+                batch = []
+        if batch:
+            self.__add_write(lambda conn, rows=batch: conn.executemany(sql, rows))
+        with self.__lock:
+            self.__flush()
+
+    def update_calendar(
+            self,
+            listing_id: str,
+            calendar: BookingCalendar | dict,
+            pricing: dict = None,
+            min_nights: int = None,
+            max_nights: int = None,
+            previous: BookingCalendar = None
+    ):
+        """Merge booked dates into the stored bookings and update refresh statistics (and optionally pricing).
+
+        Stored bookings of days that the calendar shows as available are removed. Bookings of days the calendar does
+        not know, e.g. past days or implausibly long bookings left out of it, are kept. The calendar counts as changed
+        if a booking was added or removed.
+
+        Given the previously stored calendar of the listing, only the days that changed since are written.
+        """
+        if isinstance(calendar, dict):
+            calendar = BookingCalendar.from_dict(calendar)
+        changes = calendar.changed_since(previous) if previous else calendar
+        booked_dates = [(listing_id, dt) for dt in changes.booked_dates()]
+        available_ranges = [(listing_id, first, last) for first, last in changes.available_ranges()]
+        next_available = calendar.first_available()
+        now = datetime.utcnow().isoformat()
+
+        def write(conn: sqlite3.Connection):
+            n_changes = conn.total_changes
+            conn.executemany('DELETE FROM bookings WHERE listing_id = ? AND date BETWEEN ? AND ?', available_ranges)
+            conn.executemany('INSERT OR IGNORE INTO bookings (listing_id, date) VALUES (?, ?)', booked_dates)
+            conn.execute("""
+                UPDATE listings SET
+                    updated_at = ?,
+                    calendar_refreshes = calendar_refreshes + 1,
+                    calendar_changes = calendar_changes + ?,
+                    next_available = ?
+                WHERE id = ?
+            """, (now, int(conn.total_changes > n_changes), next_available, listing_id))
+
+        self.__add_write(write)
+        if pricing:
+            self.update_pricing(listing_id, pricing, min_nights, max_nights)
+
+    def update_pricing(self, listing_id: str, pricing: dict, min_nights: int = None, max_nights: int = None):
+        pricing = dict(pricing)
+        if max_nights:
+            pricing['nights_max'] = max_nights
+        if min_nights:
+            pricing['nights_min'] = min_nights
+        self.__add_write(lambda conn: conn.execute(
+            "UPDATE listings SET pricing = json_patch(coalesce(pricing, '{}'), ?) WHERE id = ?",
+            (json.dumps(pricing), listing_id)
+        ))
+
+    def __add_write(self, write: Callable):
+        with self.__lock:
+            self.__writes.append(write)
+            if len(self.__writes) >= self.__batch_size:
+                self.__flush()
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.__db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    @stage_timer.timed('persistence')
+    def __flush(self):
+        """Run all collected writes in one transaction."""
+        if not self.__writes:
+            return
+        writes, self.__writes = self.__writes, []
+        self.__conn.execute('BEGIN IMMEDIATE')
+        try:
+            for write in writes:
+                write(self.__conn)
+        except BaseException:
+            self.__conn.execute('ROLLBACK')
+            raise
+        self.__conn.execute('COMMIT')
+
+    def __iter_stale_listings(self, since: str, columns: list):
+        """Iterate over listings not updated since "since" in pages, without holding a read transaction open."""
+        match = re.fullmatch(r'(\d+)([smhdw])', since)
+        if not match:
+            raise ValueError('Invalid period: "{}", expected e.g. "12h" or "1d"'.format(since))
+        cutoff = datetime.utcnow() - timedelta(**{self.DURATION_UNITS[match[2]]: int(match[1])})
+        sql = 'SELECT {} FROM listings WHERE deleted = 0 AND updated_at <= ? AND id > ? ORDER BY id LIMIT ?'.format(
+            ', '.join(columns))
+        conn = self.__connect()
+        try:
+            last_id = ''
+            while True:
+                rows = conn.execute(sql, (cutoff.isoformat(), last_id, self.PAGE_SIZE)).fetchall()
+                yield from rows
+                if len(rows) < self.PAGE_SIZE:
+                    break
+                last_id = rows[-1][0]
+        finally:
+            conn.close()
@@ -0,0 +1,170 @@
+from logging import Logger
+from queue import Empty, Full, Queue
+from threading import Event, Thread
+from time import monotonic
+from typing import Iterable
+
+from stl.metrics.stage_timer import stage_timer
+from stl.persistence import CalendarPersistenceInterface, PersistenceInterface
+
+
+class WriteBehind(PersistenceInterface):
+    """Persistence stage that hands all writes to a dedicated writer thread, so fetching and writing overlap.
+
+    Writes are passed to the writer thread through a bounded queue, so producers block while the wrapped persistence
+    layer falls behind. Listings are saved in batches of `batch_size` listings, or of whatever arrived within
+    `max_seconds`. Other writes are applied in the order they were made. After a write fails no further writes are
+    made, and the error is re-raised to the producer on its next write, or else on close.
+
+    Use wrap() to keep the wrapped persistence layer's support for calendar updates.
+    """
+    __STOP = object()
+
+    def __init__(
+            self,
+            persistence: PersistenceInterface,
+            logger: Logger,
+            queue_size: int = 1000,
+            batch_size: int = 500,
+            max_seconds: float = 5.0
+    ):
+        self.__batch_size = batch_size
+        self.__error = None
+        self.__error_raised = False
+        self.__logger = logger
+        self.__max_seconds = max_seconds
+        self.__persistence = persistence
+        self.__queue = Queue(maxsize=queue_size)
+        self.__writer = Thread(target=self.__write, name='stl-write-behind', daemon=True)
+        self.__writer.start()
+
+    @property
+    def persistence(self) -> PersistenceInterface:
+        return self.__persistence
+
+    @staticmethod
+    def wrap(persistence: PersistenceInterface, logger: Logger, **kwargs) -> 'WriteBehind':
+        """Wrap persistence layer, keeping its support for calendar updates if it has any."""
+        if isinstance(persistence, CalendarPersistenceInterface):
+            return CalendarWriteBehind(persistence, logger, **kwargs)
+        return WriteBehind(persistence, logger, **kwargs)
+
+    def close(self):
+        """Flush all queued writes, stop the writer thread and close the wrapped persistence layer."""
+        while self.__writer.is_alive():
+            try:
+                self.__queue.put(self.__STOP, timeout=1)
+                break
+            except Full:
+                continue
+        self.__writer.join()
+        self.__persistence.close()
+        if self.__error is not None and not self.__error_raised:
+            raise self.__error
+
+    def flush(self):
+        """Wait until all writes queued so far have been made, then flush the wrapped persistence layer."""
+        flushed = Event()
+        self._put(('flush', flushed))
+        while not flushed.wait(1):
+            if self.__error is not None or not self.__writer.is_alive():
+                break
+        if self.__error is not None:
+            self.__error_raised = True
+            raise self.__error
+
+    def save(self, query: str, listings: Iterable):
+        for listing in listings:
+            self._put(('save', query, listing))
+
+    def _put(self, item):
+        """Queue item for the writer, waiting while the queue is full unless the writer has failed."""
+        while True:
+            if self.__error is not None:
+                self.__error_raised = True
+                raise self.__error
+            try:
+                self.__queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def __write(self):
+        batch_query, batch, batch_started_at = None, [], None
+        try:
+            while True:
+                timeout = None if not batch else max(0.0, batch_started_at + self.__max_seconds - monotonic())
+                try:
+                    item = self.__queue.get(timeout=timeout)
+                except Empty:
+                    item = None  # batch is due
+                if item is not None and item is not self.__STOP and item[0] == 'save' and (
+                        not batch or item[1] == batch_query
+                ):
+                    if not batch:
+                        batch_query, batch_started_at = item[1], monotonic()
+                    batch.append(item[2])
+                    if len(batch) < self.__batch_size:
+                        continue
+                    item = None
+
+                if batch:
+                    self.__save_batch(batch_query, batch)
+                    batch = []
+                if item is self.__STOP:
+                    return
+                if item is None:
+                    continue
+                if item[0] == 'save':  # listing of another query
+                    batch_query, batch, batch_started_at = item[1], [item[2]], monotonic()
+                    continue
+                if item[0] == 'flush':
+                    self.__persistence.flush()
+                    item[1].set()
+                    continue
+
+                method, args, kwargs = item
+                with stage_timer.stage('persistence writer'):
+                    getattr(self.__persistence, method)(*args, **kwargs)
+        except BaseException as e:
+            self.__logger.error('Write-behind persistence stopped: {!r}'.format(e))
+            self.__error = e
+            while True:  # discard queued writes, so blocked producers can notice the error
+                try:
+                    if self.__queue.get_nowait() is self.__STOP:
+                        return
+                except Empty:
+                    return
+
+    def __save_batch(self, query: str, batch: list):
+        started_at = monotonic()
+        with stage_timer.stage('persistence writer'):
+            self.__persistence.save(query, batch)
+        self.__logger.debug('Saved {} listings in {:.2f}s'.format(len(batch), monotonic() - started_at))
+
+
+class CalendarWriteBehind(WriteBehind, CalendarPersistenceInterface):
+    """Write-behind stage for a persistence layer that supports calendar updates. Reads are not queued."""
+
+    def get_all_index_ids(self, since: str):
+        return self.persistence.get_all_index_ids(since)
+
+    def get_refresh_candidates(self, since: str):
+        return self.persistence.get_refresh_candidates(since)
+
+    def mark_deleted(self, listing_id: str):
+        self._put(('mark_deleted', (listing_id,), {}))
+
+    def update_calendar(
+            self,
+            listing_id: str,
+            calendar,
+            pricing: dict = None,
+            min_nights: int = None,
+            max_nights: int = None,
+            previous=None
+    ):
+        self._put(('update_calendar', (listing_id, calendar, pricing, min_nights, max_nights, previous), {}))
+
+    def update_pricing(self, listing_id: str, pricing: dict, min_nights: int = None, max_nights: int = None):
+        self._put(('update_pricing', (listing_id, pricing, min_nights, max_nights), {}))
@@ -1,18 +1,25 @@
 import json
 import requests
 
-from datetime import timedelta
+from datetime import date
 from logging import Logger
+from threading import Lock
 from urllib.parse import urlparse, parse_qs
 
 from stl.endpoint.base_endpoint import BaseEndpoint
 from stl.endpoint.calendar import Calendar
+from stl.endpoint.deadline import clip_timeout, deadline
 from stl.endpoint.explore import Explore
 from stl.endpoint.pdp import Pdp
 from stl.endpoint.reviews import Reviews
-from stl.exception.api import ForbiddenException
-from stl.persistence.elastic import Elastic
-from stl.persistence import PersistenceInterface
+from stl.exception.api import DeadlineExceededException, ForbiddenException
+from stl.metrics.request_metrics import request_metrics
+from stl.metrics.stage_timer import stage_timer
+from stl.model.booking_calendar import BookingCalendar
+from stl.persistence import CalendarPersistenceInterface, PersistenceInterface
+from stl.persistence.calendar_snapshots import CalendarSnapshotStore
+from stl.scraper.refresh_scheduler import RefreshScheduler
+from stl.worker.pool import WorkerPool
 
 
 class AirbnbScraperInterface:
@@ -21,24 +28,39 @@ class AirbnbScraperInterface:
 
 
 class AirbnbSearchScraper(AirbnbScraperInterface):
-    def __init__(self, explore: Explore, pdp: Pdp, reviews: Reviews, persistence: PersistenceInterface, logger: Logger):
+    def __init__(
+            self,
+            explore: Explore,
+            pdp: Pdp,
+            reviews: Reviews,
+            persistence: PersistenceInterface,
+            logger: Logger,
+            listing_deadline: float = None
+    ):
+        """listing_deadline: seconds to get the reviews and details of a listing, after which it is skipped."""
         self.__logger = logger
         self.__explore = explore
         self.__geography = {}
         self.__ids_seen = set()
+        self.__listing_deadline = listing_deadline
+        self.__n_listings = 0
         self.__pdp = pdp
         self.__persistence = persistence
         self.__reviews = reviews
 
     def run(self, query: str, params: dict):
-        listings = []
+        self.__n_listings = 0
+        self.__persistence.save(query, self.__iter_listings(query, params))  # storage times its own writes
+        self.__logger.info('Got data for {} listings.'.format(self.__n_listings))
+
+    def __iter_listings(self, query: str, params: dict):
+        """Search all result pages for query and yield each listing as soon as its data is complete."""
         url = self.__explore.get_url(query, params)
         data, pagination = self.__explore.search(url)
         self.__geography.update(self.__normalize_geography(data, query))
         self.__logger.info('Getting {} results for "{}" - ({})'.format(
             pagination['totalCount'], self.__geography['fullAddress'], params)
         )
-        n_listings = 0
         page = 1
         data_cache = {}
         while pagination.get('hasNextPage'):
@@ -48,13 +70,19 @@ class AirbnbSearchScraper(AirbnbScraperInterface):
                 if listing_id in self.__ids_seen:
                     self.__logger.info('Duplicate listing: {}'.format(listing_id))
                     continue  # skip duplicates
+                try:
+                    with deadline(self.__listing_deadline):
+                        reviews = self.__reviews.get_reviews(listing_id)
+                        listing = self.__pdp.get_listing(listing_id, data_cache, self.__geography, reviews)
+                except DeadlineExceededException:
+                    self.__logger.warning('{}: listing not complete within {}s, skipping it'.format(
+                        listing_id, self.__listing_deadline))
+                    continue
                 self.__ids_seen.add(listing_id)
-                n_listings += 1
-                reviews = self.__reviews.get_reviews(listing_id)
-                listing = self.__pdp.get_listing(listing_id, data_cache, self.__geography, reviews)
+                self.__n_listings += 1
 
                 msg = '{:>4} {:<12} {:>12} {:<5}{:<9}{} {:<1} {} ({})'.format(
-                    '#' + str(n_listings),
+                    '#' + str(self.__n_listings),
                     listing['city'],
                     '${} {}'.format(listing['price_rate'], listing['price_rate_type']),
                     str(listing['bedrooms']) + 'br' if listing['bedrooms'] else '0br',
@@ -65,7 +93,7 @@ class AirbnbSearchScraper(AirbnbScraperInterface):
                     listing['url']
                 )
                 self.__logger.info(msg)
-                listings.append(listing)
+                yield listing
 
             self.__add_search_params(params, url)
             items_offset = pagination['itemsOffset']
@@ -74,9 +102,6 @@ class AirbnbSearchScraper(AirbnbScraperInterface):
             data, pagination = self.__explore.search(url)
             page += 1
 
-        self.__persistence.save(query, listings)
-        self.__logger.info('Got data for {} listings.'.format(n_listings))
-
     @staticmethod
     def __add_search_params(params: dict, url: str):
         parsed_qs = parse_qs(urlparse(url).query)
@@ -121,55 +146,151 @@ class AirbnbSearchScraper(AirbnbScraperInterface):
 
 
 class AirbnbCalendarScraper(AirbnbScraperInterface):
-    def __init__(self, calendar: Calendar, persistence: PersistenceInterface, logger: Logger):
+    def __init__(
+            self,
+            calendar: Calendar,
+            persistence: PersistenceInterface,
+            logger: Logger,
+            snapshots: CalendarSnapshotStore = None,
+            listing_deadline: float = None
+    ):
+        """listing_deadline: seconds to get the calendar and pricing of a listing, after which it is abandoned."""
         self.__calendar = calendar
+        self.__listing_deadline = listing_deadline
         self.__logger = logger
         self.__persistence = persistence
+        self.__previous_snapshots = None
+        self.__snapshots = snapshots
+        self.__snapshots_lock = Lock()
+        self.__snapshot_writer = None
 
-    def run(self, source: str, since: str):
-        if source == 'elasticsearch':
-            assert isinstance(self.__persistence, Elastic)
-            for listing_id in self.__persistence.get_all_index_ids(since):
-                self.__update_calendar_and_pricing(listing_id)
+    def run(self, source: str, since: str, workers: int = 1, budget: int = None):
+        if source in ['all', 'elasticsearch']:
+            assert isinstance(self.__persistence, CalendarPersistenceInterface)
+            if budget:
+                scheduler = RefreshScheduler(budget)
+                listing_ids = scheduler.select(self.__persistence.get_refresh_candidates(since))
+                self.__logger.info('Scheduled {} listings for a budget of {} requests.'.format(
+                    len(listing_ids), budget))
+                listing_ids = self.__within_budget(listing_ids, budget)
+            else:
+                listing_ids = self.__persistence.get_all_index_ids(since)
+            self.open_snapshots()
+            try:
+                if workers > 1:
+                    n_listings = WorkerPool(workers, self.__logger).run(self.__try_update_listing, listing_ids)
+                    self.__logger.info('Updated calendars for {} listings.'.format(n_listings))
+                else:
+                    for listing_id in listing_ids:
+                        self.__try_update_listing(listing_id)
+            finally:
+                if hasattr(listing_ids, 'close'):
+                    listing_ids.close()  # stop reading listing ids, e.g. from a point in time, when stopped early
+                self.close_snapshots()
         else:  # source is a listing id
-            booking_calendar, min_nights, max_nights = self.__calendar.get_calendar(source)
-            ranges = Calendar.get_date_ranges('available', booking_calendar)
-            return booking_calendar, self.__calendar.get_rate_data(source, ranges, min_nights, max_nights, True)
+            with deadline(self.__listing_deadline):
+                booking_calendar, min_nights, max_nights = self.__calendar.get_calendar(source)
+                ranges = Calendar.get_date_ranges('available', booking_calendar)
+                return booking_calendar, self.__calendar.get_rate_data(source, ranges, min_nights, max_nights, True)
+
+    def __within_budget(self, listing_ids: list, budget: int):
+        """Yield listing ids until the API requests made since have used up the budget.
+
+        Listings already handed out to workers are still updated, so the budget may be overrun by a few listings.
+        """
+        n_requests_before = request_metrics.get_requests()
+        for listing_id in listing_ids:
+            if request_metrics.get_requests() - n_requests_before >= budget:
+                self.__logger.warning('Request budget of {} used up, skipping the remaining listings.'.format(budget))
+                return
+            yield listing_id
+
+    def open_snapshots(self):
+        """Start snapshotting the calendars of updated listings, if snapshots are configured, until closed. Only what
+        changed since the latest snapshot of a listing, taken today or on the latest earlier day, is stored.
+        """
+        if self.__snapshots:
+            with self.__snapshots_lock:
+                self.__snapshot_writer = self.__snapshots.writer()
+                self.__previous_snapshots = self.__snapshots.open_previous_day()
+
+    def close_snapshots(self):
+        with self.__snapshots_lock:
+            if self.__snapshot_writer:
+                self.__snapshot_writer.close()
+                self.__snapshot_writer = None
+            if self.__previous_snapshots:
+                self.__previous_snapshots.close()
+                self.__previous_snapshots = None
 
-    def __update_calendar_and_pricing(self, listing_id):
-        assert isinstance(self.__persistence, Elastic)
+    def __get_snapshots(self) -> tuple:
+        """Get the snapshot writer of today and the snapshots of the latest earlier day, moving on to the next day's
+        snapshots after midnight.
+        """
+        with self.__snapshots_lock:
+            if self.__snapshot_writer and self.__snapshot_writer.date != date.today():
+                self.__snapshot_writer.close()
+                self.__snapshot_writer = self.__snapshots.writer()
+                # the previous day's snapshots may still be read by other workers, and are closed once released
+                self.__previous_snapshots = self.__snapshots.open_previous_day()
+
+            return self.__snapshot_writer, self.__previous_snapshots
+
+    def update_listing(self, listing_id: str):
+        """Get calendar and pricing of a single listing and store them.
+
+        Raises DeadlineExceededException if the listing takes longer than the listing deadline.
+        """
+        with deadline(self.__listing_deadline):
+            self.__update_listing(listing_id)
+
+    def __try_update_listing(self, listing_id: str):
+        """Update listing, or skip it once its deadline is exceeded. It is then left to be updated by a later run."""
+        try:
+            self.update_listing(listing_id)
+        except DeadlineExceededException:
+            self.__logger.warning('{}: calendar and pricing not complete within {}s, skipping listing'.format(
+                listing_id, self.__listing_deadline))
+
+    def __update_listing(self, listing_id: str):
+        assert isinstance(self.__persistence, CalendarPersistenceInterface)
         self.__logger.info(listing_id + ': getting pricing and calendar data...')
         try:
             calendar, min_nights, max_nights = self.__calendar.get_calendar(listing_id)
-            assert isinstance(calendar, dict)
-            for date_range in Calendar.get_date_ranges('booked', calendar):
+            assert isinstance(calendar, BookingCalendar)
+            for date_range in calendar.get_ranges('booked'):
                 if date_range['length'] > 62:
                     # assume 62+ night bookings not real and remove them from booking calendar
-                    booking_dates = [(date_range['start'] + timedelta(days=i)).strftime('%Y-%m-%d')
-                                     for i in range(date_range['length'])]
-                    calendar = {dt: calendar[dt] for dt in sorted(set(calendar) - set(booking_dates))}
+                    calendar = calendar.without(date_range['start'], date_range['length'])
                 elif date_range['length'] > 50:
                     self.__logger.warning('{}: {} day booking'.format(listing_id, date_range['length']))
 
-            self.__persistence.update_calendar(listing_id, calendar)
-            ranges = Calendar.get_date_ranges('available', calendar)
+            ranges = calendar.get_ranges('available')
             pricing_doc = self.__calendar.get_rate_data(listing_id, ranges, min_nights, max_nights)
             if not pricing_doc:
                 self.__logger.warning('Could not get any pricing data for {}'.format(listing_id))
-                return
-            self.__persistence.update_pricing(listing_id, pricing_doc, min_nights, max_nights)
+            snapshot_writer, previous_snapshots = self.__get_snapshots()
+            previous = snapshot_writer.get(listing_id) if snapshot_writer else None
+            if previous is None and previous_snapshots:
+                previous = previous_snapshots.get(listing_id)
+            with stage_timer.stage('persistence'):
+                self.__persistence.update_calendar(
+                    listing_id, calendar, pricing_doc, min_nights, max_nights, previous)
+            if snapshot_writer:  # snapshot what was stored, to be diffed against by later refreshes
+                snapshot_writer.add(listing_id, calendar)
         except ForbiddenException:
             if self.__exists_listing(listing_id):
                 raise RuntimeError('Could not get listing calendar for existing listing %s' % listing_id)
             else:
                 self.__logger.warning('GONE: deleting listing id {}'.format(listing_id))
-                self.__persistence.mark_deleted(listing_id)
+                with stage_timer.stage('persistence'):
+                    self.__persistence.mark_deleted(listing_id)
 
     @staticmethod
     def __exists_listing(listing_id):
         # check if listing still exists
         url = BaseEndpoint.build_airbnb_url('/rooms/{}'.format(listing_id))
-        response = requests.get(url)
+        response = requests.get(url, timeout=clip_timeout(BaseEndpoint.get_timeout('rooms')))
 
         if response.status_code == 200:  # OK
             return True
@@ -0,0 +1,97 @@
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from logging import Logger
+
+from stl.endpoint.pdp import Pdp
+from stl.endpoint.reviews import Reviews
+from stl.metrics.stage_timer import stage_timer
+from stl.persistence import PersistenceInterface
+from stl.persistence.response_archive import ResponseArchive
+from stl.scraper.airbnb_scraper import AirbnbScraperInterface
+
+_pdp = None
+
+
+def _reparse_listing(entry: tuple) -> dict | None:
+    """Re-parse an archived PDP response along with its archived reviews. Runs in a worker process."""
+    global _pdp
+    if _pdp is None:
+        _pdp = Pdp(None, None, logging.getLogger(__name__))
+
+    listing_id, pdp_location, review_locations = entry
+    record = ResponseArchive.read(*pdp_location)
+
+    # reviews are requested right before the listing, in batches: keep the last run of batches, which starts at the
+    # most recent first batch
+    review_records = []
+    for review_location in reversed(review_locations):
+        review_record = ResponseArchive.read(*review_location)
+        review_records.append(review_record)
+        if not review_record['context'].get('offset'):
+            break
+    reviews = []
+    for review_record in reversed(review_records):
+        r, _ = Reviews.parse_reviews(review_record['response'])
+        reviews.extend(r)
+
+    try:
+        return _pdp.parse_listing(
+            listing_id,
+            record['response'],
+            record['context']['listing'],
+            record['context']['geography'],
+            reviews,
+            datetime.fromisoformat(record['scraped_at'])
+        )
+    except (KeyError, TypeError) as e:
+        logging.getLogger(__name__).warning('Could not re-parse listing {}: {!r}'.format(listing_id, e))
+        return None
+
+
+class ArchiveReparser(AirbnbScraperInterface):
+    """Regenerate normalized listings from archived raw responses, without making any API requests."""
+
+    def __init__(self, archive: ResponseArchive, persistence: PersistenceInterface, logger: Logger, workers: int = 1):
+        self.__archive = archive
+        self.__logger = logger
+        self.__persistence = persistence
+        self.__workers = max(1, workers)
+
+    def run(self, query: str):
+        entries = self.__get_entries()
+        self.__logger.info('Re-parsing {} archived listings with {} workers'.format(len(entries), self.__workers))
+        with stage_timer.stage('persistence'):
+            self.__persistence.save(query, self.__iter_listings(entries))
+
+    def __get_entries(self) -> list:
+        """Pair the latest archived PDP response of each listing with the review batches archived before it."""
+        pdp_locations = {}
+        for listing_id, scraped_at, *location in self.__archive.iter_index('PdpPlatformSections'):
+            if listing_id not in pdp_locations or scraped_at >= pdp_locations[listing_id][0]:
+                pdp_locations[listing_id] = (scraped_at, tuple(location))
+
+        review_records = {}
+        for listing_id, scraped_at, *location in self.__archive.iter_index('PdpReviews'):
+            if listing_id in pdp_locations:
+                review_records.setdefault(listing_id, []).append((scraped_at, tuple(location)))
+
+        entries = []
+        for listing_id, (pdp_scraped_at, pdp_location) in pdp_locations.items():
+            batches = sorted(r for r in review_records.get(listing_id, []) if r[0] <= pdp_scraped_at)
+            entries.append((listing_id, pdp_location, [location for _, location in batches]))
+
+        return entries
+
+    def __iter_listings(self, entries: list):
+        n_listings = n_failed = 0
+        with ProcessPoolExecutor(self.__workers) as executor:
+            for listing in executor.map(_reparse_listing, entries, chunksize=16):
+                if listing is None:
+                    n_failed += 1
+                    continue
+                n_listings += 1
+                yield listing
+
+        self.__logger.info('Re-parsed {} listings ({} failed).'.format(n_listings, n_failed))
@@ -0,0 +1,82 @@
+import heapq
+import math
+
+from datetime import datetime, timezone
+from typing import Iterable
+
+from stl.endpoint.calendar import Calendar
+
+
+class RefreshScheduler:
+    """Rank listings by calendar refresh priority and select as many as fit into a per-run request budget.
+
+    Priority grows with the time since the last update, scaled by how likely the calendar is to have changed: how often
+    it changed in past refreshes, how soon its next available date is, and how active (reviewed) the listing is.
+    Dormant listings are therefore not refreshed as often, but are never starved forever.
+
+    The requests a listing takes are estimated from its minimum and maximum nights: one calendar request plus a pricing
+    probe per length of stay tested.
+    """
+    ACTIVITY_WEIGHT = 0.25
+    DEFAULT_STALENESS_DAYS = 30  # assumed staleness of listings that were never updated
+    MAX_REVIEW_COUNT = 500  # review count at which a listing counts as fully active
+    PROXIMITY_HORIZON_DAYS = 14
+    PROXIMITY_WEIGHT = 0.5
+    DEFAULT_MAX_NIGHTS = 1125  # Airbnb's default, assumed for listings that were never priced
+    MIN_REQUESTS_PER_LISTING = 2  # one calendar request plus at least one pricing probe
+
+    def __init__(self, budget: int, now: datetime = None):
+        self.__budget = budget
+        self.__now = self.__parse_datetime(now) or datetime.utcnow()
+
+    def get_priority(self, candidate: dict) -> float:
+        """Get refresh priority of a candidate listing: higher is more urgent."""
+        updated_at = self.__parse_datetime(candidate.get('updated_at'))
+        staleness = (self.__now - updated_at).total_seconds() / 86400 if updated_at else self.DEFAULT_STALENESS_DAYS
+
+        # Laplace smoothing, so that listings without history start out at a change rate of 0.5
+        volatility = ((candidate.get('calendar_changes') or 0) + 1) / ((candidate.get('calendar_refreshes') or 0) + 2)
+
+        proximity = 0
+        next_available = self.__parse_datetime(candidate.get('next_available'))
+        if next_available:
+            days_until = (next_available - self.__now).total_seconds() / 86400
+            proximity = max(0.0, 1 - max(0.0, days_until) / self.PROXIMITY_HORIZON_DAYS)
+
+        activity = min(1.0, math.log1p(candidate.get('review_count') or 0) / math.log1p(self.MAX_REVIEW_COUNT))
+
+        return max(0.0, staleness) * (
+            volatility + self.PROXIMITY_WEIGHT * proximity + self.ACTIVITY_WEIGHT * activity
+        )
+
+    def get_requests(self, candidate: dict) -> int:
+        """Estimate the number of API requests to refresh a candidate listing."""
+        test_lengths = Calendar.get_test_lengths(
+            candidate.get('nights_max') or self.DEFAULT_MAX_NIGHTS, candidate.get('nights_min') or 1)
+        return 1 + max(1, len(test_lengths))
+
+    def select(self, candidates: Iterable[dict]) -> list:
+        """Get the ids of the highest priority candidates whose estimated requests fit into the budget, highest
+        priority first.
+        """
+        n_candidates = self.__budget // self.MIN_REQUESTS_PER_LISTING
+        listing_ids = []
+        n_requests = 0
+        for candidate in heapq.nlargest(n_candidates, candidates, key=self.get_priority):
+            n_requests += self.get_requests(candidate)
+            if n_requests > self.__budget:
+                break
+            listing_ids.append(candidate['id'])
+
+        return listing_ids
+
+    @staticmethod
+    def __parse_datetime(value) -> datetime | None:
+        """Parse a datetime or ISO 8601 string as a naive UTC datetime."""
+        if not value:
+            return None
+        if not isinstance(value, datetime):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
@@ -0,0 +1,175 @@
+import itertools
+import json
+
+from collections import OrderedDict
+from datetime import datetime
+from logging import Logger
+from threading import Condition, Thread
+from typing import Callable
+
+
+class Job:
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, job_id: int, command: str, args: dict):
+        self.args = args
+        self.command = command
+        self.created_at = datetime.utcnow()
+        self.error = None
+        self.finished_at = None
+        self.id = job_id
+        self.key = Job.get_key(args)
+        self.result = None
+        self.started_at = None
+        self.status = Job.QUEUED
+        self.submissions = 1
+
+    @staticmethod
+    def get_key(args: dict) -> str:
+        """Get key identifying jobs with the same arguments."""
+        return json.dumps(args, sort_keys=True)
+
+    def to_dict(self) -> dict:
+        return {
+            'id':          self.id,
+            'command':     self.command,
+            'args':        self.args,
+            'status':      self.status,
+            'submissions': self.submissions,
+            'created_at':  self.created_at.isoformat(),
+            'started_at':  self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'result':      self.result,
+            'error':       self.error,
+        }
+
+
+class JobQueue:
+    """Run submitted jobs on a fixed number of worker threads.
+
+    At most `limits[command]` jobs of a command run at the same time (unlimited if not given), so e.g. a long
+    `calendar --all` job cannot occupy every worker. A job identical to one that is still queued or running is not
+    queued again: the existing job is returned instead. Finished jobs are kept until there are more than
+    `max_finished` of them.
+    """
+
+    def __init__(
+            self,
+            run: Callable[[Job], str | None],
+            logger: Logger,
+            workers: int = 1,
+            limits: dict = None,
+            max_queued: int = 100,
+            max_finished: int = 1000
+    ):
+        self.__condition = Condition()
+        self.__ids = itertools.count(1)
+        self.__jobs = OrderedDict()
+        self.__limits = limits or {}
+        self.__logger = logger
+        self.__max_finished = max_finished
+        self.__max_queued = max_queued
+        self.__run = run
+        self.__running = {}
+        self.__started_at = datetime.utcnow()
+        self.__stopped = False
+        self.__threads = [
+            Thread(target=self.__work, name='stl-job-worker-{}'.format(i), daemon=True) for i in range(workers)
+        ]
+        for thread in self.__threads:
+            thread.start()
+
+    def get(self, job_id: int) -> Job | None:
+        with self.__condition:
+            return self.__jobs.get(job_id)
+
+    def get_jobs(self) -> list:
+        with self.__condition:
+            return list(self.__jobs.values())
+
+    def get_status(self) -> dict:
+        with self.__condition:
+            counts = {status: 0 for status in [Job.QUEUED, Job.RUNNING, Job.DONE, Job.FAILED]}
+            for job in self.__jobs.values():
+                counts[job.status] += 1
+
+            return {
+                'started_at': self.__started_at.isoformat(),
+                'workers':    len(self.__threads),
+                'limits':     self.__limits,
+                'running':    {command: n for command, n in self.__running.items() if n},
+                'jobs':       counts,
+            }
+
+    def stop(self):
+        """Stop accepting jobs and wait for running jobs to finish. Queued jobs are not run."""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+
+    def submit(self, command: str, args: dict) -> Job:
+        """Queue a job, or get the identical job that is already queued or running."""
+        with self.__condition:
+            if self.__stopped:
+                raise RuntimeError('Job queue is stopped')
+            key = Job.get_key(args)
+            for existing in self.__jobs.values():
+                if existing.key == key and existing.status in [Job.QUEUED, Job.RUNNING]:
+                    existing.submissions += 1
+                    return existing
+            if sum(1 for j in self.__jobs.values() if j.status == Job.QUEUED) >= self.__max_queued:
+                raise OverflowError('Job queue is full')
+
+            job = Job(next(self.__ids), command, args)
+            self.__jobs[job.id] = job
+            self.__condition.notify_all()
+
+            return job
+
+    def wait(self, job: Job, timeout: float) -> bool:
+        """Wait up to timeout seconds for job to finish, return whether it has finished."""
+        with self.__condition:
+            return self.__condition.wait_for(lambda: job.status in [Job.DONE, Job.FAILED], timeout)
+
+    def __next_job(self) -> Job | None:
+        """Wait for a queued job whose command is below its concurrency limit, and mark it as running."""
+        with self.__condition:
+            while not self.__stopped:
+                for job in self.__jobs.values():
+                    if job.status != Job.QUEUED:
+                        continue
+                    if self.__running.get(job.command, 0) >= self.__limits.get(job.command, len(self.__threads)):
+                        continue
+                    job.status = Job.RUNNING
+                    job.started_at = datetime.utcnow()
+                    self.__running[job.command] = self.__running.get(job.command, 0) + 1
+                    return job
+                self.__condition.wait()
+
+            return None
+
+    def __work(self):
+        while True:
+            job = self.__next_job()
+            if job is None:
+                return
+            self.__logger.info('Running job {}: {}'.format(job.id, job.key))
+            try:
+                result, error, status = self.__run(job), None, Job.DONE
+            except BaseException as e:  # includes SystemExit raised by commands that exit on errors
+                result, error, status = None, repr(e), Job.FAILED
+                self.__logger.error('Job {} failed: {}'.format(job.id, error))
+
+            with self.__condition:
+                job.error, job.result, job.status = error, result, status
+                job.finished_at = datetime.utcnow()
+                self.__running[job.command] -= 1
+                finished = [j.id for j in self.__jobs.values() if j.status in [Job.DONE, Job.FAILED]]
+                for job_id in finished[:max(0, len(finished) - self.__max_finished)]:
+                    del self.__jobs[job_id]
+                self.__condition.notify_all()
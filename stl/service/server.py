@@ -0,0 +1,138 @@
+import json
+import os
+
+from docopt import docopt, DocoptExit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import Logger
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+from stl.command.stl_command import StlCommand
+from stl.metrics.request_metrics import request_metrics
+from stl.service.job_queue import JobQueue
+
+
+class StlServer:
+    """Local HTTP API to submit STL commands as jobs to a resident service.
+
+    Endpoints:
+        POST /jobs        Submit a job: {"argv": ["pricing", "<listingId>", "--checkin=..."], "wait": 30}. Arguments are
+                          those of stl.py. With "wait", respond once the job has finished or after "wait" seconds.
+        GET  /jobs        List jobs.
+        GET  /jobs/<id>   Get a job and its result. Supports ?wait=<seconds>.
+        GET  /status      Get workers, concurrency limits and the number of jobs per status.
+        GET  /metrics     Get API request metrics in the Prometheus text format. With ?format=json, get totals and
+                          latency quantiles per API operation instead.
+    """
+    COMMANDS = ['search', 'calendar', 'pricing', 'data', 'reparse']
+
+    def __init__(self, job_queue: JobQueue, logger: Logger):
+        self.__job_queue = job_queue
+        self.__logger = logger
+        self.__server = None
+
+    def serve(self, host: str = '127.0.0.1', port: int = 8765, socket_path: str = None):
+        """Serve requests until shutdown() is called, on a Unix socket if socket_path is given."""
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.__server = _ThreadingUnixHTTPServer(socket_path, _RequestHandler)
+            address = socket_path
+        else:
+            self.__server = ThreadingHTTPServer((host, port), _RequestHandler)
+            address = 'http://{}:{}'.format(host, port)
+        self.__server.stl = self
+        self.__logger.warning('Serving STL jobs on {}'.format(address))
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.__server.server_close()
+            if socket_path and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+    def shutdown(self):
+        """Stop serving requests. Must not be called from the thread running serve()."""
+        if self.__server is not None:
+            self.__server.shutdown()
+
+    def handle(self, method: str, url: str, body: dict) -> tuple:
+        """Handle API request, return (HTTP status, response)."""
+        path = urlparse(url).path.rstrip('/')
+        query = parse_qs(urlparse(url).query)
+        if method == 'GET' and path == '/status':
+            return 200, self.__job_queue.get_status()
+        if method == 'GET' and path == '/metrics':
+            if query.get('format') == ['json']:
+                return 200, request_metrics.get_report()
+            return 200, request_metrics.format_prometheus()
+        if method == 'GET' and path == '/jobs':
+            return 200, [job.to_dict() for job in self.__job_queue.get_jobs()]
+        if method == 'GET' and path.startswith('/jobs/'):
+            job_id = path[len('/jobs/'):]
+            job = self.__job_queue.get(int(job_id)) if job_id.isdigit() else None
+            if job is None:
+                return 404, {'error': 'Job not found'}
+            if query.get('wait'):
+                self.__job_queue.wait(job, float(query['wait'][0]))
+            return 200, job.to_dict()
+        if method == 'POST' and path == '/jobs':
+            return self.__submit(body)
+
+        return 404, {'error': 'Not found'}
+
+    def __submit(self, body: dict) -> tuple:
+        argv = body.get('argv')
+        if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+            return 400, {'error': '"argv" must be a list of strings'}
+        try:
+            args = docopt(StlCommand.__doc__, argv, help=False)
+        except DocoptExit as e:
+            return 400, {'error': str(e)}
+        command = next((c for c in self.COMMANDS if args.get(c)), None)
+        if command is None:
+            return 400, {'error': 'Command must be one of: {}'.format(', '.join(self.COMMANDS))}
+
+        try:
+            job = self.__job_queue.submit(command, args)
+        except (OverflowError, RuntimeError) as e:
+            return 503, {'error': str(e)}
+        if body.get('wait'):
+            finished = self.__job_queue.wait(job, float(body['wait']))
+            return (200 if finished else 202), job.to_dict()
+
+        return 202, job.to_dict()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.__respond(*self.server.stl.handle('GET', self.path, {}))
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        except ValueError:
+            return self.__respond(400, {'error': 'Invalid JSON body'})
+        if not isinstance(body, dict):
+            return self.__respond(400, {'error': 'JSON body must be an object'})
+        self.__respond(*self.server.stl.handle('POST', self.path, body))
+
+    def log_message(self, format: str, *args):
+        pass  # jobs are logged by the job queue
+
+    def __respond(self, status: int, data):
+        """Respond with data as JSON, or as plain text if it is a string."""
+        if isinstance(data, str):
+            content = data.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            content = json.dumps(data, default=str).encode('utf-8')
+            content_type = 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
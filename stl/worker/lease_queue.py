@@ -0,0 +1,173 @@
+import sqlite3
+
+from threading import Lock
+from time import time
+from typing import Iterable
+
+
+class LeaseQueue:
+    """Work queue in a SQLite database file, shared by any number of worker processes.
+
+    Workers lease tasks for `lease_seconds` and keep their leases alive with heartbeats. A task whose lease expires,
+    e.g. because its worker crashed, is handed out again. A task that failed or whose lease expired `max_attempts`
+    times is marked as failed. Identical tasks are only queued once while pending.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id            INTEGER PRIMARY KEY,
+            queue         TEXT NOT NULL,
+            payload       TEXT NOT NULL,
+            status        TEXT NOT NULL DEFAULT 'queued',
+            attempts      INTEGER NOT NULL DEFAULT 0,
+            available_at  REAL NOT NULL,
+            leased_by     TEXT,
+            lease_expires REAL,
+            last_error    TEXT,
+            updated_at    REAL NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS tasks_pending_payload ON tasks (queue, payload)
+            WHERE status IN ('queued', 'leased');
+        CREATE INDEX IF NOT EXISTS tasks_queue_status ON tasks (queue, status, available_at);
+    """
+    QUEUED = 'queued'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, db_path: str, lease_seconds: float = 300, max_attempts: int = 3, retry_seconds: float = 60):
+        self.__conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.__conn.execute('PRAGMA journal_mode = WAL')
+        self.__conn.execute('PRAGMA synchronous = NORMAL')
+        self.__conn.executescript(self.SCHEMA)
+        self.__lease_seconds = lease_seconds
+        self.__lock = Lock()
+        self.__max_attempts = max_attempts
+        self.__retry_seconds = retry_seconds
+
+    def ack(self, task_id: int, worker_id: str) -> bool:
+        """Mark leased task as done. Returns False if the lease was lost to another worker."""
+        return self.__finish(task_id, worker_id, self.DONE, None)
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+    def enqueue(self, queue: str, payloads: Iterable[str], batch_size: int = 1000) -> int:
+        """Queue tasks, skipping any identical to a pending task. Returns the number of tasks queued."""
+        n_queued = 0
+        batch = []
+        for payload in payloads:
+            batch.append(payload)
+            if len(batch) >= batch_size:
+                n_queued += self.__insert(queue, batch)
+                batch = []
+        n_queued += self.__insert(queue, batch)
+
+        return n_queued
+
+    def get_counts(self, queue: str) -> dict:
+        """Get number of tasks per status."""
+        counts = {status: 0 for status in [self.QUEUED, self.LEASED, self.DONE, self.FAILED]}
+        with self.__lock:
+            rows = self.__conn.execute(
+                'SELECT status, COUNT(*) FROM tasks WHERE queue = ? GROUP BY status', (queue,)).fetchall()
+        counts.update(dict(rows))
+
+        return counts
+
+    def is_drained(self, queue: str) -> bool:
+        """Whether no task is queued (including retries that are not due yet) or leased. A leased task may still come
+        back for a retry, once it fails or its lease expires.
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                'SELECT 1 FROM tasks WHERE queue = ? AND status IN (?, ?) LIMIT 1', (queue, self.QUEUED, self.LEASED)
+            ).fetchone()
+
+        return row is None
+
+    def heartbeat(self, task_ids: list, worker_id: str):
+        """Extend leases of tasks still held by worker."""
+        if not task_ids:
+            return
+        with self.__lock:
+            self.__conn.execute(
+                'UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE id IN ({}) AND status = ? AND leased_by = ?'
+                .format(','.join('?' * len(task_ids))),
+                [time() + self.__lease_seconds, time()] + list(task_ids) + [self.LEASED, worker_id]
+            )
+
+    def lease(self, queue: str, worker_id: str, n: int = 1) -> list:
+        """Lease up to n available tasks, as dicts with id, payload and attempts."""
+        now = time()
+        with self.__lock:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            try:
+                # give up on tasks whose lease expired too many times
+                self.__conn.execute(
+                    'UPDATE tasks SET status = ?, last_error = ?, updated_at = ? '
+                    'WHERE queue = ? AND status = ? AND lease_expires < ? AND attempts >= ?',
+                    (self.FAILED, 'Lease expired', now, queue, self.LEASED, now, self.__max_attempts)
+                )
+                rows = self.__conn.execute(
+                    'SELECT id, payload, attempts FROM tasks '
+                    'WHERE queue = ? AND ((status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?)) '
+                    'ORDER BY available_at, id LIMIT ?',
+                    (queue, self.QUEUED, now, self.LEASED, now, n)
+                ).fetchall()
+                self.__conn.executemany(
+                    'UPDATE tasks SET status = ?, leased_by = ?, lease_expires = ?, attempts = attempts + 1, '
+                    'updated_at = ? WHERE id = ?',
+                    [(self.LEASED, worker_id, now + self.__lease_seconds, now, row[0]) for row in rows]
+                )
+            except BaseException:
+                self.__conn.execute('ROLLBACK')
+                raise
+            self.__conn.execute('COMMIT')
+
+        return [{'id': task_id, 'payload': payload, 'attempts': attempts + 1} for task_id, payload, attempts in rows]
+
+    def nack(self, task_id: int, worker_id: str, error: str) -> bool:
+        """Release failed task for a retry after a delay, or mark it as failed once out of attempts."""
+        with self.__lock:
+            row = self.__conn.execute('SELECT attempts FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        if row and row[0] >= self.__max_attempts:
+            return self.__finish(task_id, worker_id, self.FAILED, error)
+
+        with self.__lock:
+            cursor = self.__conn.execute(
+                'UPDATE tasks SET status = ?, available_at = ?, leased_by = NULL, lease_expires = NULL, '
+                'last_error = ?, updated_at = ? WHERE id = ? AND status = ? AND leased_by = ?',
+                (self.QUEUED, time() + self.__retry_seconds * (row[0] if row else 1), error, time(), task_id,
+                 self.LEASED, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def __finish(self, task_id: int, worker_id: str, status: str, error: str | None) -> bool:
+        with self.__lock:
+            cursor = self.__conn.execute(
+                'UPDATE tasks SET status = ?, last_error = ?, leased_by = NULL, lease_expires = NULL, updated_at = ? '
+                'WHERE id = ? AND status = ? AND leased_by = ?',
+                (status, error, time(), task_id, self.LEASED, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def __insert(self, queue: str, payloads: list) -> int:
+        if not payloads:
+            return 0
+        now = time()
+        with self.__lock:
+            self.__conn.execute('BEGIN IMMEDIATE')
+            try:
+                n_before = self.__conn.total_changes
+                self.__conn.executemany(
+                    'INSERT OR IGNORE INTO tasks (queue, payload, available_at, updated_at) VALUES (?, ?, ?, ?)',
+                    [(queue, payload, now, now) for payload in payloads]
+                )
+                n_queued = self.__conn.total_changes - n_before
+            except BaseException:
+                self.__conn.execute('ROLLBACK')
+                raise
+            self.__conn.execute('COMMIT')
+
+        return n_queued
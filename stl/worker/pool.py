@@ -0,0 +1,74 @@
+from logging import Logger
+from queue import Queue
+from threading import Event, Lock, Thread
+from typing import Callable, Iterable
+
+
+class WorkerPool:
+    """Process items from a (possibly lazy) iterable using a fixed number of worker threads.
+
+    Items are handed to the workers through a bounded queue, so the source is only consumed as fast as the workers
+    can keep up with it. This allows e.g. an Elasticsearch scroll to be fed straight into the pool without reading the
+    whole result set into memory first.
+    """
+    __STOP = object()
+
+    def __init__(self, workers: int, logger: Logger, queue_size: int = None):
+        if workers < 1:
+            raise ValueError('workers must be >= 1')
+        self.__logger = logger
+        self.__queue_size = queue_size or workers * 2
+        self.__workers = workers
+
+    def run(self, func: Callable, items: Iterable) -> int:
+        """Call func(item) for each item and return the number of items processed.
+
+        After the first error no new items are handed out. The error is re-raised once all workers have stopped.
+        """
+        queue = Queue(maxsize=self.__queue_size)
+        stop = Event()
+        lock = Lock()
+        errors = []
+        n_processed = 0
+
+        def work():
+            nonlocal n_processed
+            while True:
+                item = queue.get()
+                try:
+                    if item is self.__STOP:
+                        return
+                    if stop.is_set():
+                        continue  # drain remaining items after an error
+                    func(item)
+                    with lock:
+                        n_processed += 1
+                except BaseException as e:
+                    errors.append(e)
+                    stop.set()
+                finally:
+                    queue.task_done()
+
+        threads = [Thread(target=work, name='stl-worker-{}'.format(i), daemon=True) for i in range(self.__workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                queue.put(item)  # blocks while the queue is full, so the source is not read ahead of the workers
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            for _ in threads:
+                queue.put(self.__STOP)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            self.__logger.error('Worker pool stopped after {} items: {}'.format(n_processed, errors[0]))
+            raise errors[0]
+
+        return n_processed
@@ -0,0 +1,160 @@
+import os
+import socket
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logging import Logger
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable
+
+from stl.worker.lease_queue import LeaseQueue
+
+
+class QueueWorker:
+    """Pull tasks from a lease queue and handle them on a number of threads, acking each task once handled.
+
+    If handlers buffer their writes, `flush` is called before handled tasks are acked: once `ack_batch_size` tasks are
+    handled, once the oldest of them was handled `ack_seconds` ago, or once no task is left to lease. If flush raises,
+    the handled tasks are released for a retry instead.
+
+    Leases of tasks being handled or waiting for an ack are renewed every `heartbeat_seconds`. A task whose handler
+    raises is released for a retry. Unless `wait` is set, the worker stops once no tasks are left queued or leased.
+    """
+
+    def __init__(
+            self,
+            lease_queue: LeaseQueue,
+            queue: str,
+            handle: Callable[[str], None],
+            logger: Logger,
+            concurrency: int = 1,
+            heartbeat_seconds: float = 60,
+            poll_seconds: float = 5,
+            wait: bool = False,
+            flush: Callable[[], None] = None,
+            ack_batch_size: int = 100,
+            ack_seconds: float = 10
+    ):
+        self.__ack_batch_size = ack_batch_size
+        self.__ack_seconds = ack_seconds
+        self.__concurrency = max(1, concurrency)
+        self.__flush = flush
+        self.__handle = handle
+        self.__heartbeat_seconds = heartbeat_seconds
+        self.__lease_queue = lease_queue
+        self.__leased = set()
+        self.__lock = Lock()
+        self.__logger = logger
+        self.__poll_seconds = poll_seconds
+        self.__queue = queue
+        self.__stopped = Event()
+        self.__wait = wait
+        self.worker_id = '{}:{}'.format(socket.gethostname(), os.getpid())
+
+    def run(self) -> dict:
+        """Handle tasks until the queue is drained or until stopped, return tasks done and attempts failed."""
+        heartbeat = Thread(target=self.__send_heartbeats, name='stl-queue-heartbeat', daemon=True)
+        heartbeat.start()
+        counts = {'done': 0, 'failed': 0}
+        futures = {}
+        handled = []  # tasks handled, but not acked yet
+        handled_since = None
+
+        def collect(future):
+            nonlocal handled_since
+            task = futures.pop(future)
+            if not future.result():
+                counts['failed'] += 1
+            elif self.__flush is None:
+                counts['done'] += 1
+            else:
+                handled.append(task)
+                handled_since = handled_since or monotonic()
+
+        try:
+            with ThreadPoolExecutor(self.__concurrency) as executor:
+                while not self.__stopped.is_set():
+                    n_free = self.__concurrency - len(futures)
+                    tasks = self.__lease_queue.lease(self.__queue, self.worker_id, n_free) if n_free else []
+                    for task in tasks:
+                        with self.__lock:
+                            self.__leased.add(task['id'])
+                        futures[executor.submit(self.__handle_task, task)] = task
+                    if not futures:
+                        if handled:  # no tasks left to lease for now
+                            self.__flush_and_ack(handled, counts)
+                            handled.clear()
+                            handled_since = None
+                        if not self.__wait and self.__lease_queue.is_drained(self.__queue):
+                            break
+                        self.__stopped.wait(self.__poll_seconds)
+                        continue
+
+                    done, _ = wait(futures, timeout=self.__poll_seconds, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+                    if handled and (
+                            len(handled) >= self.__ack_batch_size or monotonic() - handled_since >= self.__ack_seconds
+                    ):
+                        self.__flush_and_ack(handled, counts)
+                        handled.clear()
+                        handled_since = None
+                for future in list(futures):  # wait for tasks in progress when stopped
+                    collect(future)
+                if handled:
+                    self.__flush_and_ack(handled, counts)
+        finally:
+            self.__stopped.set()
+            heartbeat.join()
+
+        self.__logger.info('Worker {} finished: {} tasks done, {} attempts failed.'.format(
+            self.worker_id, counts['done'], counts['failed']))
+        return counts
+
+    def stop(self):
+        """Stop leasing new tasks. Tasks in progress are finished."""
+        self.__stopped.set()
+
+    def __flush_and_ack(self, tasks: list, counts: dict):
+        """Flush the writes of handled tasks, then ack them. Release them for a retry if the flush fails."""
+        try:
+            self.__flush()
+        except Exception as e:
+            self.__logger.error('Flushing writes of {} tasks failed: {!r}'.format(len(tasks), e))
+            for task in tasks:
+                self.__lease_queue.nack(task['id'], self.worker_id, repr(e))
+                self.__release(task)
+            counts['failed'] += len(tasks)
+            return
+
+        for task in tasks:
+            self.__lease_queue.ack(task['id'], self.worker_id)
+            self.__release(task)
+        counts['done'] += len(tasks)
+
+    def __handle_task(self, task: dict) -> bool:
+        """Handle task. Ack it, unless acks wait for a flush. Release it for a retry if the handler raises."""
+        try:
+            self.__handle(task['payload'])
+        except Exception as e:
+            self.__logger.error('Task {} ({}) failed on attempt {}: {!r}'.format(
+                task['id'], task['payload'], task['attempts'], e))
+            self.__lease_queue.nack(task['id'], self.worker_id, repr(e))
+            self.__release(task)
+            return False
+
+        if self.__flush is None:
+            self.__lease_queue.ack(task['id'], self.worker_id)
+            self.__release(task)
+        return True
+
+    def __release(self, task: dict):
+        """Stop renewing the lease of a task."""
+        with self.__lock:
+            self.__leased.discard(task['id'])
+
+    def __send_heartbeats(self):
+        while not self.__stopped.wait(self.__heartbeat_seconds):
+            with self.__lock:
+                task_ids = list(self.__leased)
+            self.__lease_queue.heartbeat(task_ids, self.worker_id)